@@ -0,0 +1,179 @@
+"""Risk and return metrics for a portfolio, computed in one pass over aligned NumPy arrays.
+
+Positions and close prices are laid out as (trading day x symbol) matrices, so every metric
+is array arithmetic however many symbols or years the portfolio spans. The portfolio has no
+cash account: each purchase counts as money added and each sale as money taken out.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+
+TRADING_DAYS = 252
+BENCHMARK = "SPY"
+RISK_FREE_RATE = 0.04
+
+
+def _clean(value, digits=6):
+    """Round a metric for JSON, turning NaN/inf/None into None."""
+    if value is None or not math.isfinite(value):
+        return None
+    return round(float(value), digits)
+
+
+def _close_frame(historical_prices, symbols):
+    """Closes of symbols as a (date x symbol) frame; a zero or missing close counts as no price."""
+    series = {}
+    for symbol in symbols:
+        s = pd.Series(historical_prices.get(symbol) or {}, dtype="float64")
+        s.index = pd.to_datetime(s.index)
+        series[symbol] = s[s > 0]
+    return pd.DataFrame(series, columns=symbols).sort_index()
+
+
+def _align(frame, days):
+    """frame's closes on days, carrying the last close forward (and the first one back)."""
+    return frame.reindex(frame.index.union(days)).ffill().reindex(days).bfill().to_numpy()
+
+
+def xirr(amounts, years, low=-0.99, high=10.0, tolerance=1e-10):
+    """Annual rate at which amounts received at years (from the first flow) have zero net present value.
+
+    Solved by bisection on the vectorized NPV; None when the flows do not change sign over the bracket.
+    """
+    def npv(rate):
+        return float(np.sum(amounts * np.power(1.0 + rate, -years)))
+
+    npv_low, npv_high = npv(low), npv(high)
+    if not (math.isfinite(npv_low) and math.isfinite(npv_high)) or npv_low * npv_high > 0:
+        return None
+    for _ in range(200):
+        mid = (low + high) / 2
+        npv_mid = npv(mid)
+        if abs(npv_mid) < tolerance or high - low < tolerance:
+            break
+        if npv_low * npv_mid < 0:
+            high = mid
+        else:
+            low, npv_low = mid, npv_mid
+    return mid
+
+
+def portfolio_metrics(transactions, historical_prices, benchmark_prices=None, risk_free_rate=RISK_FREE_RATE,
+                      rates=None, benchmark_rates=None):
+    """Compute return and risk metrics from a user's transactions.
+
+    transactions are rows with symbol, shares, price and date ('YYYY-MM-DD'); historical_prices
+    maps symbol -> {date: close} and benchmark_prices is the benchmark's {date: close}. rates is
+    an optional (date x symbol) frame of daily factors into the base currency, as from
+    fx.rate_history(), and benchmark_rates the benchmark's daily factors as a Series; without
+    them every price is taken as already in one currency.
+
+    Returns time- and money-weighted returns, annualized volatility and Sharpe ratio of the
+    daily time-weighted returns, maximum drawdown, beta against the benchmark, and the
+    correlation matrix of the daily returns of the symbols currently held. A metric that
+    cannot be computed (e.g. too little history) is None.
+    """
+    metrics = {
+        "start": None, "end": None, "days": 0,
+        "twr": None, "twr_annualized": None, "mwr": None,
+        "volatility": None, "sharpe": None, "max_drawdown": None, "max_drawdown_date": None,
+        "beta": None, "correlation": {"symbols": [], "matrix": []},
+    }
+    tx = pd.DataFrame(transactions, columns=["symbol", "shares", "price", "date"])
+    tx = tx[tx["symbol"].isin([symbol for symbol, prices in historical_prices.items() if prices])]
+    if tx.empty:
+        return metrics
+
+    tx["date"] = pd.to_datetime(tx["date"])
+    symbols = sorted(tx["symbol"].unique())
+    frame = _close_frame(historical_prices, symbols)
+    days = frame.index[frame.index >= tx["date"].min()]
+    if days.empty:
+        return metrics
+
+    # A trade on a non-trading day takes effect on the next trading day; later trades are ignored.
+    row = np.searchsorted(days.to_numpy(), tx["date"].to_numpy())
+    keep = row < len(days)
+    row, col = row[keep], pd.Categorical(tx["symbol"], categories=symbols).codes[keep]
+    shares, amount = tx["shares"].to_numpy("float64")[keep], (tx["shares"] * tx["price"]).to_numpy("float64")[keep]
+    closes = _align(frame, days)
+    if rates is not None:
+        # Trades convert at their own date's rate and closes at each day's, as in portfolio.portfolio_values().
+        rates = rates.reindex(columns=symbols).sort_index()
+        trade_rates = rates.reindex(rates.index.union(pd.DatetimeIndex(tx["date"].unique()))).ffill().bfill()
+        amount = amount * trade_rates.stack().reindex(pd.MultiIndex.from_arrays([tx["date"], tx["symbol"]])).to_numpy()[keep]
+        closes = closes * _align(rates, days)
+
+    deltas = np.zeros((len(days), len(symbols)))
+    np.add.at(deltas, (row, col), shares)
+    holdings = np.clip(deltas.cumsum(axis=0), 0, None)
+    bought, sold = np.zeros(len(days)), np.zeros(len(days))
+    np.add.at(bought, row, np.where(amount > 0, amount, 0.0))
+    np.add.at(sold, row, np.where(amount < 0, -amount, 0.0))
+
+    values = np.nansum(holdings * closes, axis=1)
+
+    # Daily time-weighted return: purchases join at the start of the day, sale proceeds
+    # leave at its end, so neither counts as performance.
+    base = np.concatenate(([0.0], values[:-1])) + bought
+    invested = base > 1e-9
+    with np.errstate(divide="ignore", invalid="ignore"):
+        daily = np.where(invested, (values + sold) / base - 1, 0.0)
+    returns = daily[invested]
+
+    wealth = np.cumprod(1 + daily)
+    years = (days[-1] - days[0]).days / 365.25
+    twr = wealth[-1] - 1
+    metrics.update({
+        "start": days[0].strftime('%Y-%m-%d'),
+        "end": days[-1].strftime('%Y-%m-%d'),
+        "days": int(invested.sum()),
+        "twr": _clean(twr),
+        "twr_annualized": _clean((1 + twr) ** (1 / years) - 1) if years >= 1 else None,
+    })
+
+    # Money-weighted return: the IRR of purchases (out), sales (in) and today's value (in).
+    flows = sold - bought
+    flows[-1] += values[-1]
+    flow_days = np.flatnonzero(flows)
+    if len(flow_days) > 1:
+        flow_years = (days[flow_days] - days[0]).days.to_numpy() / 365.25
+        metrics["mwr"] = _clean(xirr(flows[flow_days], flow_years))
+
+    if len(returns) > 1:
+        volatility = returns.std(ddof=1) * math.sqrt(TRADING_DAYS)
+        metrics["volatility"] = _clean(volatility)
+        if volatility > 0:
+            metrics["sharpe"] = _clean((returns.mean() * TRADING_DAYS - risk_free_rate) / volatility)
+
+    drawdown = wealth / np.maximum.accumulate(wealth) - 1
+    metrics["max_drawdown"] = _clean(drawdown.min())
+    metrics["max_drawdown_date"] = days[int(drawdown.argmin())].strftime('%Y-%m-%d') if drawdown.min() < 0 else None
+
+    if benchmark_prices:
+        benchmark = _align(_close_frame({BENCHMARK: benchmark_prices}, [BENCHMARK]), days)[:, 0]
+        if benchmark_rates is not None:
+            benchmark = benchmark * _align(benchmark_rates.sort_index().to_frame(), days)[:, 0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            benchmark_returns = np.concatenate(([np.nan], benchmark[1:] / benchmark[:-1] - 1))
+        paired = invested & np.isfinite(benchmark_returns)
+        if paired.sum() > 1:
+            variance = benchmark_returns[paired].var(ddof=1)
+            if variance > 0:
+                covariance = np.cov(daily[paired], benchmark_returns[paired])[0, 1]
+                metrics["beta"] = _clean(covariance / variance)
+
+    held = np.flatnonzero((holdings[-1] > 0) & np.isfinite(closes).all(axis=0))
+    if len(held) and len(days) > 2:
+        held_closes = closes[:, held]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            symbol_returns = held_closes[1:] / held_closes[:-1] - 1
+            matrix = np.atleast_2d(np.corrcoef(symbol_returns, rowvar=False))
+        metrics["correlation"] = {
+            "symbols": [symbols[i] for i in held],
+            "matrix": [[_clean(value, 4) for value in matrix_row] for matrix_row in matrix],
+        }
+    return metrics
@@ -1,36 +1,85 @@
+import csv
+import io
 import os
 import json
+import logging
+import sqlite3
+import click
 from cs50 import SQL
-from flask import Flask, flash, redirect, render_template, request, session, jsonify
-from flask_session import Session
+from flask import Flask, Response, flash, redirect, render_template, request, session, jsonify, stream_with_context
 from werkzeug.security import check_password_hash, generate_password_hash
 from datetime import datetime, timedelta, date
 from flask_compress import Compress
 
-from helpers import apology, login_required, lookup, usd, search_symbols, get_historical_data, get_stock_news
+from assets import Assets
+from cache import create_cache
+from database import Database
+import sessions
+from metrics import Instrumentation, TimedSQL
+from fx import BASE_CURRENCIES, FxStore, conversion_rates, rate_history
+from portfolio import growth_series, lot_costs, summarize_holdings
+from snapshots import USER_TRANSACTIONS, growth_from_snapshots, invalidate_snapshots, snapshot_all
+from analytics import BENCHMARK, portfolio_metrics
+from migrations import connect, migrate
+from lots import LOT_METHODS, OPEN_LOT, NotEnoughShares, open_lots, rebuild_ledger, rebuild_ledgers, record_trade
+from price_store import PriceStore
+from price_series import DEFAULT_RANGE, POINT_BUDGET, RANGES, price_series
+from price_stream import FULL_RETRY_AFTER, MAX_SYMBOLS, PriceStream
+from refresher import QuoteRefresher, refresh_once
+from symbol_index import SymbolIndex
+from importer import import_transactions
+
+from helpers import (apology, login_required, lookup, lookup_many, usd, money, search_symbols, get_historical_data,
+                     get_historical_data_many, get_stock_news, history_pool, transaction, encode_cursor, decode_cursor,
+                     listing_currencies)
 
 app = Flask(__name__)
 
+# cs50 sets the root logger to DEBUG; per-call debug lines are opt-in with LOG_LEVEL=DEBUG.
+logging.getLogger().setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+Instrumentation(app,
+                profile_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+                profile_dir=os.environ.get("PROFILE_DIR", "profiles"),
+                token=os.environ.get("METRICS_TOKEN"),
+                allow_loopback=os.environ.get("METRICS_ALLOW_LOOPBACK") == "1")
+
 Compress(app)
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = timedelta(days=365)
-STATIC_VERSION = "v4"
-@app.context_processor
-def inject_static_version():
-    return dict(STATIC_VERSION=STATIC_VERSION)
+# Templates link static files through asset_url(); run `python assets.py` to build them.
+Assets(app)
+
+DATABASE = os.environ.get("DATABASE_PATH", "finance.db")
 
-api_cache = {}
+api_cache = create_cache()
+price_store = PriceStore(DATABASE)
+fx_store = FxStore(DATABASE)
+symbol_index = SymbolIndex(os.environ.get("SYMBOL_INDEX_PATH", "symbols.json"))
+# Each stream holds a worker thread; keep most of the Procfile's 64 threads for ordinary requests.
+PRICE_STREAM_LIMIT = int(os.environ.get("PRICE_STREAM_LIMIT", 32))
+price_stream = PriceStream(api_cache, is_crypto=lambda symbol: symbol_index.asset_type(symbol) == "crypto",
+                           max_streams=PRICE_STREAM_LIMIT)
 
 app.jinja_env.filters["usd"] = usd
+app.jinja_env.filters["money"] = money
 
-app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+SECRET_KEY = os.environ.get("SECRET_KEY")
+sessions.init_app(app, os.environ.get("SESSION_BACKEND", "cookie" if SECRET_KEY else "sqlite"),
+                  secret_key=SECRET_KEY, path=os.environ.get("SESSION_PATH", "sessions.db"))
 
-db = SQL("sqlite:///finance.db")
+migrate(DATABASE)
+# Hot-path routes use the prepared-statement layer; everything else still goes through cs50.
+database = Database(DATABASE)
+db = TimedSQL(SQL(f"sqlite:///{DATABASE}", creator=lambda: connect(DATABASE)))
 
 if not os.environ.get("API_KEY"):
     raise RuntimeError("API_KEY not set")
 
+ANALYTICS_BENCHMARK = os.environ.get("ANALYTICS_BENCHMARK", BENCHMARK)
+
+QUOTE_REFRESH_INTERVAL = int(os.environ.get("QUOTE_REFRESH_INTERVAL", 60))
+if os.environ.get("QUOTE_REFRESHER") == "1":
+    QuoteRefresher(DATABASE, api_cache, QUOTE_REFRESH_INTERVAL).start()
+
 
 @app.after_request
 def add_header(response):
@@ -41,158 +90,211 @@ def add_header(response):
         response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
         response.headers["Expires"] = 0
         response.headers["Pragma"] = "no-cache"
-    else:
+    elif "Cache-Control" not in response.headers:
         response.headers["Cache-Control"] = "public, max-age=31536000"
     return response
 
 
+def base_currency(user_id):
+    """The currency the user's portfolio is valued in."""
+    return database.query_one("SELECT base_currency FROM users WHERE id = ?", user_id)["base_currency"]
+
+
+def open_positions(user_id):
+    """The user's open positions with the currency each symbol is quoted in."""
+    return database.query(
+        "SELECT p.symbol, p.shares AS total_shares, p.open_cost AS cost_basis, COALESCE(l.currency, 'USD') AS currency "
+        "FROM positions p LEFT JOIN listing_currencies l ON l.symbol = p.symbol "
+        "WHERE p.user_id = ? AND p.shares > 0 ORDER BY p.symbol", user_id)
+
+
+def load_summary(user_id):
+    """Value the user's open positions at live quotes, in their base currency."""
+    base = base_currency(user_id)
+    positions = open_positions(user_id)
+    quotes = lookup_many([row["symbol"] for row in positions], api_cache)
+    factors = conversion_rates({row["currency"] for row in positions}, base, fx_store, api_cache)
+    summary = summarize_holdings(positions, quotes, {row["symbol"]: factors[row["currency"]] for row in positions},
+                                 base_costs(user_id, positions, base))
+    summary["currency"] = base
+    return summary
+
+
+def base_costs(user_id, positions, base):
+    """{symbol: cost basis in base} for positions quoted in another currency, each lot at the rate of its purchase
+    day, as the growth chart converts purchases."""
+    foreign = {row["symbol"]: row["currency"] for row in positions if row["currency"] != base}
+    if not foreign:
+        return {}
+    lots = database.query(
+        f"SELECT symbol, acquired, remaining * cost_per_share AS cost FROM lots "
+        f"WHERE user_id = ? AND {OPEN_LOT} AND symbol IN ({','.join('?' * len(foreign))})", user_id, *foreign)
+    if not lots:
+        return {}
+    start = datetime.strptime(min(lot["acquired"] for lot in lots), '%Y-%m-%d').date()
+    return lot_costs(lots, rate_history(foreign, base, start, fx_store, api_cache))
+
+
+def traded_currencies(user_id=None):
+    """{symbol: currency} of every symbol the user (or, without one, anybody) has traded, open or closed."""
+    query = ("SELECT DISTINCT p.symbol, COALESCE(l.currency, 'USD') AS currency "
+             "FROM positions p LEFT JOIN listing_currencies l ON l.symbol = p.symbol")
+    rows = database.query(query + " WHERE p.user_id = ?", user_id) if user_id is not None else database.query(query)
+    return {row["symbol"]: row["currency"] for row in rows}
+
+
+def load_growth(user_id):
+    """The user's portfolio growth curve in their base currency: stored daily snapshots plus today's point."""
+    base = base_currency(user_id)
+    transactions = database.query(USER_TRANSACTIONS, user_id)
+    if not transactions:
+        return dict(growth_series([], {}), currency=base)
+
+    currencies = traded_currencies(user_id)
+    all_historical_prices = get_historical_data_many(list(currencies), api_cache, price_store)
+    rates = None
+    if any(currency != base for currency in currencies.values()):
+        start = datetime.strptime(transactions[0]["date"], '%Y-%m-%d').date()
+        rates = rate_history(currencies, base, start, fx_store, api_cache)
+    return dict(growth_from_snapshots(database, user_id, base, transactions, all_historical_prices, rates),
+                currency=base)
+
+
+def growth_version(user_id):
+    """Cheap fingerprint of everything the growth curve depends on, used as its ETag."""
+    tx = db.execute("SELECT COUNT(*) AS n, MAX(id) AS last_id FROM transactions WHERE user_id = ?", user_id)[0]
+    prices = db.execute(
+        "SELECT MAX(last_date) AS last_date FROM price_history_sync "
+        "WHERE symbol IN (SELECT symbol FROM positions WHERE user_id = ?)", user_id)[0]
+    # FX rates move once a day, which the date already accounts for.
+    return f"{user_id}-{tx['n']}-{tx['last_id']}-{prices['last_date']}-{base_currency(user_id)}-{date.today().isoformat()}"
+
+
+def analytics_version(user_id):
+    """Fingerprint of the user's transactions and of every price series their metrics read."""
+    tx = db.execute("SELECT COUNT(*) AS n, MAX(id) AS last_id FROM transactions WHERE user_id = ?", user_id)[0]
+    prices = db.execute(
+        "SELECT MAX(last_date) AS last_date, MAX(synced_on) AS synced_on FROM price_history_sync "
+        "WHERE symbol IN (SELECT symbol FROM positions WHERE user_id = ?) OR symbol = ?", user_id, ANALYTICS_BENCHMARK)[0]
+    # FX rates move once a day, which the date already accounts for.
+    return (f"{user_id}-{tx['n']}-{tx['last_id']}-{prices['last_date']}-{prices['synced_on']}-{ANALYTICS_BENCHMARK}"
+            f"-{base_currency(user_id)}-{date.today().isoformat()}")
+
+
+def load_analytics(user_id):
+    """Risk and return metrics over everything the user has traded, cached until their inputs change."""
+    metrics = api_cache.get("analytics", analytics_version(user_id))
+    if metrics is not None:
+        return metrics
+
+    symbols = [row["symbol"] for row in db.execute("SELECT symbol FROM positions WHERE user_id = ?", user_id)]
+    histories = get_historical_data_many(symbols + [ANALYTICS_BENCHMARK], api_cache, price_store)
+    transactions = db.execute("SELECT symbol, shares, price, DATE(timestamp) as date FROM transactions WHERE user_id = ? ORDER BY timestamp ASC", user_id)
+    base = base_currency(user_id)
+    currencies = traded_currencies(user_id)
+    currencies[ANALYTICS_BENCHMARK] = (currencies.get(ANALYTICS_BENCHMARK)
+                                       or listing_currencies([ANALYTICS_BENCHMARK], api_cache, symbol_index).get(ANALYTICS_BENCHMARK)
+                                       or "USD")
+    rates = benchmark_rates = None
+    if transactions and any(currency != base for currency in currencies.values()):
+        start = datetime.strptime(transactions[0]["date"], '%Y-%m-%d').date()
+        factors = rate_history(currencies, base, start, fx_store, api_cache)
+        rates, benchmark_rates = factors[symbols], factors[ANALYTICS_BENCHMARK]
+    metrics = portfolio_metrics(transactions, {symbol: histories[symbol] for symbol in symbols},
+                                histories[ANALYTICS_BENCHMARK], rates=rates, benchmark_rates=benchmark_rates)
+    metrics["currency"] = base
+    metrics["benchmark"] = ANALYTICS_BENCHMARK
+    # Keyed after the histories were loaded, which may have just synced today's prices.
+    api_cache.set("analytics", analytics_version(user_id), metrics)
+    return metrics
+
+
+def revalidate(response):
+    """Make a JSON API response cacheable by the browser only after revalidating its ETag."""
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
 @app.route("/")
 @login_required
 def index():
-    """Show portfolio of stocks with advanced metrics and a real growth chart"""
-    user_id = session["user_id"]
-
-    holdings_db = db.execute(
-        "SELECT symbol, SUM(shares) as total_shares FROM transactions WHERE user_id = ? GROUP BY symbol HAVING total_shares > 0", user_id)
-
-    grand_total_value = 0
-    total_pl = 0
-    total_daily_pl = 0
-    total_invested = 0
-    holdings = []
-    all_historical_prices = {}
-
-    for row in holdings_db:
-        quote = lookup(row["symbol"], api_cache)
-
-        if not quote:
-            print(f"WARNING: Could not retrieve quote for {row['symbol']}. Skipping this holding.")
-            continue
-
-        cost_basis_rows = db.execute(
-            "SELECT SUM(price * shares) as total_cost, SUM(shares) as total_shares_bought FROM transactions WHERE user_id = ? AND symbol = ? AND shares > 0", user_id, row["symbol"])
-
-        total_cost_for_holding = cost_basis_rows[0]["total_cost"] or 0
-        total_shares_bought = cost_basis_rows[0]["total_shares_bought"] or 0
-        avg_price = total_cost_for_holding / total_shares_bought if total_shares_bought > 0 else 0
-
-        current_value = row["total_shares"] * quote["price"]
-        unrealized_pl = current_value - (row["total_shares"] * avg_price)
-
-        previous_close_safe = quote.get("previous_close", quote["price"])
-        daily_pl = (quote["price"] - previous_close_safe) * row["total_shares"]
+    """Show portfolio of stocks with advanced metrics; the growth chart loads from the JSON API after first paint"""
+    summary = load_summary(session["user_id"])
+    return render_template("index.html",
+                           holdings=summary["holdings"], grand_total=summary["grand_total"], total_pl=summary["total_pl"],
+                           total_daily_pl=summary["total_daily_pl"], total_pl_pct=summary["total_pl_pct"],
+                           total_daily_pl_pct=summary["total_daily_pl_pct"], currency=summary["currency"],
+                           distribution=summary["distribution"], currencies=BASE_CURRENCIES)
 
-        position_cost_basis = row["total_shares"] * avg_price
-        total_pl_pct_for_holding = (unrealized_pl / position_cost_basis) * 100 if position_cost_basis > 0 else 0
 
-        price_change_abs = quote["price"] - previous_close_safe
-        price_change_pct = (price_change_abs / previous_close_safe) * 100 if previous_close_safe > 0 else 0
+@app.route("/base-currency", methods=["POST"])
+@login_required
+def set_base_currency():
+    """Change the currency the user's portfolio is valued in"""
+    currency = (request.form.get("currency") or "").upper()
+    if currency not in BASE_CURRENCIES:
+        return apology("unsupported currency", 400)
+    with transaction(db):
+        db.execute("UPDATE users SET base_currency = ? WHERE id = ?", currency, session["user_id"])
+        invalidate_snapshots(db, session["user_id"])
+    return redirect("/")
 
-        holdings.append({
-            "symbol": row["symbol"], "shares": row["total_shares"], "price": quote["price"],
-            "avg_price": avg_price, "total_value": current_value, "total_pl": unrealized_pl,
-            "daily_pl": daily_pl, "price_change_abs": price_change_abs, "price_change_pct": price_change_pct,
-            "total_pl_pct": total_pl_pct_for_holding
-        })
 
-        grand_total_value += current_value
-        total_pl += unrealized_pl
-        total_daily_pl += daily_pl
-        total_invested += position_cost_basis
+@app.route("/api/portfolio/summary")
+@login_required
+def api_portfolio_summary():
+    """Holdings, totals and asset distribution as JSON."""
+    response = jsonify(load_summary(session["user_id"]))
+    response.add_etag()
+    return revalidate(response.make_conditional(request))
 
-        all_historical_prices[row["symbol"]] = get_historical_data(row["symbol"], api_cache)
 
-    total_pl_pct = (total_pl / total_invested) * 100 if total_invested > 0 else 0
-    yesterday_value = grand_total_value - total_daily_pl
-    total_daily_pl_pct = (total_daily_pl / yesterday_value) * 100 if yesterday_value > 0 else 0
+@app.route("/api/portfolio/growth")
+@login_required
+def api_portfolio_growth():
+    """Portfolio growth curve as JSON, answered with 304 when nothing it depends on has changed."""
+    user_id = session["user_id"]
+    version = growth_version(user_id)
+    if request.if_none_match.contains(version):
+        response = app.response_class(status=304)
+        response.set_etag(version)
+        return revalidate(response)
 
-    dist_chart_labels = [h['symbol'] for h in holdings]
-    dist_chart_values = [h['total_value'] for h in holdings]
+    growth = load_growth(user_id)
+    response = jsonify(growth)
+    # Taken after load_growth(), which may have just synced today's prices.
+    response.set_etag(growth_version(user_id))
+    return revalidate(response)
 
-    transactions = db.execute("SELECT symbol, shares, price, DATE(timestamp) as date FROM transactions WHERE user_id = ? ORDER BY timestamp ASC", user_id)
 
-    growth_chart_labels = []
-    growth_chart_values_abs = []
-    growth_chart_values_pct = []
-
-    if transactions and holdings:
-        start_date = datetime.strptime(transactions[0]['date'], '%Y-%m-%d').date()
-        end_date = date.today()
-
-        time_span_days = (end_date - start_date).days
-        if time_span_days > 365 * 2:
-            delta = timedelta(days=30)
-            time_unit = 'month'
-        elif time_span_days > 90:
-            delta = timedelta(days=7)
-            time_unit = 'week'
-        else:
-            delta = timedelta(days=1)
-            time_unit = 'day'
-
-        current_date = start_date
-        last_added_date = None
-
-        while current_date <= end_date:
-            date_str = current_date.strftime('%Y-%m-%d')
-
-            if time_unit == 'week' and last_added_date and current_date.isocalendar()[:2] == last_added_date.isocalendar()[:2]:
-                current_date += timedelta(days=1)
-                continue
-            if time_unit == 'month' and last_added_date and current_date.month == last_added_date.month and current_date.year == last_added_date.year:
-                current_date += timedelta(days=1)
-                continue
-
-            holdings_on_date = {}
-            cost_basis_on_date = 0
-
-            for t in transactions:
-                if t['symbol'] in all_historical_prices:
-                    if t['date'] <= date_str:
-                        holdings_on_date[t['symbol']] = holdings_on_date.get(t['symbol'], 0) + t['shares']
-                        if t['shares'] > 0:
-                            cost_basis_on_date += t['shares'] * t['price']
-
-            value_on_date = 0
-            for symbol, shares in holdings_on_date.items():
-                if shares > 0:
-                    price_history = all_historical_prices.get(symbol, {})
-                    price_on_date = price_history.get(date_str)
-
-                    if not price_on_date:
-                        temp_date = current_date - timedelta(days=1)
-                        while temp_date >= start_date:
-                            price_on_date = price_history.get(temp_date.strftime('%Y-%m-%d'))
-                            if price_on_date:
-                                break
-                            temp_date -= timedelta(days=1)
-
-                    if price_on_date:
-                        value_on_date += shares * price_on_date
-
-            if value_on_date > 0:
-                growth_chart_labels.append(date_str)
-                growth_chart_values_abs.append(round(value_on_date, 2))
-                pct_growth = ((value_on_date - cost_basis_on_date) / cost_basis_on_date) * 100 if cost_basis_on_date > 0 else 0
-                growth_chart_values_pct.append(round(pct_growth, 2))
-
-            last_added_date = current_date
-            current_date += delta
-
-    all_chart_data = {
-        "distribution": {"labels": dist_chart_labels, "values": dist_chart_values},
-        "growth": {
-            "labels": growth_chart_labels,
-            "values_abs": growth_chart_values_abs,
-            "values_pct": growth_chart_values_pct
-        }
-    }
+@app.route("/api/portfolio/analytics")
+@login_required
+def api_portfolio_analytics():
+    """Portfolio risk and return metrics as JSON."""
+    response = jsonify(load_analytics(session["user_id"]))
+    response.add_etag()
+    return revalidate(response.make_conditional(request))
 
-    return render_template("index.html",
-                           holdings=holdings, grand_total=grand_total_value, total_pl=total_pl,
-                           total_daily_pl=total_daily_pl, total_pl_pct=total_pl_pct,
-                           total_daily_pl_pct=total_daily_pl_pct, chart_data_json=all_chart_data)
 
+@app.route("/api/prices/stream")
+@login_required
+def api_price_stream():
+    """Server-Sent Events stream of `price` ticks for the comma-separated ?symbols=, sent as they change."""
+    symbols = list(dict.fromkeys(symbol.strip().upper() for symbol in request.args.get("symbols", "").split(",")
+                                 if symbol.strip()))
+    if not symbols or len(symbols) > MAX_SYMBOLS:
+        return jsonify({"error": f"symbols must list 1 to {MAX_SYMBOLS} symbols"}), 400
+    if not price_stream.open_slot():
+        # EventSource gives up on a 503, leaving the page with the prices it was rendered with.
+        response = jsonify({"error": "too many live price streams, try again later"})
+        response.headers["Retry-After"] = str(FULL_RETRY_AFTER)
+        return response, 503
+    response = Response(price_stream.events(symbols), mimetype="text/event-stream")
+    response.call_on_close(price_stream.close_slot)
+    response.headers["Cache-Control"] = "no-store"
+    # Stops nginx from buffering the stream.
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 
 @app.route("/buy", methods=["GET", "POST"])
@@ -226,9 +328,18 @@ def buy():
             return apology("invalid symbol", 400)
 
         user_id = session["user_id"]
+        currency = listing_currencies([symbol], api_cache, symbol_index).get(symbol)
 
-        db.execute("INSERT INTO transactions (user_id, symbol, shares, price, timestamp, asset_type) VALUES (?, ?, ?, ?, ?, ?)",
-                   user_id, symbol, shares, price, date_str, asset_type)
+        try:
+            with database.transaction() as conn:
+                trade_id = conn.execute("INSERT INTO transactions (user_id, symbol, shares, price, timestamp, asset_type) VALUES (?, ?, ?, ?, ?, ?)",
+                                        (user_id, symbol, shares, price, date_str, asset_type)).lastrowid
+                record_trade(conn, trade_id, user_id, symbol, shares, price, date_str)
+                invalidate_snapshots(conn, user_id, date_str)
+                if currency:
+                    conn.execute("INSERT OR REPLACE INTO listing_currencies (symbol, currency) VALUES (?, ?)", (symbol, currency))
+        except NotEnoughShares as e:
+            return apology(f"earlier sales no longer add up: {e}", 400)
 
         flash("Purchase logged successfully!", "success")
         return redirect("/")
@@ -236,14 +347,96 @@ def buy():
         today = date.today().strftime('%Y-%m-%d')
         return render_template("buy.html", today=today)
 
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+
+def history_page(user_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """Return one page of the user's transactions, newest first, and the cursor for the next page.
+
+    Pages are keyset-paginated on (timestamp, id), so each one costs an index range scan of
+    `limit` rows no matter how deep into the history it is. Raises ValueError for a bad cursor.
+    """
+    # Prices are in the listing currency of each symbol.
+    query = ("SELECT t.id, t.symbol, t.shares, t.price, t.timestamp, t.asset_type, COALESCE(l.currency, 'USD') AS currency "
+             "FROM transactions t LEFT JOIN listing_currencies l ON l.symbol = t.symbol WHERE t.user_id = ?")
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        rows = database.query(f"{query} AND (t.timestamp, t.id) < (?, ?) ORDER BY t.timestamp DESC, t.id DESC LIMIT ?",
+                              user_id, timestamp, row_id, limit + 1)
+    else:
+        rows = database.query(f"{query} ORDER BY t.timestamp DESC, t.id DESC LIMIT ?", user_id, limit + 1)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["timestamp"], rows[-1]["id"])
+    return rows, next_cursor
+
+
 @app.route("/history")
 @login_required
 def history():
-    """Show history of transactions"""
+    """Show the most recent page of transactions; older ones load from /api/history"""
+    try:
+        transactions, next_cursor = history_page(session["user_id"], request.args.get("cursor"))
+    except ValueError:
+        return apology("invalid cursor", 400)
+    return render_template("history.html", transactions=transactions, next_cursor=next_cursor)
+
+
+@app.route("/api/history")
+@login_required
+def api_history():
+    """One page of transaction history as JSON, for infinite scroll."""
+    limit = min(request.args.get("limit", HISTORY_PAGE_SIZE, type=int), HISTORY_MAX_PAGE_SIZE)
+    try:
+        transactions, next_cursor = history_page(session["user_id"], request.args.get("cursor"), max(limit, 1))
+    except ValueError:
+        return jsonify({"error": "invalid cursor"}), 400
+    response = jsonify({"transactions": [dict(row) for row in transactions], "next_cursor": next_cursor})
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+EXPORT_COLUMNS = ["id", "symbol", "shares", "price", "timestamp", "asset_type", "currency"]
+
+
+@app.route("/history/export.<any(csv, ndjson):fmt>")
+@login_required
+def export_history(fmt):
+    """Stream the user's full transaction history as CSV or NDJSON, one keyset page at a time."""
     user_id = session["user_id"]
-    transactions = db.execute(
-        "SELECT id, symbol, shares, price, timestamp FROM transactions WHERE user_id = ? ORDER BY timestamp DESC", user_id)
-    return render_template("history.html", transactions=transactions)
+
+    def pages():
+        cursor = None
+        while True:
+            rows, cursor = history_page(user_id, cursor, HISTORY_MAX_PAGE_SIZE)
+            yield rows
+            if not cursor:
+                return
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in pages():
+            writer.writerows([row[column] for column in EXPORT_COLUMNS] for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    def generate_ndjson():
+        for rows in pages():
+            yield "".join(json.dumps(dict(row)) + "\n" for row in rows)
+
+    if fmt == "csv":
+        response = Response(stream_with_context(generate_csv()), mimetype="text/csv")
+    else:
+        response = Response(stream_with_context(generate_ndjson()), mimetype="application/x-ndjson")
+    response.headers["Content-Disposition"] = f"attachment; filename=transactions.{fmt}"
+    response.headers["Cache-Control"] = "private, no-store"
+    return response
 
 
 @app.route("/calculator")
@@ -263,12 +456,12 @@ def login():
         elif not request.form.get("password"):
             return apology("must provide password", 403)
 
-        rows = db.execute("SELECT * FROM users WHERE username = ?", request.form.get("username"))
+        user = database.query_one("SELECT id, hash FROM users WHERE username = ?", request.form.get("username"))
 
-        if len(rows) != 1 or not check_password_hash(rows[0]["hash"], request.form.get("password")):
+        if user is None or not check_password_hash(user["hash"], request.form.get("password")):
             return apology("invalid username and/or password", 403)
 
-        session["user_id"] = rows[0]["id"]
+        session["user_id"] = user["id"]
         return redirect("/")
     else:
         return render_template("login.html")
@@ -296,15 +489,17 @@ def register():
         elif password != confirmation:
             return apology("passwords do not match", 400)
 
-        rows = db.execute("SELECT * FROM users WHERE username = ?", username)
-        if len(rows) > 0:
+        if database.query_one("SELECT 1 FROM users WHERE username = ?", username):
             return apology("username already exists", 400)
 
         hash = generate_password_hash(password)
-        db.execute("INSERT INTO users (username, hash) VALUES (?, ?)", username, hash)
+        try:
+            user_id = database.execute("INSERT INTO users (username, hash) VALUES (?, ?)", username, hash).lastrowid
+        except sqlite3.IntegrityError:
+            # Registered by a concurrent request since the check above.
+            return apology("username already exists", 400)
 
-        rows = db.execute("SELECT * FROM users WHERE username = ?", username)
-        session["user_id"] = rows[0]["id"]
+        session["user_id"] = user_id
 
         flash("Registered successfully!", "success")
         return redirect("/")
@@ -339,26 +534,29 @@ def sell():
         if not symbol or shares_to_sell <= 0 or price <= 0:
             return apology("all fields are required", 400)
 
-        owned_shares_rows = db.execute(
-            "SELECT SUM(shares) as total_shares FROM transactions WHERE user_id = ? AND symbol = ? GROUP BY symbol", user_id, symbol)
-
-        if not owned_shares_rows or owned_shares_rows[0]["total_shares"] < shares_to_sell:
-            return apology("not enough shares to sell", 400)
-
-        cost_basis_rows = db.execute(
-            "SELECT SUM(price * shares) as total_cost, SUM(shares) as total_shares_bought FROM transactions WHERE user_id = ? AND symbol = ? AND shares > 0", user_id, symbol)
-
-        total_cost = cost_basis_rows[0]["total_cost"]
-        total_shares_bought = cost_basis_rows[0]["total_shares_bought"]
-        average_cost_per_share = total_cost / total_shares_bought
+        lot_method = request.form.get("lot_method", "fifo")
+        if lot_method not in LOT_METHODS:
+            return apology("invalid lot method", 400)
+        try:
+            lot_ids = [int(lot_id) for lot_id in request.form.getlist("lot_id")]
+        except ValueError:
+            return apology("invalid lot", 400)
 
-        cost_of_shares_sold = shares_to_sell * average_cost_per_share
+        position = database.query_one("SELECT shares FROM positions WHERE user_id = ? AND symbol = ?", user_id, symbol)
 
-        total_sale_value = shares_to_sell * price
-        realized_pl = total_sale_value - cost_of_shares_sold
+        if position is None or position["shares"] < shares_to_sell:
+            return apology("not enough shares to sell", 400)
 
-        db.execute("INSERT INTO transactions (user_id, symbol, shares, price, timestamp) VALUES (?, ?, ?, ?, ?)",
-                   user_id, symbol, -shares_to_sell, price, date_str)
+        # The ledger matches the sale against the lots held on its date and books its exact P/L.
+        try:
+            with database.transaction() as conn:
+                trade_id = conn.execute("INSERT INTO transactions (user_id, symbol, shares, price, timestamp) VALUES (?, ?, ?, ?, ?)",
+                                        (user_id, symbol, -shares_to_sell, price, date_str)).lastrowid
+                realized_pl = record_trade(conn, trade_id, user_id, symbol, -shares_to_sell, price, date_str,
+                                           lot_method, lot_ids)
+                invalidate_snapshots(conn, user_id, date_str)
+        except NotEnoughShares as e:
+            return apology(f"not enough shares to sell: {e}", 400)
 
         if realized_pl >= 0:
             flash(f"Sold successfully! Realized Profit: ${realized_pl:,.2f}", "success")
@@ -368,24 +566,66 @@ def sell():
         return redirect("/")
     else:
         today = date.today().strftime('%Y-%m-%d')
-        symbols = db.execute(
-            "SELECT symbol FROM transactions WHERE user_id = ? GROUP BY symbol HAVING SUM(shares) > 0", user_id)
+        symbols = database.query(
+            "SELECT symbol FROM positions WHERE user_id = ? AND shares > 0 ORDER BY symbol", user_id)
         user_symbols = [row['symbol'] for row in symbols]
         return render_template("sell.html", symbols=user_symbols, today=today)
 
 
+@app.route("/api/lots/<symbol>")
+@login_required
+def api_lots(symbol):
+    """The user's open lots of symbol, for picking specific lots to sell."""
+    return jsonify(open_lots(db, session["user_id"], symbol))
+
+
 @app.route("/reset", methods=["POST"])
 @login_required
 def reset():
     """Reset the user's entire transaction history"""
     user_id = session["user_id"]
 
-    db.execute("DELETE FROM transactions WHERE user_id = ?", user_id)
+    with transaction(db):
+        db.execute("DELETE FROM lot_sales WHERE lot_id IN (SELECT id FROM lots WHERE user_id = ?)", user_id)
+        db.execute("DELETE FROM sales WHERE user_id = ?", user_id)
+        db.execute("DELETE FROM lots WHERE user_id = ?", user_id)
+        db.execute("DELETE FROM transactions WHERE user_id = ?", user_id)
+        db.execute("DELETE FROM positions WHERE user_id = ?", user_id)
+        invalidate_snapshots(db, user_id)
 
     flash("Your portfolio has been reset!", "success")
     return redirect("/")
 
 
+@app.route("/import", methods=["GET", "POST"])
+@login_required
+def import_csv():
+    """Import many transactions at once from a CSV file"""
+    if request.method == "POST":
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            return apology("must provide a CSV file", 400)
+
+        conn = connect(DATABASE)
+        try:
+            result = import_transactions(conn, api_cache, session["user_id"],
+                                         io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline=""), symbol_index)
+        except UnicodeDecodeError:
+            return apology("file must be UTF-8 encoded CSV", 400)
+        except csv.Error:
+            return apology("file is not valid CSV", 400)
+        finally:
+            conn.close()
+
+        if result["imported"]:
+            flash(f"Imported {result['imported']} transactions.", "success")
+        if result["skipped"]:
+            flash(f"{result['skipped']} rows were skipped.", "danger")
+        return render_template("import.html", errors=result["errors"])
+    else:
+        return render_template("import.html", errors=[])
+
+
 @app.route("/analysis")
 @login_required
 def analysis():
@@ -398,20 +638,36 @@ def analysis():
 def stock_detail(symbol):
     """Show detail page for a specific stock."""
 
-    quote = lookup(symbol, api_cache)
+    quote = lookup_many([symbol], api_cache).get(symbol)
     if not quote:
         return apology("Stock symbol not found", 404)
 
-    historical_data = get_historical_data(symbol, api_cache)
-
+    # The chart fetches its range from /api/stock/<symbol>/history; start syncing the history
+    # now so that request finds it cached (or joins this fetch) instead of starting cold.
+    history_pool.submit(get_historical_data, symbol, api_cache, price_store)
     news = get_stock_news(quote["name"], api_cache)
+    currency = listing_currencies([symbol], api_cache, symbol_index).get(symbol) or "USD"
 
     return render_template("stock_detail.html",
                            quote=quote,
-                           historical_data=historical_data,
+                           currency=currency,
                            news=news)
 
 
+@app.route("/api/stock/<symbol>/history")
+@login_required
+def api_stock_history(symbol):
+    """Daily closes for one range (?range=1m|6m|1y|5y|max) as columnar arrays, downsampled to ?points."""
+    range_key = request.args.get("range", DEFAULT_RANGE)
+    if range_key not in RANGES:
+        return jsonify({"error": f"range must be one of {', '.join(RANGES)}"}), 400
+    points = request.args.get("points", POINT_BUDGET, type=int)
+
+    closes = get_historical_data(symbol.upper(), api_cache, price_store)
+    response = jsonify(price_series(closes, range_key, points))
+    response.add_etag()
+    return revalidate(response.make_conditional(request))
+
 
 @app.route("/search")
 @login_required
@@ -420,7 +676,7 @@ def search():
     q = request.args.get("q")
     asset_type = request.args.get("type", "stock")
     if q:
-        matches = search_symbols(q, asset_type, api_cache)
+        matches = search_symbols(q, asset_type, api_cache, symbol_index)
         return jsonify(matches)
     return jsonify([])
 
@@ -431,11 +687,86 @@ def delete(transaction_id):
     """Delete a specific transaction"""
     user_id = session["user_id"]
 
-    db.execute("DELETE FROM transactions WHERE id = ? AND user_id = ?", transaction_id, user_id)
+    try:
+        with transaction(db):
+            rows = db.execute("SELECT symbol, DATE(timestamp) AS date FROM transactions WHERE id = ? AND user_id = ?",
+                              transaction_id, user_id)
+            if rows:
+                db.execute("DELETE FROM transactions WHERE id = ? AND user_id = ?", transaction_id, user_id)
+                rebuild_ledger(db, user_id, rows[0]["symbol"])
+                invalidate_snapshots(db, user_id, rows[0]["date"])
+    except NotEnoughShares as e:
+        return apology(f"later sales depend on this purchase: {e}", 400)
 
     flash("Transaction deleted successfully!", "success")
     return redirect("/history")
 
 
+@app.cli.command("rebuild-positions")
+def rebuild_positions_command():
+    """Recompute the positions table and lot ledger from the transactions table."""
+    count = rebuild_ledgers(db)
+    print(f"Rebuilt {count} positions.")
+
+
+@app.cli.command("snapshot-portfolios")
+def snapshot_portfolios_command():
+    """Store every user's portfolio value for each finished day not stored yet; run nightly after the close."""
+    users = {row["id"]: row["base_currency"] for row in database.query("SELECT id, base_currency FROM users")}
+    transactions = {}
+    for row in database.query(
+            "SELECT user_id, symbol, shares, price, DATE(timestamp) AS date FROM transactions ORDER BY user_id, timestamp, id"):
+        transactions.setdefault(row["user_id"], []).append(
+            {"symbol": row["symbol"], "shares": row["shares"], "price": row["price"], "date": row["date"]})
+
+    # Each symbol's history is loaded once and shared by everyone holding it.
+    currencies = traded_currencies()
+    histories = get_historical_data_many(list(currencies), api_cache, price_store)
+    rates = {}
+    for base in set(users.values()):
+        group = [user_id for user_id in transactions if users[user_id] == base]
+        symbols = {row["symbol"] for user_id in group for row in transactions[user_id]}
+        if any(currencies.get(symbol, "USD") != base for symbol in symbols):
+            start = min(datetime.strptime(transactions[user_id][0]["date"], '%Y-%m-%d').date() for user_id in group)
+            rates[base] = rate_history({symbol: currencies.get(symbol, "USD") for symbol in symbols}, base, start,
+                                       fx_store, api_cache)
+
+    count = snapshot_all(database, users, transactions, histories, rates)
+    print(f"Stored {count} daily snapshots for {len(transactions)} users.")
+
+
+@app.cli.command("refresh-symbols")
+def refresh_symbols_command():
+    """Download the stock and crypto symbol lists behind /search autocomplete."""
+    count = symbol_index.refresh()
+    print(f"Indexed {count} symbols.")
+
+
+@app.cli.command("import-transactions")
+@click.argument("username")
+@click.argument("csv_file", type=click.File("r", encoding="utf-8-sig"))
+def import_transactions_command(username, csv_file):
+    """Import a CSV of transactions into USERNAME's portfolio."""
+    rows = db.execute("SELECT id FROM users WHERE username = ?", username)
+    if not rows:
+        raise click.ClickException(f"no such user: {username}")
+
+    result = import_transactions(connect(DATABASE), api_cache, rows[0]["id"], csv_file, symbol_index)
+    for line_num, message in result["errors"]:
+        print(f"line {line_num}: {message}")
+    print(f"Imported {result['imported']} transactions, skipped {result['skipped']} rows.")
+
+
+@app.cli.command("refresh-quotes")
+@click.option("--once", is_flag=True, help="Refresh a single time and exit.")
+def refresh_quotes_command(once):
+    """Keep quotes for all held symbols warm in the shared cache."""
+    if once:
+        count = refresh_once(connect(DATABASE), api_cache)
+        print(f"Refreshed {count} quotes.")
+    else:
+        QuoteRefresher(DATABASE, api_cache, QUOTE_REFRESH_INTERVAL).run()
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
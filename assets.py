@@ -0,0 +1,144 @@
+"""Fingerprinted, precompressed static assets.
+
+`python assets.py` copies every file under static/ into static/dist/ with a hash of its
+content in the name (js/stock-chart.js -> js/stock-chart.3f2a9c1b04de.js), writes gzip
+and Brotli versions of the text files next to the copies, and records the names in
+static/dist/manifest.json. Templates link assets with asset_url(), which looks names up
+in the manifest, so a changed file gets a new URL and every URL can be cached for a year.
+Built files are served as the .br or .gz version the browser accepts, compressed once at
+build time instead of on every request. Without a build, as in development, asset_url()
+links the plain file with its content hash as a query string instead.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import request, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+DIST = "dist"
+MANIFEST = "manifest.json"
+HASH_LENGTH = 12
+COMPRESSIBLE = {".css", ".html", ".js", ".json", ".map", ".svg", ".txt"}
+# Preferred first.
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:HASH_LENGTH]
+
+
+def _write(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _compress(path, data):
+    _write(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        _write(path + ".br", brotli.compress(data, quality=11))
+
+
+def build(static_dir="static"):
+    """Write the fingerprinted copy (and compressed versions) of every static file, then the manifest.
+
+    Files from earlier builds are left in place, so pages rendered by workers still on the
+    previous release keep loading. Returns the manifest: {filename: fingerprinted filename}.
+    """
+    out_dir = os.path.join(static_dir, DIST)
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != out_dir)
+        # Dotfiles are tool state (such as batch_img_convert.py's manifest), not assets.
+        for name in sorted(name for name in files if not name.startswith(".")):
+            source = os.path.join(root, name)
+            filename = os.path.relpath(source, static_dir).replace(os.sep, "/")
+            stem, ext = os.path.splitext(filename)
+            manifest[filename] = f"{stem}.{_digest(source)}{ext}"
+            target = os.path.join(out_dir, manifest[filename])
+            if os.path.exists(target):
+                continue
+            with open(source, "rb") as f:
+                data = f.read()
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # The copy goes last: once it exists, its compressed versions do too.
+            if ext in COMPRESSIBLE:
+                _compress(target, data)
+            _write(target, data)
+
+    os.makedirs(out_dir, exist_ok=True)
+    _write(os.path.join(out_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+class Assets:
+    """asset_url() for templates and precompressed serving of built assets, for a Flask app."""
+
+    def __init__(self, app):
+        self.static_dir = app.static_folder
+        self.manifest = {}
+        try:
+            with open(os.path.join(self.static_dir, DIST, MANIFEST), encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            pass
+        # (filename, mtime) -> content hash, for unbuilt files.
+        self._digests = {}
+        app.add_template_global(self.url, "asset_url")
+        self._send_static = app.view_functions["static"]
+        app.view_functions["static"] = self.static_view
+
+    def url(self, filename):
+        """URL of the static file filename that changes whenever its content does."""
+        if filename in self.manifest:
+            return url_for("static", filename=f"{DIST}/{self.manifest[filename]}")
+        try:
+            key = (filename, os.stat(os.path.join(self.static_dir, filename)).st_mtime_ns)
+            if key not in self._digests:
+                self._digests[key] = _digest(os.path.join(self.static_dir, filename))
+        except OSError:
+            return url_for("static", filename=filename)
+        return url_for("static", filename=filename, v=self._digests[key])
+
+    def static_view(self, filename):
+        if not filename.startswith(f"{DIST}/"):
+            return self._send_static(filename=filename)
+
+        for encoding, suffix in ENCODINGS:
+            path = safe_join(self.static_dir, filename + suffix)
+            if request.accept_encodings[encoding] and path and os.path.isfile(path):
+                response = send_from_directory(self.static_dir, filename + suffix,
+                                               mimetype=mimetypes.guess_type(filename)[0])
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = self._send_static(filename=filename)
+        response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = IMMUTABLE
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--static", default="static", help="static directory to build from")
+    args = parser.parse_args()
+    manifest = build(args.static)
+    print(f"Built {len(manifest)} assets into {os.path.join(args.static, DIST)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,168 @@
 #!/usr/bin/env python3
 """
-Batch convert PNG/JPG to WebP and generate responsive sizes.
+Batch convert PNG/JPG to WebP (and optionally AVIF) and generate responsive sizes.
 
 Usage:
-  python batch_img_convert.py --src static/img --sizes 480 800 1200 --quality 80
+  python batch_img_convert.py --src static/img --sizes 480 800 1200 --quality 80 --jobs 4
 
 - Scans --src recursively for .png, .jpg, .jpeg (and .webp if you pass --include-webp).
-- For each image, generates WebP variants (e.g., image-480.webp, image-800.webp).
-- Preserves aspect ratio; resizes by width.
-- Skips generating a size if that output already exists (unless --overwrite).
+- For each image, generates WebP variants (e.g., image-480.webp, image-800.webp), plus AVIF ones with --avif.
+- Preserves aspect ratio; resizes by width. Each source is decoded once for all its sizes and formats.
+- --jobs N converts N images at a time in separate processes (0 = one per CPU core).
+- Keeps a manifest (.img-manifest.json in the output directory, or in --src) of each source's content
+  hash and the encode settings, and only re-encodes images whose content or settings changed, or
+  whose outputs are missing. --overwrite re-encodes everything. Output paths in it are relative to
+  the manifest, so the script can be run from any directory.
 - By default writes next to the source file; use --out to change destination.
+- --srcset-json PATH writes each image's srcset strings for templates; --print-srcset prints
+  <picture> snippets that link the variants through asset_url().
 
 Requirements:
   pip install pillow
+  AVIF needs Pillow 11.2+ built with libavif, or: pip install pillow-avif-plugin
 """
 
 import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from PIL import Image
 
-def convert_one(img_path: Path, out_dir: Path, widths, quality=80, overwrite=False):
+MANIFEST_NAME = ".img-manifest.json"
+WEBP_METHOD = 6
+AVIF_SPEED = 4
+MIME_TYPES = {"webp": "image/webp", "avif": "image/avif"}
+
+
+def avif_supported():
     try:
-        with Image.open(img_path) as im:
-            im.load()
-            # Ensure RGB for JPEG/PNG with alpha
-            if im.mode in ("RGBA", "P"):
-                im = im.convert("RGB")
-            for w in widths:
-                out_name = f"{img_path.stem}-{w}.webp"
-                out_path = out_dir / out_name
-                if out_path.exists() and not overwrite:
-                    print(f"✓ Skip (exists): {out_path}")
-                    continue
-                ratio = w / im.width
-                new_h = max(1, int(im.height * ratio))
-                resized = im.resize((w, new_h), Image.LANCZOS)
-                resized.save(out_path, "WEBP", quality=quality, method=6)
+        import pillow_avif  # noqa: F401 - registers AVIF with Pillow releases that lack it
+    except ImportError:
+        pass
+    return ".avif" in Image.registered_extensions()
+
+
+def file_hash(path: Path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def output_path(img_path: Path, out_dir: Path, width, fmt):
+    return out_dir / f"{img_path.stem}-{width}.{fmt}"
+
+
+def convert_one(img_path: Path, out_dir: Path, widths, quality=80, formats=("webp",), avif_quality=60):
+    """Decode img_path once and write every width in every format.
+
+    Returns {"width", "height", "heights": {width: height}, "outputs": {format: {width: path}}};
+    raises on failure.
+    """
+    outputs = {fmt: {} for fmt in formats}
+    heights = {}
+    with Image.open(img_path) as im:
+        im.load()
+        # Ensure RGB for JPEG/PNG with alpha
+        if im.mode in ("RGBA", "P"):
+            im = im.convert("RGB")
+        for w in widths:
+            ratio = w / im.width
+            new_h = max(1, int(im.height * ratio))
+            resized = im.resize((w, new_h), Image.LANCZOS)
+            heights[str(w)] = new_h
+            for fmt in formats:
+                out_path = output_path(img_path, out_dir, w, fmt)
+                if fmt == "avif":
+                    resized.save(out_path, "AVIF", quality=avif_quality, speed=AVIF_SPEED)
+                else:
+                    resized.save(out_path, "WEBP", quality=quality, method=WEBP_METHOD)
+                outputs[fmt][str(w)] = out_path.as_posix()
                 print(f"→ Saved: {out_path}")
+        return {"width": im.width, "height": im.height, "heights": heights, "outputs": outputs}
+
+
+def attempt(fn, *args):
+    """(fn(*args), None), or (None, the exception) if it raised."""
+    try:
+        return fn(*args), None
     except Exception as e:
-        print(f"✗ Error with {img_path}: {e}")
+        return None, e
+
+
+def load_manifest(path: Path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path: Path, manifest):
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def relative_outputs(outputs, base: Path):
+    """outputs with every path made relative to base, so the manifest works from any working directory."""
+    return {fmt: {w: Path(os.path.relpath(p, base)).as_posix() for w, p in sizes.items()} for fmt, sizes in outputs.items()}
+
+
+def output_paths(entry, base: Path):
+    """Every output path of a manifest entry, resolved against the manifest's directory base."""
+    return [base / p for sizes in entry["outputs"].values() for p in sizes.values()]
+
+
+def up_to_date(entry, digest, settings, base: Path):
+    """True when entry was encoded from content with this digest, with these settings, and its outputs exist."""
+    return (entry is not None and entry.get("sha256") == digest and entry.get("settings") == settings
+            and "heights" in entry and all(p.exists() for p in output_paths(entry, base)))
+
+
+def static_name(path, static_root: Path):
+    """path relative to the static folder, as asset_url() takes it."""
+    try:
+        return Path(path).resolve().relative_to(static_root.resolve()).as_posix()
+    except ValueError:
+        return Path(path).as_posix()
+
+
+def srcsets(manifest, base: Path, static_root: Path):
+    """{source: {"width", "height", "src", format: srcset}} for every image in the manifest.
+
+    src is the largest WebP variant and width/height are its dimensions; paths in the
+    manifest are relative to base.
+    """
+    result = {}
+    for key, entry in sorted(manifest.items()):
+        sets = {fmt: ", ".join(f"{static_name(base / p, static_root)} {w}w"
+                               for w, p in sorted(sizes.items(), key=lambda item: int(item[0])))
+                for fmt, sizes in entry["outputs"].items()}
+        largest = max(entry["outputs"]["webp"], key=int)
+        result[key] = dict(sets, width=int(largest), height=entry["heights"][largest],
+                           src=static_name(base / entry["outputs"]["webp"][largest], static_root))
+    return result
+
+
+def picture_snippet(item, sizes_attr="100vw"):
+    def linked(srcset):
+        return ", ".join(f"{{{{ asset_url('{name}') }}}} {width}"
+                         for name, width in (part.rsplit(" ", 1) for part in srcset.split(", ")))
+
+    lines = ["<picture>"]
+    for fmt in ("avif", "webp"):
+        if fmt in item:
+            lines.append(f'  <source type="{MIME_TYPES[fmt]}" srcset="{linked(item[fmt])}" sizes="{sizes_attr}">')
+    lines.append(f"  <img src=\"{{{{ asset_url('{item['src']}') }}}}\" width=\"{item['width']}\" height=\"{item['height']}\" "
+                 f'alt="" loading="lazy" decoding="async">')
+    lines.append("</picture>")
+    return "\n".join(lines)
+
 
 def main():
     parser = argparse.ArgumentParser(description="Batch convert images to WebP sized variants.")
@@ -46,14 +170,27 @@ def main():
     parser.add_argument("--out", type=str, default=None, help="Output directory (defaults to same as source files)")
     parser.add_argument("--sizes", type=int, nargs="+", default=[480, 800, 1200], help="Widths to generate")
     parser.add_argument("--quality", type=int, default=80, help="WebP quality (0-100)")
+    parser.add_argument("--avif", action="store_true", help="Also generate AVIF variants")
+    parser.add_argument("--avif-quality", type=int, default=60, help="AVIF quality (0-100)")
     parser.add_argument("--include-webp", action="store_true", help="Also re-encode .webp originals")
-    parser.add_argument("--overwrite", action="store_true", help="Overwrite existing outputs")
+    parser.add_argument("--overwrite", action="store_true", help="Re-encode every image, changed or not")
+    parser.add_argument("--jobs", type=int, default=1, help="Images to convert in parallel (0 = CPU count)")
+    parser.add_argument("--srcset-json", type=str, default=None, help="Write srcset strings per image to this file")
+    parser.add_argument("--print-srcset", action="store_true", help="Print a <picture> snippet per image")
+    parser.add_argument("--sizes-attr", type=str, default="100vw", help="sizes attribute for --print-srcset")
+    parser.add_argument("--static-root", type=str, default="static", help="Folder asset_url() paths are relative to")
     args = parser.parse_args()
 
     exts = [".png", ".jpg", ".jpeg"]
     if args.include_webp:
         exts.append(".webp")
 
+    formats = ["webp"]
+    if args.avif:
+        if not avif_supported():
+            raise SystemExit("AVIF output needs Pillow 11.2+ with libavif, or: pip install pillow-avif-plugin")
+        formats.append("avif")
+
     src = Path(args.src)
     if not src.exists():
         raise SystemExit(f"Source not found: {src}")
@@ -62,15 +199,63 @@ def main():
     if out_dir:
         out_dir.mkdir(parents=True, exist_ok=True)
 
-    files = [p for p in src.rglob("*") if p.suffix.lower() in exts]
+    manifest_dir = out_dir or src
+    manifest_path = manifest_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+    # Our own outputs are not sources, even with --include-webp.
+    generated = {p.resolve() for entry in manifest.values() for p in output_paths(entry, manifest_dir)}
+    files = sorted(p for p in src.rglob("*") if p.suffix.lower() in exts and p.resolve() not in generated)
     if not files:
         print("No images found.")
         return
 
-    print(f"Found {len(files)} images. Converting to sizes: {args.sizes} (quality={args.quality})")
+    settings = {"sizes": sorted(set(args.sizes)), "quality": args.quality, "formats": formats,
+                "webp_method": WEBP_METHOD}
+    if args.avif:
+        settings.update(avif_quality=args.avif_quality, avif_speed=AVIF_SPEED)
+
+    updated, pending = {}, []
     for img in files:
-        target_dir = out_dir if out_dir else img.parent
-        convert_one(img, target_dir, args.sizes, quality=args.quality, overwrite=args.overwrite)
+        key = img.relative_to(src).as_posix()
+        digest = file_hash(img)
+        if not args.overwrite and up_to_date(manifest.get(key), digest, settings, manifest_dir):
+            print(f"✓ Skip (unchanged): {img}")
+            updated[key] = manifest[key]
+        else:
+            pending.append((key, img, digest))
+
+    print(f"Found {len(files)} images, {len(pending)} to convert. Sizes: {settings['sizes']} "
+          f"(quality={args.quality}, formats={', '.join(formats)})")
+    jobs = args.jobs or os.cpu_count()
+    convert_args = [(img, out_dir if out_dir else img.parent, settings["sizes"], args.quality, formats, args.avif_quality)
+                    for _, img, _ in pending]
+    if jobs > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(pending))) as pool:
+            futures = [pool.submit(convert_one, *call) for call in convert_args]
+            outcomes = [attempt(future.result) for future in futures]
+    else:
+        outcomes = [attempt(convert_one, *call) for call in convert_args]
+
+    failed = 0
+    for (key, img, digest), (entry, error) in zip(pending, outcomes):
+        if error is not None:
+            print(f"✗ Error with {img}: {error}")
+            failed += 1
+            continue
+        updated[key] = dict(entry, outputs=relative_outputs(entry["outputs"], manifest_dir), sha256=digest, settings=settings)
+    save_manifest(manifest_path, updated)
+
+    if args.srcset_json or args.print_srcset:
+        items = srcsets(updated, manifest_dir, Path(args.static_root))
+        if args.srcset_json:
+            with open(args.srcset_json, "w", encoding="utf-8") as f:
+                json.dump(items, f, indent=2)
+            print(f"→ Saved: {args.srcset_json}")
+        if args.print_srcset:
+            for key, item in items.items():
+                print(f"\n<!-- {key} -->\n{picture_snippet(item, args.sizes_attr)}")
+    if failed:
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1 @@
+"""Benchmark and load-test suite for the dashboard hot path; see README.md."""
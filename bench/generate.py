@@ -0,0 +1,119 @@
+"""Synthetic portfolio data for the benchmark suite.
+
+Builds a finance.db-compatible database with `users` users, each holding `holdings`
+symbols bought and sold over `transactions` trades spread across `years` years. The users
+and transactions tables are created from the repository's finance.db schema and the app's
+migrations are applied on top, so the positions, lots and price tables match production.
+Every user logs in with BENCH_PASSWORD as bench-user-<n>.
+
+    python -m bench.generate bench.db --users 50 --holdings 20 --transactions 1000 --years 5
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import date, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from lots import rebuild_ledger
+from migrations import connect, migrate
+
+
+REPO_DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "finance.db")
+BENCH_PASSWORD = "bench"
+SYMBOL_POOL = 500
+
+
+def username(n):
+    return f"bench-user-{n}"
+
+
+def symbol(n):
+    """The n-th symbol of the stub server's universe."""
+    return f"S{n:04d}"
+
+
+def _create_schema(path):
+    source = sqlite3.connect(REPO_DATABASE)
+    try:
+        statements = [row[0] for row in source.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name IN ('users', 'transactions')")]
+    finally:
+        source.close()
+    conn = sqlite3.connect(path)
+    try:
+        for statement in statements:
+            conn.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _trades(rng, user_id, holdings, transactions, years):
+    """One user's trades, in date order, as transactions rows. About one in five is a sale."""
+    symbols = [symbol(n) for n in rng.sample(range(SYMBOL_POOL), holdings)]
+    start = date.today() - timedelta(days=int(years * 365))
+    days = sorted(rng.randrange(int(years * 365)) for _ in range(transactions))
+    held = dict.fromkeys(symbols, 0)
+    rows = []
+    for i, day in enumerate(days):
+        # Every symbol is bought once first, so each user ends up with `holdings` positions.
+        sym = symbols[i] if i < holdings else rng.choice(symbols)
+        shares = rng.randint(1, 20)
+        if i >= holdings and held[sym] > 1 and rng.random() < 0.2:
+            shares = -rng.randint(1, held[sym] - 1)
+        held[sym] += shares
+        price = round(rng.uniform(20, 400), 2)
+        rows.append((user_id, sym, shares, price, (start + timedelta(days=day)).isoformat(), "stock"))
+    return rows
+
+
+def generate(path, users=50, holdings=20, transactions=1000, years=5, seed=1):
+    """Write a fresh benchmark database to path. Returns the number of transactions written."""
+    if os.path.exists(path):
+        os.remove(path)
+    _create_schema(path)
+    migrate(path)
+
+    rng = random.Random(seed)
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    holdings = min(holdings, SYMBOL_POOL, transactions)
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN")
+        count = 0
+        for n in range(1, users + 1):
+            user_id = conn.execute("INSERT INTO users (username, hash) VALUES (?, ?)", (username(n), password_hash)).lastrowid
+            rows = _trades(rng, user_id, holdings, transactions, years)
+            conn.executemany(
+                "INSERT INTO transactions (user_id, symbol, shares, price, timestamp, asset_type) VALUES (?, ?, ?, ?, ?, ?)",
+                rows)
+            for sym in {row[1] for row in rows}:
+                rebuild_ledger(conn, user_id, sym, strict=False)
+            count += len(rows)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("path", help="database file to (re)create")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--holdings", type=int, default=20, help="symbols held per user")
+    parser.add_argument("--transactions", type=int, default=1000, help="trades per user")
+    parser.add_argument("--years", type=float, default=5, help="span of each user's trade history")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    count = generate(args.path, args.users, args.holdings, args.transactions, args.years, args.seed)
+    print(f"Wrote {args.users} users and {count} transactions to {args.path} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
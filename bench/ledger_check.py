@@ -0,0 +1,113 @@
+"""Consistency check for the lot ledger: a full rebuild must leave an incremental ledger unchanged.
+
+Logs random trade histories one trade at a time through lots.record_trade(), as buy() and
+sell() do, in an entry order that back-dates trades and logs several on one day, then
+replays each symbol with lots.rebuild_ledger() and compares lots, sales and positions.
+Exits 1 on any difference.
+
+    python -m bench.ledger_check --histories 300 --trades 25 --seed 1
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import date, timedelta
+
+from bench.generate import _create_schema
+from lots import NotEnoughShares, open_lots, rebuild_ledger, record_trade
+from migrations import connect, migrate
+
+
+SYMBOL = "CHK"
+TOLERANCE = 1e-6
+
+LEDGER_STATE = [
+    "SELECT id, remaining FROM lots WHERE user_id = ? ORDER BY id",
+    "SELECT id, cost_basis, realized_pl FROM sales WHERE user_id = ? ORDER BY id",
+    "SELECT sale_id, lot_id, shares, cost FROM lot_sales "
+    "WHERE sale_id IN (SELECT id FROM sales WHERE user_id = ?) ORDER BY sale_id, lot_id",
+    "SELECT shares, open_cost, realized_pl FROM positions WHERE user_id = ?",
+]
+
+
+def _state(conn, user_id):
+    return [conn.execute(query, (user_id,)).fetchall() for query in LEDGER_STATE]
+
+
+def _same(a, b):
+    if isinstance(a, float) or isinstance(b, float):
+        return abs(a - b) <= TOLERANCE * max(1, abs(a), abs(b))
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _log_trade(conn, rng, user_id, start, days):
+    """Log one random trade; a sale the ledger rejects is rolled back. Returns True if it was kept."""
+    day = (start + timedelta(days=rng.randrange(days))).isoformat()
+    price = round(rng.uniform(5, 100), 2)
+    if rng.random() < 0.55:
+        shares, method, lot_ids = rng.randint(1, 20), "fifo", []
+    else:
+        shares = -rng.randint(1, 15)
+        method = rng.choice(("fifo", "lifo", "specific"))
+        lots = open_lots(conn, user_id, SYMBOL)
+        lot_ids = [lot["id"] for lot in rng.sample(lots, min(len(lots), rng.randint(0, 2)))] if method == "specific" else []
+
+    conn.execute("SAVEPOINT trade")
+    try:
+        trade_id = conn.execute("INSERT INTO transactions (user_id, symbol, shares, price, timestamp) VALUES (?, ?, ?, ?, ?)",
+                                (user_id, SYMBOL, shares, price, day)).lastrowid
+        record_trade(conn, trade_id, user_id, SYMBOL, shares, price, day, method, lot_ids)
+    except NotEnoughShares:
+        conn.execute("ROLLBACK TO trade")
+        conn.execute("RELEASE trade")
+        return False
+    conn.execute("RELEASE trade")
+    return True
+
+
+def check(histories=300, trades=25, days=20, seed=1):
+    """Run the check on a scratch database. Returns the number of histories whose rebuild differed."""
+    rng = random.Random(seed)
+    mismatches = 0
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "ledger.db")
+        _create_schema(path)
+        migrate(path)
+        conn = connect(path)
+        try:
+            start = date.today() - timedelta(days=days)
+            for n in range(histories):
+                user_id = conn.execute("INSERT INTO users (username, hash) VALUES (?, '')", (f"ledger-{n}",)).lastrowid
+                for _ in range(trades):
+                    _log_trade(conn, rng, user_id, start, days)
+
+                incremental = _state(conn, user_id)
+                rebuild_ledger(conn, user_id, SYMBOL)
+                rebuilt = _state(conn, user_id)
+                if not _same(incremental, rebuilt):
+                    mismatches += 1
+                    print(f"history {n}: rebuild changed the ledger\n  incremental: {incremental}\n  rebuilt:     {rebuilt}")
+        finally:
+            conn.close()
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--histories", type=int, default=300, help="random trade histories to log")
+    parser.add_argument("--trades", type=int, default=25, help="trades logged per history")
+    parser.add_argument("--days", type=int, default=20, help="span of days the trades are dated across")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    mismatches = check(args.histories, args.trades, args.days, args.seed)
+    print(f"{mismatches} of {args.histories} histories changed on rebuild")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Scripted load against a running app, reporting latency percentiles and throughput.
+
+Each virtual user logs in as one of the generated bench users and then requests the
+scenario's pages in turn until the run ends. Samples from the warm-up period (which
+syncs price history and fills the caches) are discarded. Results can be saved as JSON
+and compared with an earlier run to fail on regressions.
+
+    python -m bench.loadtest http://127.0.0.1:5000 --users 50 --concurrency 8 --duration 30
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+import requests
+
+from bench.generate import BENCH_PASSWORD, SYMBOL_POOL, symbol, username
+
+
+# Endpoint name -> path; {symbol} is filled in with a random symbol of the stub universe.
+ENDPOINTS = {
+    "index": "/",
+    "history": "/history",
+    "stock_detail": "/stock/{symbol}",
+    "summary": "/api/portfolio/summary",
+    "growth": "/api/portfolio/growth",
+    "analytics": "/api/portfolio/analytics",
+}
+DEFAULT_SCENARIO = ("index", "history", "stock_detail")
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _virtual_user(base_url, user, scenario, warmup_until, deadline, samples, errors, seed):
+    rng = random.Random(seed)
+    client = requests.Session()
+    response = client.post(f"{base_url}/login", data={"username": username(user), "password": BENCH_PASSWORD},
+                           allow_redirects=False)
+    if response.status_code != 302:
+        errors.append(("login", f"login as {username(user)} returned {response.status_code}"))
+        return
+
+    step = 0
+    while time.monotonic() < deadline:
+        name = scenario[step % len(scenario)]
+        step += 1
+        url = base_url + ENDPOINTS[name].format(symbol=symbol(rng.randrange(SYMBOL_POOL)))
+        started = time.monotonic()
+        try:
+            response = client.get(url, allow_redirects=False)
+            ok = response.status_code == 200
+        except requests.RequestException as e:
+            ok, response = False, e
+        elapsed = time.monotonic() - started
+        if started < warmup_until:
+            continue
+        if ok:
+            samples.append((name, elapsed))
+        else:
+            errors.append((name, str(getattr(response, "status_code", response))))
+
+
+def run_load(base_url, users=50, concurrency=8, duration=30, warmup=5, scenario=DEFAULT_SCENARIO, seed=1):
+    """Drive concurrency virtual users (cycling through bench users 1..users) for warmup + duration seconds.
+
+    Returns {"duration", "concurrency", "throughput", "errors", "endpoints": {name: stats}}, where
+    stats has count, errors, mean and p50/p95/p99 in milliseconds.
+    """
+    base_url = base_url.rstrip("/")
+    samples, errors = [], []
+    warmup_until = time.monotonic() + warmup
+    deadline = warmup_until + duration
+    threads = [
+        threading.Thread(target=_virtual_user,
+                         args=(base_url, i % users + 1, scenario, warmup_until, deadline, samples, errors, seed + i))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    endpoints = {}
+    for name in scenario:
+        timings = sorted(elapsed * 1000 for endpoint, elapsed in samples if endpoint == name)
+        stats = {"count": len(timings), "errors": sum(endpoint == name for endpoint, _ in errors),
+                 "mean": sum(timings) / len(timings) if timings else None}
+        stats.update({f"p{p}": percentile(timings, p) for p in PERCENTILES})
+        endpoints[name] = stats
+    return {
+        "duration": duration,
+        "concurrency": concurrency,
+        "throughput": len(samples) / duration if duration else 0,
+        "errors": [f"{name}: {message}" for name, message in errors[:20]],
+        "endpoints": endpoints,
+    }
+
+
+def report(results, out=sys.stdout):
+    """Print results as a table."""
+    print(f"{'endpoint':<14}{'count':>8}{'errors':>8}{'mean':>10}" + "".join(f"{f'p{p}':>10}" for p in PERCENTILES), file=out)
+    for name, stats in results["endpoints"].items():
+        cells = [stats["mean"]] + [stats[f"p{p}"] for p in PERCENTILES]
+        print(f"{name:<14}{stats['count']:>8}{stats['errors']:>8}"
+              + "".join(f"{cell:>8.1f}ms" if cell is not None else f"{'-':>10}" for cell in cells), file=out)
+    print(f"throughput: {results['throughput']:.1f} req/s with {results['concurrency']} concurrent users", file=out)
+    for error in results["errors"]:
+        print(f"error: {error}", file=out)
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Endpoints whose p95 is more than tolerance slower than in baseline, as messages."""
+    regressions = []
+    for name, stats in results["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name, {}).get("p95")
+        if before and stats["p95"] is not None and stats["p95"] > before * (1 + tolerance):
+            regressions.append(f"{name}: p95 {stats['p95']:.1f}ms vs {before:.1f}ms in the baseline")
+    return regressions
+
+
+def add_output_arguments(parser):
+    parser.add_argument("--json", metavar="PATH", help="also write the results to PATH as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="fail if p95 regressed against an earlier --json file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown against the baseline")
+
+
+def add_load_arguments(parser):
+    parser.add_argument("--users", type=int, default=50, help="generated bench users to log in as")
+    parser.add_argument("--concurrency", type=int, default=8, help="virtual users requesting in parallel")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of unmeasured requests first")
+    parser.add_argument("--scenario", default=",".join(DEFAULT_SCENARIO),
+                        help=f"comma-separated endpoints to cycle through, from {', '.join(ENDPOINTS)}")
+
+
+def finish(results, args):
+    """Report results, save them and compare them with the baseline. Returns the exit status."""
+    report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 1 if results["errors"] else 0
+
+
+def parse_scenario(value):
+    scenario = tuple(name.strip() for name in value.split(",") if name.strip())
+    unknown = [name for name in scenario if name not in ENDPOINTS]
+    if unknown or not scenario:
+        raise SystemExit(f"unknown endpoint(s) in --scenario: {', '.join(unknown) or value}")
+    return scenario
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("url", help="base URL of the running app")
+    add_load_arguments(parser)
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    results = run_load(args.url, args.users, args.concurrency, args.duration, args.warmup, parse_scenario(args.scenario))
+    sys.exit(finish(results, args))
+
+
+if __name__ == "__main__":
+    main()
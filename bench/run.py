@@ -0,0 +1,82 @@
+"""One-shot benchmark: synthetic data, stub upstream, the app, and a load run against it.
+
+Generates a database in a scratch directory, starts the stub FMP/NewsAPI server and the
+Flask app (threaded, in this process) on local ports, runs the load scenario and prints
+latency percentiles per endpoint. Nothing outside the scratch directory is touched.
+
+    python -m bench.run --users 20 --holdings 25 --transactions 2000 --years 5 --latency 80 --duration 30
+"""
+
+import argparse
+import importlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+from bench.generate import generate
+from bench.loadtest import add_load_arguments, add_output_arguments, finish, parse_scenario, run_load
+from bench.stub_server import StubServer
+
+
+def start_app(workdir, database, upstream_url):
+    """Import the app configured for the benchmark and serve it on a free local port. Returns (server, url)."""
+    os.environ.update({
+        "DATABASE_PATH": database,
+        "UPSTREAM_BASE_URL": upstream_url,
+        "CACHE_PATH": os.path.join(workdir, "cache.db"),
+        "SYMBOL_INDEX_PATH": os.path.join(workdir, "symbols.json"),
+        "API_KEY": os.environ.get("API_KEY", "bench"),
+        "NEWS_API_KEY": os.environ.get("NEWS_API_KEY", "bench"),
+    })
+    # Session files land in the working directory.
+    os.chdir(workdir)
+    app = importlib.import_module("app").app
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--holdings", type=int, default=20, help="symbols held per user")
+    parser.add_argument("--transactions", type=int, default=1000, help="trades per user")
+    parser.add_argument("--years", type=float, default=5, help="span of each user's trade history")
+    parser.add_argument("--latency", type=float, default=80, help="stub upstream delay in milliseconds")
+    parser.add_argument("--jitter", type=float, default=20, help="± spread of the stub delay in milliseconds")
+    parser.add_argument("--workdir", help="scratch directory to use instead of a temporary one")
+    add_load_arguments(parser)
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    scenario = parse_scenario(args.scenario)
+    for option in ("json", "baseline"):
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="quantive-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    database = os.path.join(workdir, "bench.db")
+    started = time.perf_counter()
+    count = generate(database, args.users, args.holdings, args.transactions, args.years)
+    print(f"Generated {args.users} users, {count} transactions in {time.perf_counter() - started:.1f}s ({workdir})")
+
+    stub = StubServer(latency=args.latency, jitter=args.jitter).start()
+    server, url = start_app(workdir, database, stub.url)
+    print(f"App on {url}, stub upstream on {stub.url} ({args.latency:g}±{args.jitter:g} ms)")
+    try:
+        results = run_load(url, args.users, args.concurrency, args.duration, args.warmup, scenario)
+    finally:
+        server.shutdown()
+        stub.stop()
+    results["upstream_requests"] = stub.requests
+    print(f"upstream requests: {stub.requests}")
+    sys.exit(finish(results, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Local stand-in for the FMP and NewsAPI endpoints the app calls.
+
+Answers every endpoint with deterministic synthetic data after a configurable delay, so
+load runs measure the app rather than the providers (or their rate limits). Start the app
+with UPSTREAM_BASE_URL pointing here.
+
+    python -m bench.stub_server --port 8900 --latency 80 --jitter 20
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+import zlib
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench.generate import SYMBOL_POOL, symbol
+
+
+HISTORY_DAYS = 10 * 365
+
+
+def _base_price(sym):
+    return 20 + zlib.crc32(sym.encode()) % 380
+
+
+def quote(sym):
+    price = _base_price(sym) * (1 + (zlib.crc32(f"{sym}{date.today()}".encode()) % 200 - 100) / 2000)
+    return {"symbol": sym, "name": f"{sym} Corp", "price": round(price, 2), "previousClose": _base_price(sym),
+            "exchange": "NASDAQ"}
+
+
+def history(sym, start=None):
+    """Daily closes of sym, newest first like FMP: a seeded random walk over HISTORY_DAYS."""
+    rng = random.Random(sym)
+    price, rows = float(_base_price(sym)), []
+    today = date.today()
+    for i in range(HISTORY_DAYS):
+        day = today - timedelta(days=i)
+        if start and day.isoformat() < start:
+            break
+        price = max(1.0, price * (1 + rng.gauss(0, 0.015)))
+        if day.weekday() < 5:
+            rows.append({"date": day.isoformat(), "open": price, "high": price, "low": price,
+                         "close": round(price, 2), "volume": 1_000_000})
+    return rows
+
+
+def listings():
+    return [{"symbol": symbol(n), "name": f"{symbol(n)} Corp", "exchangeShortName": "NASDAQ", "type": "stock"}
+            for n in range(SYMBOL_POOL)]
+
+
+def route(path, query):
+    """The JSON body for a request path and query, or None for an unknown endpoint."""
+    parts = path.strip("/").split("/")
+    if path.startswith("/api/v3/quote/"):
+        return [quote(sym) for sym in urllib.parse.unquote(parts[-1]).split(",")]
+    if path.startswith("/api/v3/historical-price-full/"):
+        sym = urllib.parse.unquote(parts[-1])
+        return {"symbol": sym, "historical": history(sym, query.get("from"))}
+    if path.startswith("/api/v3/profile/"):
+        return [{"symbol": sym, "currency": "USD"} for sym in urllib.parse.unquote(parts[-1]).split(",")]
+    if path == "/api/v3/search":
+        prefix = query.get("query", "").upper()
+        return [dict(listing, currency="USD") for listing in listings() if listing["symbol"].startswith(prefix)][:10]
+    if path == "/api/v3/stock/list":
+        return listings()
+    if path == "/api/v3/symbol/available-cryptocurrencies":
+        return [{"symbol": "BTCUSD", "name": "Bitcoin USD", "currency": "USD"}]
+    if path == "/api/v3/fx":
+        return [{"ticker": "EUR/USD", "bid": 1.08, "ask": 1.08}, {"ticker": "GBP/USD", "bid": 1.27, "ask": 1.27},
+                {"ticker": "USD/JPY", "bid": 150.0, "ask": 150.0}]
+    if path == "/v2/everything":
+        return {"status": "ok", "articles": [
+            {"title": f"{query.get('q', '')} headline {i}", "url": f"https://example.com/{i}", "description": "",
+             "source": {"name": "Bench Wire"}, "publishedAt": f"{date.today()}T00:00:00Z"} for i in range(10)]}
+    return None
+
+
+class StubServer:
+    """Threaded HTTP server answering FMP/NewsAPI paths after latency ± jitter milliseconds."""
+
+    def __init__(self, port=0, latency=0, jitter=0):
+        self.latency, self.jitter = latency, jitter
+        self.requests = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                url = urllib.parse.urlsplit(self.path)
+                body = route(url.path, dict(urllib.parse.parse_qsl(url.query)))
+                delay = max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)) / 1000
+                if delay:
+                    time.sleep(delay)
+                payload = json.dumps(body if body is not None else {"error": "not found"}).encode()
+                self.send_response(200 if body is not None else 404)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="bench-stub", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=80, help="mean response delay in milliseconds")
+    parser.add_argument("--jitter", type=float, default=20, help="uniform ± spread of the delay in milliseconds")
+    args = parser.parse_args()
+
+    stub = StubServer(args.port, args.latency, args.jitter)
+    print(f"Stub FMP/NewsAPI listening on {stub.url} ({args.latency:g}±{args.jitter:g} ms)")
+    try:
+        stub.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
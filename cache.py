@@ -0,0 +1,330 @@
+"""Market-data cache shared by the helpers that call FMP and NewsAPI.
+
+Entries live in a namespace ("quote", "search", "historical", "news") that sets their TTL.
+Two backends are available: an in-process LRU dict, and a SQLite file that every gunicorn
+worker on the host reads and writes, so a quote fetched by one worker is a hit for the rest.
+
+get_or_fetch() coalesces misses: only one fetch per key is in flight at a time (threads in
+a process share a flight, processes share a lease row in the SQLite backend) and everyone
+else waits for its result. Namespaces can opt into stale-while-revalidate, where an expired
+entry is returned at once while a single background refresh runs.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from metrics import count
+
+
+NAMESPACE_TTLS = {
+    "quote": timedelta(minutes=5),
+    # Quotes polled for the live price stream; its poll interval.
+    "live": timedelta(seconds=15),
+    "search": timedelta(hours=1),
+    "historical": timedelta(days=1),
+    "news": timedelta(minutes=30),
+    "fx": timedelta(days=1),
+    "profile": timedelta(days=7),
+    # Keyed by a fingerprint of the inputs, so entries never go stale; the TTL only bounds their lifetime.
+    "analytics": timedelta(days=1),
+}
+DEFAULT_TTL = timedelta(minutes=5)
+
+# Expired entries are kept this long before a sweep removes them.
+STALE_GRACE = timedelta(days=1)
+
+# How long past expiry an entry may still be served while it is refreshed in the background,
+# for namespaces that opt in (CACHE_STALE_WHILE_REVALIDATE=1).
+STALE_WHILE_REVALIDATE = {
+    "quote": timedelta(minutes=10),
+    "search": timedelta(hours=12),
+    "historical": timedelta(days=1),
+    "news": timedelta(hours=1),
+}
+
+_refresh_pool = ThreadPoolExecutor(max_workers=2)
+
+
+class MemoryBackend:
+    """Per-process LRU store bounded by entry count."""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def sweep(self, before):
+        with self._lock:
+            for key in [k for k, (_, expires_at) in self._entries.items() if expires_at < before]:
+                del self._entries[key]
+
+    # A per-process store has no other processes to coordinate with; in-process
+    # coalescing is done by MarketCache itself.
+    def acquire_lease(self, key, seconds):
+        return True
+
+    def release_lease(self, key):
+        pass
+
+    def lease_held(self, key):
+        return False
+
+
+class SQLiteBackend:
+    """Store entries as JSON in a SQLite file shared by all worker processes."""
+
+    # Only bump an entry's access time when it is older than this, so hot reads stay read-only.
+    TOUCH_INTERVAL = 60
+    SWEEP_EVERY = 200
+
+    def __init__(self, path="cache.db", max_entries=20000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_entries_accessed ON cache_entries (accessed_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_leases (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT value, expires_at, accessed_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[2] > self.TOUCH_INTERVAL:
+            conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires_at):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, separators=(",", ":")), expires_at, time.time()))
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            self.sweep(time.time() - STALE_GRACE.total_seconds())
+
+    def sweep(self, before):
+        conn = self._connect()
+        conn.execute("DELETE FROM cache_entries WHERE expires_at < ?", (before,))
+        conn.execute(
+            "DELETE FROM cache_entries WHERE key IN ("
+            "SELECT key FROM cache_entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        conn.execute("DELETE FROM cache_leases WHERE expires_at < ?", (time.time(),))
+
+    def acquire_lease(self, key, seconds):
+        """Claim the right to fetch key for the next seconds; False if another process holds it."""
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO cache_leases (key, expires_at) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at WHERE cache_leases.expires_at < ?",
+            (key, now + seconds, now))
+        return cursor.rowcount == 1
+
+    def release_lease(self, key):
+        self._connect().execute("DELETE FROM cache_leases WHERE key = ?", (key,))
+
+    def lease_held(self, key):
+        row = self._connect().execute("SELECT expires_at FROM cache_leases WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] >= time.time()
+
+
+class _Flight:
+    """A fetch in progress that other threads can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+class MarketCache:
+    """Namespaced cache with per-namespace TTLs on top of a storage backend."""
+
+    # Longest a fetch may hold its key before waiters give up on it.
+    LEASE_SECONDS = 15
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, backend, ttls=None, stale_while_revalidate=None):
+        self.backend = backend
+        self.ttls = dict(NAMESPACE_TTLS, **(ttls or {}))
+        self.stale_while_revalidate = stale_while_revalidate or {}
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def _key(self, namespace, key):
+        return f"{namespace}:{key}"
+
+    def get(self, namespace, key, allow_stale=False):
+        """Return the cached value, or None if it is missing or expired.
+
+        With allow_stale=True an expired entry that hasn't been swept yet is returned too;
+        the helpers use that to keep serving data while an upstream provider is down.
+        """
+        entry = self.backend.get(self._key(namespace, key))
+        if entry is None:
+            count("quantive_cache_requests_total", namespace=namespace, result="miss")
+            return None
+        value, expires_at = entry
+        if expires_at < time.time():
+            count("quantive_cache_requests_total", namespace=namespace, result="stale" if allow_stale else "miss")
+            return value if allow_stale else None
+        count("quantive_cache_requests_total", namespace=namespace, result="hit")
+        return value
+
+    def set(self, namespace, key, value):
+        """Store value under namespace/key for that namespace's TTL."""
+        ttl = self.ttls.get(namespace, DEFAULT_TTL)
+        self.backend.set(self._key(namespace, key), value, time.time() + ttl.total_seconds())
+
+    def get_or_fetch(self, namespace, key, fetch):
+        """Return the cached value for key, calling fetch() on a miss and caching its result.
+
+        Concurrent misses on the same key share one fetch(). A None result is not cached.
+        """
+        return self.get_or_fetch_many(namespace, [key], lambda keys: {key: fetch()})[key]
+
+    def get_or_fetch_many(self, namespace, keys, fetch_many):
+        """Batch form of get_or_fetch(): fetch_many(missing_keys) returns {key: value}.
+
+        Returns {key: value} for every key, with None where nothing could be fetched.
+        Exceptions from fetch_many propagate to the caller that ran it; callers that were
+        waiting on that fetch get None.
+        """
+        results, missing, stale = {}, [], []
+        now = time.time()
+        window = self.stale_while_revalidate.get(namespace)
+        for key in keys:
+            entry = self.backend.get(self._key(namespace, key))
+            if entry is not None and entry[1] >= now:
+                results[key] = entry[0]
+            elif entry is not None and window and now - entry[1] < window.total_seconds():
+                results[key] = entry[0]
+                stale.append(key)
+            else:
+                missing.append(key)
+
+        for result, n in (("hit", len(results) - len(stale)), ("stale", len(stale)), ("miss", len(missing))):
+            if n:
+                count("quantive_cache_requests_total", n, namespace=namespace, result=result)
+        if stale:
+            _refresh_pool.submit(self._fetch_coalesced, namespace, stale, fetch_many)
+        if missing:
+            results.update(self._fetch_coalesced(namespace, missing, fetch_many))
+        return results
+
+    def _fetch_coalesced(self, namespace, keys, fetch_many):
+        """Fetch keys nobody in this process is fetching yet and wait for the others."""
+        led, waiting = {}, {}
+        with self._flights_lock:
+            for key in keys:
+                flight = self._flights.get(self._key(namespace, key))
+                if flight is not None:
+                    waiting[key] = flight
+                else:
+                    led[key] = self._flights[self._key(namespace, key)] = _Flight()
+
+        results = {}
+        try:
+            if led:
+                results.update(self._fetch_leased(namespace, list(led), fetch_many))
+        finally:
+            with self._flights_lock:
+                for key, flight in led.items():
+                    flight.value = results.get(key)
+                    del self._flights[self._key(namespace, key)]
+                    flight.done.set()
+
+        for key, flight in waiting.items():
+            flight.done.wait(self.LEASE_SECONDS)
+            results[key] = flight.value
+        return {key: results.get(key) for key in keys}
+
+    def _fetch_leased(self, namespace, keys, fetch_many):
+        """Fetch keys whose lease this process wins; wait for other processes holding the rest."""
+        results, to_fetch, peers = {}, [], []
+        now = time.time()
+        for key in keys:
+            entry = self.backend.get(self._key(namespace, key))
+            if entry is not None and entry[1] >= now:
+                # Someone refreshed it between our miss and claiming the flight.
+                results[key] = entry[0]
+            elif self.backend.acquire_lease(self._key(namespace, key), self.LEASE_SECONDS):
+                to_fetch.append(key)
+            else:
+                peers.append(key)
+
+        try:
+            if to_fetch:
+                fetched = fetch_many(to_fetch)
+                for key in to_fetch:
+                    value = fetched.get(key)
+                    if value is not None:
+                        self.set(namespace, key, value)
+                        results[key] = value
+        finally:
+            for key in to_fetch:
+                self.backend.release_lease(self._key(namespace, key))
+
+        deadline = time.time() + self.LEASE_SECONDS
+        while peers and time.time() < deadline:
+            time.sleep(self.POLL_INTERVAL)
+            now = time.time()
+            for key in list(peers):
+                # Read the backend directly: these keys were already counted as misses.
+                entry = self.backend.get(self._key(namespace, key))
+                if entry is not None and entry[1] >= now:
+                    results[key] = entry[0]
+                    peers.remove(key)
+                elif not self.backend.lease_held(self._key(namespace, key)):
+                    # The other process finished without a value; don't wait for nothing.
+                    peers.remove(key)
+        return results
+
+
+def create_cache():
+    """Build the app's cache from CACHE_BACKEND ("sqlite" or "memory"), CACHE_PATH, CACHE_MAX_ENTRIES
+    and CACHE_STALE_WHILE_REVALIDATE ("1" to serve expired entries while refreshing them)."""
+    backend_name = os.environ.get("CACHE_BACKEND", "sqlite")
+    max_entries = int(os.environ.get("CACHE_MAX_ENTRIES", 20000))
+
+    if backend_name == "memory":
+        backend = MemoryBackend(max_entries=max_entries)
+    elif backend_name == "sqlite":
+        backend = SQLiteBackend(os.environ.get("CACHE_PATH", "cache.db"), max_entries=max_entries)
+    else:
+        raise RuntimeError(f"unknown CACHE_BACKEND: {backend_name}")
+    swr = STALE_WHILE_REVALIDATE if os.environ.get("CACHE_STALE_WHILE_REVALIDATE") == "1" else None
+    return MarketCache(backend, stale_while_revalidate=swr)
@@ -0,0 +1,72 @@
+"""Data access for the request hot path: per-thread connections and prepared statements.
+
+cs50's SQL wrapper tokenizes every statement with sqlparse, logs it and builds a dict per
+row on each call. Database instead keeps one sqlite3 connection per thread, opened with
+migrations.connect so the usual pragmas apply, whose statement cache holds every query
+the app runs in prepared form: after its first use a query skips parsing and planning.
+Rows come back as sqlite3.Row, which indexes by position or column name (and so works
+in templates) without building a dict; convert with dict(row) where JSON is needed.
+"""
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import record_span, span
+from migrations import connect
+
+
+# Enough to keep every distinct statement the app issues prepared at once.
+STATEMENT_CACHE_SIZE = 256
+
+
+class Database:
+    """Queries and transactions on the SQLite file at path."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def query(self, sql, *params):
+        """All rows of a SELECT."""
+        with span("db"):
+            return self._connect().execute(sql, params).fetchall()
+
+    def query_one(self, sql, *params):
+        """The first row of a SELECT, or None."""
+        with span("db"):
+            return self._connect().execute(sql, params).fetchone()
+
+    def execute(self, sql, *params):
+        """Run one statement in its own implicit transaction; returns the cursor (lastrowid, rowcount)."""
+        with span("db"):
+            return self._connect().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """Run the enclosed statements on the yielded connection atomically, rolling back on error.
+
+        The write lock is taken up front (BEGIN IMMEDIATE), so a transaction that reads
+        before writing cannot fail halfway with SQLITE_BUSY. The block is timed as one db span.
+        """
+        conn = self._connect()
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            record_span("db", time.perf_counter() - started)
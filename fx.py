@@ -0,0 +1,204 @@
+"""Daily FX rates for valuing holdings in a user's base currency.
+
+Rates are stored in finance.db as US dollars per unit of each currency, one row per
+currency per day. FMP returns every pair it quotes in a single call, so today's rates for
+all currencies come from one batched request a day, shared by every worker through the
+market cache. A currency's history before that is backfilled once from its daily pair
+series. Converting a holding or a growth curve is then a lookup in stored rates, never an
+upstream call per request.
+"""
+
+import logging
+import os
+import threading
+import urllib.parse
+from datetime import date, timedelta
+
+import pandas as pd
+import requests
+
+import upstream
+from helpers import history_pool
+from migrations import connect
+
+
+logger = logging.getLogger(__name__)
+
+FX_URL = "https://financialmodelingprep.com/api/v3/fx"
+HISTORY_URL = "https://financialmodelingprep.com/api/v3/historical-price-full"
+
+# Currencies a user can pick as the base their portfolio is valued in.
+BASE_CURRENCIES = ("USD", "EUR", "GBP", "JPY", "CHF", "CAD", "AUD", "NZD", "HKD", "SGD",
+                   "SEK", "NOK", "DKK", "CNY", "INR", "KRW", "BRL", "MXN", "ZAR", "ILS")
+
+# Listings quoted in a currency's minor unit: currency -> (major currency, minor units per major unit).
+MINOR_UNITS = {"GBp": ("GBP", 100), "GBX": ("GBP", 100), "ILA": ("ILS", 100), "ZAc": ("ZAR", 100)}
+
+# Rows this far before a series' start are read too, so its first days have a rate to carry forward.
+LOOKBACK = timedelta(days=10)
+
+
+def major_unit(currency):
+    """(major currency, minor units per major unit) for a listing currency."""
+    return MINOR_UNITS.get(currency, (currency, 1))
+
+
+class FxStore:
+    """Daily USD rates per currency, plus how far back each currency's history has been filled."""
+
+    def __init__(self, path="finance.db"):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def save(self, rows, replace=True):
+        """Store (date, currency, usd_rate) rows. With replace=False existing days are kept."""
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(f"{verb} INTO fx_rates (currency, date, usd_rate) VALUES (?, ?, ?)",
+                             [(currency, day, rate) for day, currency, rate in rows])
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def history_from(self, currency):
+        """Earliest date currency's history has been backfilled from, or None."""
+        row = self._connect().execute("SELECT history_from FROM fx_history WHERE currency = ?", (currency,)).fetchone()
+        return row[0] if row else None
+
+    def mark_history(self, currency, start):
+        self._connect().execute(
+            "INSERT INTO fx_history (currency, history_from) VALUES (?, ?) "
+            "ON CONFLICT (currency) DO UPDATE SET history_from = MIN(history_from, excluded.history_from)",
+            (currency, start))
+
+    def latest(self):
+        """The most recent stored rate of every currency, as {currency: usd_rate}."""
+        rows = self._connect().execute(
+            "SELECT currency, usd_rate FROM fx_rates r "
+            "WHERE date = (SELECT MAX(date) FROM fx_rates WHERE currency = r.currency)")
+        return dict(rows)
+
+    def frame(self, currencies, start):
+        """Stored rates of currencies from shortly before start, as a (date x currency) frame."""
+        currencies = sorted(currencies)
+        placeholders = ",".join("?" * len(currencies))
+        rows = self._connect().execute(
+            f"SELECT date, currency, usd_rate FROM fx_rates WHERE currency IN ({placeholders}) AND date >= ?",
+            (*currencies, (start - LOOKBACK).isoformat())).fetchall()
+        frame = pd.DataFrame(rows, columns=["date", "currency", "usd_rate"])
+        frame["date"] = pd.to_datetime(frame["date"])
+        return frame.pivot_table(index="date", columns="currency", values="usd_rate").reindex(columns=currencies)
+
+
+def _mid(raw):
+    """Midpoint of a raw FMP FX quote, falling back to its open."""
+    try:
+        bid, ask = float(raw["bid"]), float(raw["ask"])
+        if bid > 0 and ask > 0:
+            return (bid + ask) / 2
+    except (KeyError, TypeError, ValueError):
+        pass
+    return float(raw.get("open") or 0) or None
+
+
+def _fetch_latest(store):
+    """Fetch today's rates for every currency in one FMP call and store them. Returns {currency: usd_rate}."""
+    data = upstream.get_json(f"{FX_URL}?apikey={os.environ.get('API_KEY')}")
+    rates = {}
+    for raw in data or []:
+        base, _, quote = (raw.get("ticker") or "").upper().partition("/")
+        mid = _mid(raw)
+        if not mid:
+            continue
+        if quote == "USD" and base:
+            rates[base] = mid
+        elif base == "USD" and quote:
+            rates.setdefault(quote, 1 / mid)
+    if not rates:
+        raise ValueError("FX response had no USD rates")
+    store.save([(date.today().isoformat(), currency, rate) for currency, rate in rates.items()])
+    return rates
+
+
+def latest_rates(store, cache):
+    """USD per unit of each currency, refreshed by a single batched FMP call at most once a day."""
+    try:
+        rates = cache.get_or_fetch("fx", "latest", lambda: _fetch_latest(store))
+    except (requests.RequestException, ValueError) as e:
+        logger.error("Exception during FX rate fetch: %s", e)
+        rates = None
+    if rates is None:
+        rates = cache.get("fx", "latest", allow_stale=True) or store.latest()
+    return dict(rates, USD=1.0)
+
+
+def conversion_rates(currencies, base, store, cache):
+    """Factor converting an amount in each of currencies into base; None where no rate is known.
+
+    Rates are only looked up when some currency differs from base.
+    """
+    factors = {currency: 1.0 for currency in currencies if currency == base}
+    if len(factors) < len(set(currencies)):
+        rates = latest_rates(store, cache)
+        for currency in set(currencies) - set(factors):
+            major, units = major_unit(currency)
+            to_usd, base_to_usd = rates.get(major), rates.get(base)
+            factors[currency] = to_usd / units / base_to_usd if to_usd and base_to_usd else None
+    return factors
+
+
+def _fetch_history(currency, start):
+    """Daily (date, usd_rate) rows for currency since start, from its USD pair (or the inverse pair)."""
+    api_key = os.environ.get("API_KEY")
+    for pair, invert in ((f"{currency}USD", False), (f"USD{currency}", True)):
+        url = f"{HISTORY_URL}/{urllib.parse.quote_plus(pair)}?from={start.isoformat()}&apikey={api_key}"
+        data = upstream.get_json(url)
+        historical = data.get("historical", []) if isinstance(data, dict) else []
+        rows = [(item["date"], 1 / item["close"] if invert else item["close"])
+                for item in historical if item.get("date") and item.get("close")]
+        if rows:
+            return rows
+    return []
+
+
+def _backfill(currency, start, store):
+    try:
+        rows = _fetch_history(currency, start)
+    except (requests.RequestException, ValueError) as e:
+        logger.error("Exception during FX history fetch for %s: %s", currency, e)
+        return
+    # Days already stored by the daily fetch keep their rate.
+    store.save([(day, currency, rate) for day, rate in rows], replace=False)
+    store.mark_history(currency, start.isoformat())
+
+
+def rate_history(currencies, base, start, store, cache):
+    """Daily factors converting into base from start on, as a (date x key) frame.
+
+    currencies maps each key (e.g. a symbol) to its currency. Currencies whose history does
+    not reach back to start are backfilled first, concurrently and once; a key whose
+    currency has no rate at all is left as NaN.
+    """
+    majors = {major_unit(currency)[0] for currency in currencies.values()} | {base}
+    majors.discard("USD")
+    latest_rates(store, cache)
+    missing = [major for major in majors if (store.history_from(major) or "9999") > start.isoformat()]
+    list(history_pool.map(lambda major: _backfill(major, start, store), missing))
+
+    usd = store.frame(majors, start) if majors else pd.DataFrame()
+    usd["USD"] = 1.0
+    usd = usd.sort_index().ffill().bfill()
+    return pd.DataFrame({
+        key: usd[major_unit(currency)[0]] / major_unit(currency)[1] / usd[base]
+        for key, currency in currencies.items()
+    }, index=usd.index)
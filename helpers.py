@@ -1,11 +1,21 @@
+import base64
+import json
+import logging
 import os
 import requests
 import urllib.parse
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 
+from contextlib import contextmanager
 from flask import redirect, render_template, request, session
 from functools import wraps
 
+import upstream
+
+
+logger = logging.getLogger(__name__)
+
 
 def apology(message, code=400):
     """Render message as an apology to user."""
@@ -36,130 +46,284 @@ def login_required(f):
     return decorated_function
 
 
-def lookup(symbol, cache):
-    """Look up quote for symbol using FMP API."""
-    if symbol in cache:
-        data, timestamp = cache[symbol]
-        if datetime.now() - timestamp < timedelta(minutes=5):
-            return data
-
+@contextmanager
+def transaction(db):
+    """Run the enclosed db.execute() calls in one transaction, rolling back on error."""
+    db.execute("BEGIN TRANSACTION")
     try:
-        api_key = os.environ.get("API_KEY")
-        url = f"https://financialmodelingprep.com/api/v3/quote/{urllib.parse.quote_plus(symbol)}?apikey={api_key}"
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-
-        if not data:
-            return None
-
-        quote = data[0]
-        price = quote.get("price")
-
-        if price is None:
-            return None
-
-        result = {
-            "name": quote.get("name"),
-            "price": float(price),
-            "symbol": quote.get("symbol"),
-            "previous_close": float(quote["previousClose"]) if "previousClose" in quote and quote["previousClose"] is not None else None
-        }
-
-        cache[symbol] = (result, datetime.now())
-        return result
-    except (requests.RequestException, ValueError, IndexError, KeyError, TypeError):
+        yield
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+
+QUOTE_BATCH_SIZE = 50
+# Quote and profile lookups block a page render; see upstream.get_json(interactive=True).
+QUOTE_TIMEOUT = (3.05, 4)
+
+# Quote and profile batches a page is waiting on. Slow history syncs and prefetches go to
+# history_pool instead, so an interactive lookup never queues behind them.
+fetch_pool = ThreadPoolExecutor(max_workers=8)
+history_pool = ThreadPoolExecutor(max_workers=8)
+
+
+def _map_batches(fetch, batches):
+    """fetch() over batches on fetch_pool; a lone batch runs inline rather than waiting for a free thread."""
+    if len(batches) == 1:
+        return [fetch(batches[0])]
+    return fetch_pool.map(fetch, batches)
+
+
+def _parse_quote(quote):
+    """Turn a raw FMP quote into the dict the app works with, or None if it has no price."""
+    price = quote.get("price")
+    if price is None:
         return None
 
-def search_symbols(keywords, asset_type, cache):
-    """Search for stock or crypto symbols using FMP API by changing the API endpoint parameters."""
-    cache_key = f"search_{asset_type}_{keywords}"
+    return {
+        "name": quote.get("name"),
+        "price": float(price),
+        "symbol": quote.get("symbol"),
+        "previous_close": float(quote["previousClose"]) if "previousClose" in quote and quote["previousClose"] is not None else None
+    }
 
-    if cache_key in cache:
-        data, timestamp = cache[cache_key]
-        if datetime.now() - timestamp < timedelta(hours=1):
-            return data
 
+def _fetch_quote_batch(symbols):
+    """Fetch quotes for up to QUOTE_BATCH_SIZE symbols in one FMP call, keyed by upper-case symbol."""
     try:
         api_key = os.environ.get("API_KEY")
+        joined = ",".join(urllib.parse.quote_plus(symbol) for symbol in symbols)
+        url = f"https://financialmodelingprep.com/api/v3/quote/{joined}?apikey={api_key}"
+        data = upstream.get_json(url, timeout=QUOTE_TIMEOUT, interactive=True)
+
+        quotes = {}
+        for raw in data or []:
+            quote = _parse_quote(raw)
+            if quote and quote["symbol"]:
+                quotes[quote["symbol"].upper()] = quote
+        return quotes
+    except (requests.RequestException, ValueError, IndexError, KeyError, TypeError, AttributeError):
+        return {}
 
-        base_url = f"https://financialmodelingprep.com/api/v3/search?query={urllib.parse.quote_plus(keywords)}&limit=10&apikey={api_key}"
 
-        if asset_type == "crypto":
-            url = f"{base_url}&exchange=CRYPTO"
-        else:
-            url = base_url
+def _fetch_quotes(symbols):
+    """Fetch quotes for symbols in concurrent batches, as symbol -> quote (None if unresolved)."""
+    batches = [symbols[i:i + QUOTE_BATCH_SIZE] for i in range(0, len(symbols), QUOTE_BATCH_SIZE)]
+    fetched = {}
+    for quotes in _map_batches(_fetch_quote_batch, batches):
+        fetched.update(quotes)
+    return {symbol: fetched.get(symbol.upper()) for symbol in symbols}
 
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
 
-        if asset_type == 'stock':
-            matches = [match for match in data if match.get("currency") == "USD"]
-        else:
-            matches = data
+def lookup_many(symbols, cache):
+    """Look up quotes for several symbols using FMP's multi-symbol quote endpoint.
+
+    Cached quotes are reused; the rest are requested in batches that run concurrently,
+    so the cost stays at roughly one round trip however many symbols are asked for.
+    Returns a dict of symbol -> quote containing only the symbols that resolved.
+    """
+    results = {}
+    for symbol, quote in cache.get_or_fetch_many("quote", list(dict.fromkeys(symbols)), _fetch_quotes).items():
+        if quote is None:
+            # Upstream failed or skipped it: an expired quote beats no quote.
+            quote = cache.get("quote", symbol, allow_stale=True)
+        if quote is not None:
+            results[symbol] = quote
+    return results
 
-        cache[cache_key] = (matches, datetime.now())
-        return matches
-    except (requests.RequestException, ValueError):
-        return []
 
-def get_historical_data(symbol, cache):
-    """Get historical daily price data for a symbol and return it as a dict."""
-    cache_key = f"historical_{symbol}"
+def refresh_quotes(symbols, cache):
+    """Fetch fresh quotes for symbols and write them to the cache regardless of what is cached.
+
+    Returns the number of quotes refreshed.
+    """
+    fetched = _fetch_quotes(list(dict.fromkeys(symbols)))
+    for symbol, quote in fetched.items():
+        if quote is not None:
+            cache.set("quote", symbol, quote)
+    return sum(quote is not None for quote in fetched.values())
 
-    if cache_key in cache:
-        data, timestamp = cache[cache_key]
-        if datetime.now() - timestamp < timedelta(days=1):
-            print(f"DEBUG: Using CACHED historical data for '{symbol}'")
-            return data
 
-    print(f"DEBUG: Making NEW API call to FMP for historical data: '{symbol}'")
+def live_quotes(symbols, cache):
+    """Quotes no older than the "live" namespace's TTL, for the price stream.
+
+    Polls from every worker are coalesced into one batched call per TTL, and what it fetches
+    also refreshes the regular quote cache. Returns a dict of symbol -> quote.
+    """
+    def fetch(batch):
+        fetched = _fetch_quotes(batch)
+        for symbol, quote in fetched.items():
+            if quote is not None:
+                cache.set("quote", symbol, quote)
+        return fetched
+
+    quotes = cache.get_or_fetch_many("live", list(dict.fromkeys(symbols)), fetch)
+    return {symbol: quote for symbol, quote in quotes.items() if quote is not None}
+
+
+def lookup(symbol, cache):
+    """Look up quote for symbol using FMP API."""
+    return lookup_many([symbol], cache).get(symbol)
+
+
+def _fetch_profile_batch(symbols):
+    """Trading currency of up to QUOTE_BATCH_SIZE symbols from one FMP company profile call."""
     try:
         api_key = os.environ.get("API_KEY")
-        url = f"https://financialmodelingprep.com/api/v3/historical-price-full/{urllib.parse.quote_plus(symbol)}?apikey={api_key}"
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        joined = ",".join(urllib.parse.quote_plus(symbol) for symbol in symbols)
+        url = f"https://financialmodelingprep.com/api/v3/profile/{joined}?apikey={api_key}"
+        data = upstream.get_json(url, timeout=QUOTE_TIMEOUT, interactive=True)
+        currencies = {(raw.get("symbol") or "").upper(): raw.get("currency") for raw in data or []}
+        # A symbol FMP has no profile for is taken to trade in USD.
+        return {symbol: currencies.get(symbol.upper()) or "USD" for symbol in symbols}
+    except (requests.RequestException, ValueError, TypeError, AttributeError):
+        return {}
+
 
-        historical_list = []
-        if isinstance(data, dict) and 'historical' in data:
-            historical_list = data.get("historical", [])
-        elif isinstance(data, list):
-            historical_list = data
+def _fetch_profiles(symbols):
+    batches = [symbols[i:i + QUOTE_BATCH_SIZE] for i in range(0, len(symbols), QUOTE_BATCH_SIZE)]
+    fetched = {}
+    for currencies in _map_batches(_fetch_profile_batch, batches):
+        fetched.update(currencies)
+    return fetched
 
-        price_dict = {item['date']: item['close'] for item in historical_list if 'date' in item and 'close' in item}
 
-        cache[cache_key] = (price_dict, datetime.now())
-        return price_dict
+def listing_currencies(symbols, cache, index=None):
+    """Currency each symbol is quoted in, from the local symbol index or FMP's company profiles.
+
+    Returns symbol -> currency code, with None for a symbol whose currency could not be fetched.
+    """
+    currencies, missing = {}, []
+    for symbol in dict.fromkeys(symbols):
+        currency = index.currency(symbol) if index is not None else None
+        if currency:
+            currencies[symbol] = currency
+        else:
+            missing.append(symbol)
+    if missing:
+        currencies.update(cache.get_or_fetch_many("profile", missing, _fetch_profiles))
+    return currencies
+
+def search_symbols(keywords, asset_type, cache, index=None):
+    """Search for stock or crypto symbols, from the local symbol index when it has matches and the FMP API otherwise."""
+    if index is not None:
+        index.refresh_if_stale(cache)
+        matches = index.search(keywords, asset_type)
+        if matches:
+            return matches
+
+    cache_key = f"{asset_type}_{keywords}"
+
+    def fetch():
+        api_key = os.environ.get("API_KEY")
+
+        base_url = f"https://financialmodelingprep.com/api/v3/search?query={urllib.parse.quote_plus(keywords)}&limit=10&apikey={api_key}"
+
+        if asset_type == "crypto":
+            url = f"{base_url}&exchange=CRYPTO"
+        else:
+            url = base_url
+
+        return upstream.get_json(url)
+
+    try:
+        matches = cache.get_or_fetch("search", cache_key, fetch)
+    except (requests.RequestException, ValueError):
+        matches = None
+    if matches is None:
+        matches = cache.get("search", cache_key, allow_stale=True)
+    return matches or []
+
+def _sync_historical(symbol, store):
+    """Bring symbol's stored history up to date (at most once a day) and return its closes."""
+    last_date, synced_on = store.sync_state(symbol)
+    if synced_on == date.today().isoformat():
+        return store.closes(symbol)
+
+    logger.debug("Making NEW API call to FMP for historical data: '%s' (from %s)", symbol, last_date or 'start')
+    api_key = os.environ.get("API_KEY")
+    url = f"https://financialmodelingprep.com/api/v3/historical-price-full/{urllib.parse.quote_plus(symbol)}?apikey={api_key}"
+    if last_date:
+        # Re-request the last stored day too, in case its close was still provisional.
+        url += f"&from={last_date}"
+    data = upstream.get_json(url)
+
+    historical_list = []
+    if isinstance(data, dict) and 'historical' in data:
+        historical_list = data.get("historical", [])
+    elif isinstance(data, list):
+        historical_list = data
+
+    store.save(symbol, historical_list)
+    return store.closes(symbol)
+
+def get_historical_data(symbol, cache, store):
+    """Get historical daily price data for a symbol and return it as a dict.
+
+    History is kept in the persistent price store; FMP is only asked for the days
+    after the last stored date, at most once per symbol per day.
+    """
+    try:
+        price_dict = cache.get_or_fetch("historical", symbol, lambda: _sync_historical(symbol, store))
     except (requests.RequestException, ValueError) as e:
-        print(f"ERROR: Exception during historical data fetch for {symbol}: {e}")
-        return {}
+        logger.error("Exception during historical data fetch for %s: %s", symbol, e)
+        price_dict = None
+    if price_dict is None:
+        # Fetch failed here or in the request we waited on: fall back to what is stored.
+        price_dict = store.closes(symbol)
+    return price_dict
+
+def get_historical_data_many(symbols, cache, store):
+    """Get historical daily price data for several symbols concurrently, as symbol -> dict."""
+    symbols = list(dict.fromkeys(symbols))
+    return dict(zip(symbols, history_pool.map(lambda symbol: get_historical_data(symbol, cache, store), symbols)))
 
 def get_stock_news(company_name, cache):
     """Get recent news for a company name using NewsAPI.org."""
-    cache_key = f"news_{company_name}"
+    def fetch():
+        api_key = os.environ.get("NEWS_API_KEY")
+        url = f"https://newsapi.org/v2/everything?q={urllib.parse.quote_plus(company_name)}&sortBy=publishedAt&pageSize=10&apiKey={api_key}"
 
-    if cache_key in cache:
-        data, timestamp = cache[cache_key]
-        if datetime.now() - timestamp < timedelta(minutes=30):
-            return data
+        data = upstream.get_json(url)
+        return data.get("articles", [])
 
     try:
-        api_key = os.environ.get("NEWS_API_KEY")
-        url = f"https://newsapi.org/v2/everything?q={urllib.parse.quote_plus(company_name)}&sortBy=publishedAt&pageSize=10&apiKey={api_key}"
+        news_data = cache.get_or_fetch("news", company_name, fetch)
+    except (requests.RequestException, ValueError, AttributeError):
+        news_data = None
+    if news_data is None:
+        news_data = cache.get("news", company_name, allow_stale=True)
+    return news_data or []
 
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
 
-        news_data = data.get("articles", [])
-        cache[cache_key] = (news_data, datetime.now())
-        return news_data
-    except (requests.RequestException, ValueError):
-        return []
+def encode_cursor(timestamp, row_id):
+    """Encode a (timestamp, id) keyset position as an opaque URL-safe token."""
+    return base64.urlsafe_b64encode(json.dumps([timestamp, row_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Decode a token from encode_cursor(); raises ValueError if it is malformed."""
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(timestamp, str) or not isinstance(row_id, int):
+        raise ValueError("invalid cursor")
+    return timestamp, row_id
 
 
 def usd(value):
     """Format value as USD."""
     return f"${value:,.2f}"
+
+
+CURRENCY_SYMBOLS = {"USD": "$", "EUR": "€", "GBP": "£", "JPY": "¥", "INR": "₹", "KRW": "₩", "ILS": "₪"}
+
+
+def money(value, currency="USD"):
+    """Format value as an amount of currency."""
+    if currency == "USD":
+        return usd(value)
+    symbol = CURRENCY_SYMBOLS.get(currency)
+    return f"{symbol}{value:,.2f}" if symbol else f"{value:,.2f} {currency}"
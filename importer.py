@@ -0,0 +1,175 @@
+"""Bulk import of transactions from a CSV file (e.g. a broker statement export).
+
+Expected columns: symbol, shares, price, date (YYYY-MM-DD), and optionally asset_type
+(stock or crypto, default stock) and side (buy or sell). Without a side column, negative
+shares are sales. The file is read BATCH_ROWS rows at a time: each batch is parsed, the
+symbols it introduces are validated with one quote API call, and its valid rows are staged
+in a file-backed temporary table, so memory stays bounded however large the upload is.
+The staged rows are then copied into transactions with one INSERT ... SELECT per symbol in
+a single transaction, after which that symbol's lot ledger is replayed once. Prices are in
+each symbol's listing currency, which is looked up in the same batched way. Invalid rows
+are skipped and counted; the first MAX_REPORTED_ERRORS are reported with their line number.
+"""
+
+import csv
+import itertools
+import math
+from datetime import date, datetime
+
+from helpers import listing_currencies, lookup_many
+from lots import NotEnoughShares, rebuild_ledger
+from snapshots import invalidate_snapshots
+
+
+REQUIRED_COLUMNS = {"symbol", "shares", "price", "date"}
+ASSET_TYPES = {"stock", "crypto"}
+BATCH_ROWS = 1000
+MAX_REPORTED_ERRORS = 500
+
+CREATE_STAGING = ("CREATE TEMP TABLE import_rows (line_num INTEGER PRIMARY KEY, symbol TEXT NOT NULL, "
+                  "shares REAL NOT NULL, price REAL NOT NULL, date TEXT NOT NULL, asset_type TEXT NOT NULL)")
+
+
+def parse_row(row):
+    """Turn one CSV row into (symbol, shares, price, date_str, asset_type); raises ValueError with the reason."""
+    symbol = (row.get("symbol") or "").strip().upper()
+    if not symbol:
+        raise ValueError("missing symbol")
+
+    try:
+        shares = float(row.get("shares") or "")
+        price = float(row.get("price") or "")
+    except ValueError:
+        raise ValueError("shares and price must be numbers")
+    if not (math.isfinite(shares) and math.isfinite(price)):
+        raise ValueError("shares and price must be finite numbers")
+    if shares == 0 or price <= 0:
+        raise ValueError("shares must be non-zero and price positive")
+
+    side = (row.get("side") or "").strip().lower()
+    if side == "buy":
+        shares = abs(shares)
+    elif side == "sell":
+        shares = -abs(shares)
+    elif side:
+        raise ValueError(f"unknown side '{side}'")
+
+    date_str = (row.get("date") or "").strip()
+    try:
+        transaction_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError("date must be YYYY-MM-DD")
+    if transaction_date > date.today():
+        raise ValueError("date cannot be in the future")
+
+    asset_type = (row.get("asset_type") or "stock").strip().lower()
+    if asset_type not in ASSET_TYPES:
+        raise ValueError(f"unknown asset_type '{asset_type}'")
+
+    return symbol, shares, price, date_str, asset_type
+
+
+class _Errors:
+    """Skipped-row count plus the first MAX_REPORTED_ERRORS (line_number, message) pairs."""
+
+    def __init__(self):
+        self.count = 0
+        self.listed = []
+
+    def add(self, line_num, message):
+        self.count += 1
+        if len(self.listed) < MAX_REPORTED_ERRORS:
+            self.listed.append((line_num, message))
+
+
+def _stage(conn, cache, reader, errors):
+    """Parse, validate and stage the CSV rows in import_rows, one batch at a time."""
+    known, unknown = set(), set()
+    while batch := list(itertools.islice(reader, BATCH_ROWS)):
+        records = []
+        for line_num, row in batch:
+            row = {(key or "").strip().lower(): value for key, value in row.items()}
+            try:
+                records.append((line_num, *parse_row(row)))
+            except ValueError as e:
+                errors.add(line_num, str(e))
+
+        # One batched quote lookup for the distinct symbols this batch introduces instead of one call per row.
+        new_symbols = sorted({record[1] for record in records} - known - unknown)
+        if new_symbols:
+            found = lookup_many(new_symbols, cache)
+            known.update(symbol for symbol in new_symbols if symbol in found)
+            unknown.update(symbol for symbol in new_symbols if symbol not in found)
+        for record in records:
+            if record[1] not in known:
+                errors.add(record[0], f"unknown symbol '{record[1]}'")
+        conn.executemany("INSERT INTO import_rows VALUES (?, ?, ?, ?, ?, ?)",
+                         [record for record in records if record[1] in known])
+    return sorted(known)
+
+
+def import_transactions(conn, cache, user_id, text_stream, index=None):
+    """Import CSV text_stream into user_id's transactions over sqlite3 connection conn.
+
+    index is the symbol index consulted for listing currencies before FMP. conn should be
+    opened for this import: its temporary tables are kept on disk.
+
+    Returns {"imported": count, "skipped": count, "errors": [(line_number, message), ...]},
+    with at most MAX_REPORTED_ERRORS errors listed, sorted by line number.
+    Raises csv.Error or UnicodeDecodeError for a file that is not readable CSV.
+    """
+    reader = csv.DictReader(text_stream)
+    columns = {name.strip().lower() for name in reader.fieldnames or []}
+    missing = REQUIRED_COLUMNS - columns
+    if missing:
+        return {"imported": 0, "skipped": 0, "errors": [(1, f"missing column(s): {', '.join(sorted(missing))}")]}
+
+    errors = _Errors()
+    # Staged rows spill to a temporary file rather than memory; this only takes effect before the
+    # connection's first temporary table, hence a connection of its own.
+    conn.execute("PRAGMA temp_store = FILE")
+    conn.execute(CREATE_STAGING)
+    try:
+        symbols = _stage(conn, cache, ((reader.line_num, row) for row in reader), errors)
+        currencies = listing_currencies(symbols, cache, index)
+        imported = _insert(conn, user_id, symbols, currencies, errors)
+    finally:
+        conn.execute("DROP TABLE temp.import_rows")
+
+    return {"imported": imported, "skipped": errors.count, "errors": sorted(errors.listed)}
+
+
+def _insert(conn, user_id, symbols, currencies, errors):
+    """Copy the staged rows into transactions, one symbol at a time. Returns the number imported."""
+    imported = 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for symbol in symbols:
+            # A symbol whose sales the lots held before them cannot cover is skipped as a whole.
+            conn.execute("SAVEPOINT import_symbol")
+            rows = conn.execute(
+                "INSERT INTO transactions (user_id, symbol, shares, price, timestamp, asset_type) "
+                "SELECT ?, symbol, shares, price, date, asset_type FROM import_rows WHERE symbol = ? ORDER BY line_num",
+                (user_id, symbol)).rowcount
+            if not rows:
+                conn.execute("RELEASE import_symbol")
+                continue
+            try:
+                rebuild_ledger(conn, user_id, symbol)
+            except NotEnoughShares as e:
+                conn.execute("ROLLBACK TO import_symbol")
+                for (line_num,) in conn.execute("SELECT line_num FROM import_rows WHERE symbol = ?", (symbol,)):
+                    errors.add(line_num, f"{e}; {symbol} skipped")
+            else:
+                imported += rows
+                first_date = conn.execute("SELECT MIN(date) FROM import_rows WHERE symbol = ?", (symbol,)).fetchone()[0]
+                invalidate_snapshots(conn, user_id, first_date)
+                if currencies.get(symbol):
+                    conn.execute("INSERT OR REPLACE INTO listing_currencies (symbol, currency) VALUES (?, ?)",
+                                 (symbol, currencies[symbol]))
+            conn.execute("RELEASE import_symbol")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return imported
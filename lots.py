@@ -0,0 +1,190 @@
+"""Lot ledger: exact cost basis and realized P/L per sale.
+
+Every purchase opens a lot with its own remaining quantity and cost per share. A sale
+consumes open lots that came before it (acquired on an earlier day, or logged earlier on
+the same day, i.e. with a lower transaction id) in FIFO, LIFO or specific-ID order (chosen
+lots first, then FIFO for any remainder); lot_sales records what it took from each lot and
+sales its method and realized P/L. Trades are replayed in (date, id) order, so a trade
+logged after every sale dated on or after it only touches the open lots it consumes. One
+dated before an existing sale, or a deleted transaction, replays that symbol's ledger
+from its transactions instead; either way the ledger depends only on the trades.
+
+positions.open_cost (cost of the shares still held) and positions.realized_pl are kept in
+step, so the dashboard and sell() read cost basis without scanning the trade history.
+
+The functions accept either the cs50 SQL wrapper or a plain sqlite3 connection, and never
+open a transaction themselves.
+"""
+
+from helpers import transaction
+from positions import REFRESH_POSITION, apply_trade, execute
+
+
+LOT_METHODS = ("fifo", "lifo", "specific")
+
+# Order in which each method consumes open lots. :lot_ids is ",id,id," for specific ID.
+LOT_ORDER = {
+    "fifo": "acquired, id",
+    "lifo": "acquired DESC, id DESC",
+    "specific": "instr(:lot_ids, ',' || id || ',') = 0, instr(:lot_ids, ',' || id || ','), acquired, id",
+}
+
+# Fractional quantities below this are float residue, not shares. Also the open_lots index predicate.
+OPEN_LOT = "remaining > 1e-9"
+EPSILON = 1e-9
+
+CREATE_LEDGER = [
+    "CREATE TABLE IF NOT EXISTS lots ("
+    "id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, symbol TEXT NOT NULL, acquired TEXT NOT NULL, "
+    "quantity REAL NOT NULL, remaining REAL NOT NULL, cost_per_share REAL NOT NULL)",
+    f"CREATE INDEX IF NOT EXISTS lots_open ON lots (user_id, symbol, acquired, id) WHERE {OPEN_LOT}",
+    "CREATE INDEX IF NOT EXISTS lots_user_symbol ON lots (user_id, symbol)",
+    "CREATE TABLE IF NOT EXISTS sales ("
+    "id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, symbol TEXT NOT NULL, sold_on TEXT NOT NULL, "
+    "method TEXT NOT NULL, lot_ids TEXT, cost_basis REAL NOT NULL DEFAULT 0, realized_pl REAL NOT NULL DEFAULT 0)",
+    "CREATE INDEX IF NOT EXISTS sales_user_symbol_date ON sales (user_id, symbol, sold_on)",
+    "CREATE TABLE IF NOT EXISTS lot_sales ("
+    "sale_id INTEGER NOT NULL, lot_id INTEGER NOT NULL, shares REAL NOT NULL, cost REAL NOT NULL, "
+    "PRIMARY KEY (sale_id, lot_id)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS lot_sales_lot ON lot_sales (lot_id)",
+]
+
+MATCH_SALE = f"""
+    INSERT INTO lot_sales (sale_id, lot_id, shares, cost)
+    SELECT :sale_id, id, MIN(remaining, :shares - before), MIN(remaining, :shares - before) * cost_per_share
+    FROM (SELECT id, remaining, cost_per_share,
+                 SUM(remaining) OVER (ORDER BY {{order}} ROWS UNBOUNDED PRECEDING) - remaining AS before
+          FROM lots WHERE user_id = :user_id AND symbol = :symbol AND {OPEN_LOT}
+                AND (acquired < :sold_on OR (acquired = :sold_on AND id < :sale_id)))
+    WHERE before < :shares - {EPSILON}"""
+
+
+class NotEnoughShares(ValueError):
+    """A sale needs more shares than the lots open before it hold."""
+
+
+def _lot_ids_text(lot_ids):
+    return f",{','.join(str(lot_id) for lot_id in lot_ids)}," if lot_ids else None
+
+
+def _add_lot(db, lot_id, user_id, symbol, acquired, shares, price):
+    execute(db,
+            "INSERT INTO lots (id, user_id, symbol, acquired, quantity, remaining, cost_per_share) "
+            "VALUES (:id, :user_id, :symbol, :acquired, :shares, :shares, :price)",
+            id=lot_id, user_id=user_id, symbol=symbol, acquired=acquired, shares=shares, price=price)
+    execute(db, "UPDATE positions SET open_cost = open_cost + :cost WHERE user_id = :user_id AND symbol = :symbol",
+            cost=shares * price, user_id=user_id, symbol=symbol)
+
+
+def _match_sale(db, sale_id, user_id, symbol, shares, price, sold_on, method, lot_ids, strict):
+    """Consume open lots for one sale and book its realized P/L. Returns the realized P/L."""
+    lot_ids = _lot_ids_text(lot_ids) if method == "specific" else None
+    params = dict(sale_id=sale_id, user_id=user_id, symbol=symbol, shares=shares, sold_on=sold_on)
+    if method == "specific":
+        params["lot_ids"] = lot_ids or ","
+    execute(db, MATCH_SALE.format(order=LOT_ORDER[method]), **params)
+
+    matched = execute(db, "SELECT COALESCE(SUM(shares), 0) AS shares, COALESCE(SUM(cost), 0) AS cost "
+                      "FROM lot_sales WHERE sale_id = :sale_id", sale_id=sale_id)[0]
+    if strict and matched["shares"] < shares - EPSILON:
+        raise NotEnoughShares(f"only {matched['shares']:g} {symbol} shares were held on {sold_on}")
+
+    execute(db,
+            "UPDATE lots SET remaining = remaining - "
+            "(SELECT shares FROM lot_sales WHERE sale_id = :sale_id AND lot_id = lots.id) "
+            "WHERE id IN (SELECT lot_id FROM lot_sales WHERE sale_id = :sale_id)", sale_id=sale_id)
+
+    # Shares no lot could cover (only tolerated when replaying inconsistent history) carry no P/L.
+    realized_pl = matched["shares"] * price - matched["cost"]
+    execute(db,
+            "INSERT OR REPLACE INTO sales (id, user_id, symbol, sold_on, method, lot_ids, cost_basis, realized_pl) "
+            "VALUES (:id, :user_id, :symbol, :sold_on, :method, :lot_ids, :cost, :realized_pl)",
+            id=sale_id, user_id=user_id, symbol=symbol, sold_on=sold_on, method=method,
+            lot_ids=lot_ids, cost=matched["cost"], realized_pl=realized_pl)
+    execute(db,
+            "UPDATE positions SET open_cost = open_cost - :cost, realized_pl = realized_pl + :realized_pl "
+            "WHERE user_id = :user_id AND symbol = :symbol",
+            cost=matched["cost"], realized_pl=realized_pl, user_id=user_id, symbol=symbol)
+    return realized_pl
+
+
+def record_trade(db, trade_id, user_id, symbol, shares, price, date_str, method="fifo", lot_ids=()):
+    """Apply a just-inserted transaction (shares < 0 for a sale) to the position and the ledger.
+
+    Returns the sale's realized P/L (0 for a purchase). Raises NotEnoughShares if a sale, or
+    a later sale replayed after it, cannot be covered by the lots open before it.
+    """
+    apply_trade(db, user_id, symbol, shares, price)
+
+    # Sales on the same day were logged earlier, so they come first and are unaffected.
+    out_of_order = execute(db, "SELECT 1 FROM sales WHERE user_id = :user_id AND symbol = :symbol AND sold_on > :date LIMIT 1",
+                           user_id=user_id, symbol=symbol, date=date_str)
+    if out_of_order:
+        if shares < 0:
+            # Recorded first so the replay knows how this sale picks its lots.
+            execute(db, "INSERT INTO sales (id, user_id, symbol, sold_on, method, lot_ids) "
+                    "VALUES (:id, :user_id, :symbol, :sold_on, :method, :lot_ids)",
+                    id=trade_id, user_id=user_id, symbol=symbol, sold_on=date_str, method=method,
+                    lot_ids=_lot_ids_text(lot_ids))
+        rebuild_ledger(db, user_id, symbol)
+        if shares > 0:
+            return 0
+        return execute(db, "SELECT realized_pl FROM sales WHERE id = :id", id=trade_id)[0]["realized_pl"]
+
+    if shares > 0:
+        _add_lot(db, trade_id, user_id, symbol, date_str, shares, price)
+        return 0
+    return _match_sale(db, trade_id, user_id, symbol, -shares, price, date_str, method, lot_ids, strict=True)
+
+
+def rebuild_ledger(db, user_id, symbol, strict=True):
+    """Replay one symbol's lots and sales from its transactions, in (date, id) order.
+
+    Each sale keeps the method it was recorded with (FIFO when it has none). With strict,
+    raises NotEnoughShares when a sale cannot be covered; otherwise books what it can.
+    """
+    params = dict(user_id=user_id, symbol=symbol)
+    sales = execute(db,
+                    "SELECT t.id, -t.shares AS shares, t.price, DATE(t.timestamp) AS sold_on, "
+                    "COALESCE(s.method, 'fifo') AS method, s.lot_ids "
+                    "FROM transactions t LEFT JOIN sales s ON s.id = t.id "
+                    "WHERE t.user_id = :user_id AND t.symbol = :symbol AND t.shares < 0 ORDER BY DATE(t.timestamp), t.id",
+                    **params)
+    execute(db, "DELETE FROM lot_sales WHERE lot_id IN (SELECT id FROM lots WHERE user_id = :user_id AND symbol = :symbol)", **params)
+    execute(db, "DELETE FROM sales WHERE user_id = :user_id AND symbol = :symbol", **params)
+    execute(db, "DELETE FROM lots WHERE user_id = :user_id AND symbol = :symbol", **params)
+    execute(db,
+            "INSERT INTO lots (id, user_id, symbol, acquired, quantity, remaining, cost_per_share) "
+            "SELECT id, user_id, symbol, DATE(timestamp), shares, shares, price FROM transactions "
+            "WHERE user_id = :user_id AND symbol = :symbol AND shares > 0", **params)
+    for statement in REFRESH_POSITION:
+        execute(db, statement, **params)
+
+    for sale in sales:
+        lot_ids = [int(lot_id) for lot_id in (sale["lot_ids"] or "").split(",") if lot_id]
+        _match_sale(db, sale["id"], user_id, symbol, sale["shares"], sale["price"], sale["sold_on"],
+                    sale["method"], lot_ids, strict)
+
+    execute(db,
+            f"UPDATE positions SET "
+            f"open_cost = (SELECT COALESCE(SUM(remaining * cost_per_share), 0) FROM lots "
+            f"WHERE user_id = :user_id AND symbol = :symbol AND {OPEN_LOT}), "
+            f"realized_pl = (SELECT COALESCE(SUM(realized_pl), 0) FROM sales WHERE user_id = :user_id AND symbol = :symbol) "
+            f"WHERE user_id = :user_id AND symbol = :symbol", **params)
+
+
+def rebuild_ledgers(db):
+    """Replay every user's positions and lots from the transactions table. Returns the number of positions."""
+    with transaction(db):
+        db.execute("DELETE FROM positions")
+        for row in db.execute("SELECT DISTINCT user_id, symbol FROM transactions"):
+            rebuild_ledger(db, row["user_id"], row["symbol"], strict=False)
+        return db.execute("SELECT COUNT(*) AS n FROM positions")[0]["n"]
+
+
+def open_lots(db, user_id, symbol):
+    """The user's open lots of symbol, oldest first, with their remaining quantity and cost per share."""
+    return execute(db,
+                   f"SELECT id, acquired, remaining, cost_per_share FROM lots "
+                   f"WHERE user_id = :user_id AND symbol = :symbol AND {OPEN_LOT} ORDER BY acquired, id",
+                   user_id=user_id, symbol=symbol)
@@ -0,0 +1,226 @@
+"""Request instrumentation: timing spans, counters, a Prometheus /metrics endpoint and sampled profiling.
+
+Each request's time is split into spans by kind (db, upstream, template). They are
+summed per request and returned in a Server-Timing header, so browser dev tools show
+where one page's time went, and they are recorded in histograms with request durations
+and cache and upstream counters. /metrics exposes everything in the Prometheus text
+format. Metrics are kept per process, so with several gunicorn workers each scrape sees
+the worker that answered it.
+
+With a profile sample rate above zero, that fraction of requests runs under cProfile
+and its stats are written to the profile directory for `python -m pstats`.
+"""
+
+import cProfile
+import hmac
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import Response, abort, g, has_request_context, request, before_render_template, template_rendered
+
+
+logger = logging.getLogger(__name__)
+
+# Peer addresses /metrics answers without a token when loopback access is switched on.
+LOOPBACK = {"127.0.0.1", "::1"}
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DESCRIPTIONS = {
+    "quantive_requests_total": ("counter", "HTTP requests by endpoint, method and status."),
+    "quantive_request_duration_seconds": ("histogram", "Time to build a response, by endpoint."),
+    "quantive_span_duration_seconds": ("histogram", "Time spent in database, upstream and template spans."),
+    "quantive_upstream_requests_total": ("counter", "Upstream API calls by host and outcome."),
+    "quantive_cache_requests_total": ("counter", "Market cache lookups by namespace and result (hit, stale, miss)."),
+    "quantive_profiled_requests_total": ("counter", "Requests run under the sampling profiler."),
+}
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Registry:
+    """Thread-safe counters and fixed-bucket histograms, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        # (name, labels) -> [count per bucket..., count, sum]
+        self.histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            self.counters[name, _labels(labels)] += amount
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(values)) for key, values in self.histograms.items())
+
+        lines, described = [], set()
+
+        def describe(name):
+            if name not in described and name in DESCRIPTIONS:
+                kind, text = DESCRIPTIONS[name]
+                lines.extend([f"# HELP {name} {text}", f"# TYPE {name} {kind}"])
+            described.add(name)
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), values in histograms:
+            describe(name)
+            for bound, n in zip(BUCKETS, values):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {n}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {values[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {values[-2]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {values[-1]:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def count(name, amount=1, **labels):
+    """Add amount to a counter."""
+    registry.inc(name, amount, **labels)
+
+
+def record_span(kind, elapsed):
+    """Record elapsed seconds spent in a span of kind, adding it to the current request's totals."""
+    registry.observe("quantive_span_duration_seconds", elapsed, kind=kind)
+    if has_request_context():
+        spans = g.setdefault("spans", {})
+        total, calls = spans.get(kind, (0.0, 0))
+        spans[kind] = (total + elapsed, calls + 1)
+
+
+@contextmanager
+def span(kind):
+    """Time the enclosed block as a span of kind."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(kind, time.perf_counter() - started)
+
+
+class TimedSQL:
+    """A cs50 SQL object whose execute() calls are timed as db spans."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def execute(self, sql, *args, **kwargs):
+        with span("db"):
+            return self._db.execute(sql, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+class Instrumentation:
+    """Request hooks, template timing, sampled profiling and the /metrics route for a Flask app."""
+
+    def __init__(self, app, profile_rate=0.0, profile_dir="profiles", token=None, allow_loopback=False):
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        self.token = token
+        self.allow_loopback = allow_loopback
+        # cProfile can only trace one request at a time; a sampled request that finds it busy runs unprofiled.
+        self._profiler_lock = threading.Lock()
+        self._profile_ids = itertools.count(1)
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._stop_profiler)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+    def _start(self):
+        g.request_started = time.perf_counter()
+        if self.profile_rate and random.random() < self.profile_rate and self._profiler_lock.acquire(blocking=False):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def _finish(self, response):
+        started = g.get("request_started")
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or "unmatched"
+        count("quantive_requests_total", endpoint=endpoint, method=request.method, status=response.status_code)
+        registry.observe("quantive_request_duration_seconds", elapsed, endpoint=endpoint)
+
+        timings = [f'{kind};dur={total * 1000:.1f};desc="{calls} call{"s" if calls != 1 else ""}"'
+                   for kind, (total, calls) in sorted(g.get("spans", {}).items())]
+        response.headers["Server-Timing"] = ", ".join(timings + [f"total;dur={elapsed * 1000:.1f}"])
+        return response
+
+    def _stop_profiler(self, exc):
+        # A teardown hook, so the profiler is released even when the view raised.
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return
+        profiler.disable()
+        self._profiler_lock.release()
+        endpoint = request.endpoint or "unmatched"
+        elapsed = time.perf_counter() - g.get("request_started", time.perf_counter())
+        count("quantive_profiled_requests_total", endpoint=endpoint)
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{elapsed * 1000:.0f}ms-{os.getpid()}-{next(self._profile_ids)}.prof")
+            profiler.dump_stats(path)
+            logger.info("Profiled %s %s in %.1f ms: %s", request.method, request.path, elapsed * 1000, path)
+        except OSError as e:
+            logger.error("Could not save profile: %s", e)
+
+    def _template_started(self, sender, template, context, **extra):
+        g.setdefault("template_started", []).append(time.perf_counter())
+
+    def _template_finished(self, sender, template, context, **extra):
+        stack = g.get("template_started")
+        if not stack:
+            return
+        record_span("template", time.perf_counter() - stack.pop())
+
+    def metrics_view(self):
+        """Prometheus scrape endpoint; requires `Authorization: Bearer <token>`.
+
+        Without a token it is a 404, unless loopback access was switched on explicitly: then it
+        answers peers on the machine itself. That is only private when no reverse proxy on the
+        same host forwards to the app, since proxied requests arrive from loopback too.
+        """
+        if self.token:
+            if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {self.token}"):
+                abort(401)
+        elif not (self.allow_loopback and request.remote_addr in LOOPBACK):
+            abort(404)
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,120 @@
+"""Schema migrations and connection settings for finance.db.
+
+The schema version is kept in SQLite's user_version pragma. migrate() runs on startup
+and applies every step above the stored version, one transaction per step, so each
+gunicorn worker can call it safely: whoever takes the write lock first does the work.
+"""
+
+import sqlite3
+
+from lots import CREATE_LEDGER, rebuild_ledger
+from positions import AGGREGATE_COLUMNS, CREATE_POSITIONS, REALIZED_PL
+from snapshots import CREATE_SNAPSHOTS
+
+
+BUSY_TIMEOUT_MS = 15000
+
+
+def connect(path, cached_statements=128):
+    """Open a sqlite3 connection with the app's per-connection pragmas applied."""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False,
+                           cached_statements=cached_statements)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def _indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS transactions_user_symbol_time ON transactions (user_id, symbol, timestamp)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users (username)")
+
+
+def _price_history(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS price_history ("
+        "symbol TEXT NOT NULL, date TEXT NOT NULL, open REAL, high REAL, low REAL, close REAL NOT NULL, "
+        "volume REAL, PRIMARY KEY (symbol, date)) WITHOUT ROWID")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS price_history_sync ("
+        "symbol TEXT PRIMARY KEY NOT NULL, last_date TEXT, synced_on TEXT NOT NULL)")
+
+
+def _positions(conn):
+    conn.execute(CREATE_POSITIONS)
+    conn.execute("DELETE FROM positions")
+    conn.execute(
+        f"INSERT INTO positions (user_id, symbol, shares, total_cost, shares_bought, sale_proceeds) "
+        f"SELECT user_id, symbol, {AGGREGATE_COLUMNS} FROM transactions GROUP BY user_id, symbol")
+    conn.execute(f"UPDATE positions SET {REALIZED_PL}")
+
+
+def _history_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS transactions_user_time_id ON transactions (user_id, timestamp, id)")
+
+
+def _rebuild_ledgers(conn):
+    # Existing histories may hold sales no earlier purchase covers; book what can be matched.
+    for user_id, symbol in conn.execute("SELECT DISTINCT user_id, symbol FROM transactions").fetchall():
+        rebuild_ledger(conn, user_id, symbol, strict=False)
+
+
+def _lot_ledger(conn):
+    for statement in CREATE_LEDGER:
+        conn.execute(statement)
+    conn.execute("ALTER TABLE positions ADD COLUMN open_cost REAL NOT NULL DEFAULT 0")
+    _rebuild_ledgers(conn)
+
+
+def _currencies(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS fx_rates ("
+        "currency TEXT NOT NULL, date TEXT NOT NULL, usd_rate REAL NOT NULL, PRIMARY KEY (currency, date)) WITHOUT ROWID")
+    conn.execute("CREATE TABLE IF NOT EXISTS fx_history (currency TEXT PRIMARY KEY NOT NULL, history_from TEXT NOT NULL)")
+    # Symbols not listed here trade in USD, as every listing did before other currencies were supported.
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS listing_currencies (symbol TEXT PRIMARY KEY NOT NULL, currency TEXT NOT NULL) WITHOUT ROWID")
+    conn.execute("ALTER TABLE users ADD COLUMN base_currency TEXT NOT NULL DEFAULT 'USD'")
+
+
+def _snapshots(conn):
+    # Starts empty: the first chart request or nightly batch after the upgrade fills it.
+    conn.execute(CREATE_SNAPSHOTS)
+
+
+# (version, description, step). Append new steps; never edit one that has shipped.
+MIGRATIONS = [
+    (1, "transactions and users indexes", _indexes),
+    (2, "price history store", _price_history),
+    (3, "materialized positions", _positions),
+    (4, "history keyset index", _history_index),
+    (5, "FIFO lot ledger", _lot_ledger),
+    (6, "FX rates and listing currencies", _currencies),
+    (7, "daily portfolio snapshots", _snapshots),
+    # Sales booked before a purchase logged later on the same day could have matched it.
+    (8, "lot ledger in (date, id) order", _rebuild_ledgers),
+]
+
+
+def migrate(path):
+    """Switch the database to WAL and apply any pending migrations. Returns the schema version."""
+    conn = connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        for version, description, step in MIGRATIONS:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                    conn.execute("ROLLBACK")
+                    continue
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                raise RuntimeError(f"migration {version} ({description}) failed: {e}") from e
+            print(f"Applied migration {version}: {description}")
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
@@ -0,0 +1,218 @@
+"""Portfolio calculations behind the dashboard: holdings valuation and the vectorized growth curve."""
+
+import logging
+from datetime import datetime, date, timedelta
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+def summarize_holdings(positions, quotes, rates=None, base_costs=None):
+    """Value each open position at its live quote and total up the dashboard figures.
+
+    positions are rows with symbol, total_shares and cost_basis (what the shares still held
+    cost, from their lots); quotes maps symbol -> quote. rates optionally maps symbol -> the
+    factor converting its prices into the base currency (None when no rate is known); each
+    holding carries the factor it was valued at. base_costs optionally maps symbol -> the
+    cost basis already in the base currency, from lot_costs(); other symbols' cost basis is
+    converted at rates too. Positions without a quote or a rate are left out.
+    """
+    grand_total_value = 0
+    total_pl = 0
+    total_daily_pl = 0
+    total_invested = 0
+    holdings = []
+
+    for row in positions:
+        quote = quotes.get(row["symbol"])
+
+        if not quote:
+            logger.warning("Could not retrieve quote for %s. Skipping this holding.", row['symbol'])
+            continue
+
+        rate = rates.get(row["symbol"], 1.0) if rates is not None else 1.0
+        if rate is None:
+            logger.warning("No FX rate for %s. Skipping this holding.", row['symbol'])
+            continue
+
+        cost_basis = (base_costs or {}).get(row["symbol"], row["cost_basis"] * rate)
+        avg_price = cost_basis / row["total_shares"] if row["total_shares"] > 0 else 0
+
+        price = quote["price"] * rate
+        current_value = row["total_shares"] * price
+        unrealized_pl = current_value - (row["total_shares"] * avg_price)
+
+        previous_close_safe = quote.get("previous_close", quote["price"]) * rate
+        daily_pl = (price - previous_close_safe) * row["total_shares"]
+
+        position_cost_basis = row["total_shares"] * avg_price
+        total_pl_pct_for_holding = (unrealized_pl / position_cost_basis) * 100 if position_cost_basis > 0 else 0
+
+        price_change_abs = price - previous_close_safe
+        price_change_pct = (price_change_abs / previous_close_safe) * 100 if previous_close_safe > 0 else 0
+
+        holdings.append({
+            "symbol": row["symbol"], "shares": row["total_shares"], "price": price,
+            "avg_price": avg_price, "total_value": current_value, "total_pl": unrealized_pl,
+            "daily_pl": daily_pl, "price_change_abs": price_change_abs, "price_change_pct": price_change_pct,
+            "total_pl_pct": total_pl_pct_for_holding, "rate": rate
+        })
+
+        grand_total_value += current_value
+        total_pl += unrealized_pl
+        total_daily_pl += daily_pl
+        total_invested += position_cost_basis
+
+    total_pl_pct = (total_pl / total_invested) * 100 if total_invested > 0 else 0
+    yesterday_value = grand_total_value - total_daily_pl
+    total_daily_pl_pct = (total_daily_pl / yesterday_value) * 100 if yesterday_value > 0 else 0
+
+    return {
+        "holdings": holdings,
+        "grand_total": grand_total_value,
+        "total_pl": total_pl,
+        "total_daily_pl": total_daily_pl,
+        "total_pl_pct": total_pl_pct,
+        "total_daily_pl_pct": total_daily_pl_pct,
+        "distribution": {
+            "labels": [h['symbol'] for h in holdings],
+            "values": [h['total_value'] for h in holdings],
+        },
+    }
+
+
+def lot_costs(lots, rates):
+    """Cost of the open lots per symbol in the base currency, each lot converted at the rate of the day it was bought.
+
+    lots are rows with symbol, acquired ('YYYY-MM-DD') and cost in the listing currency;
+    rates is a (date x symbol) frame of daily factors, as from fx.rate_history(). Symbols
+    with a lot that has no rate are left out. Returns {symbol: cost}.
+    """
+    if not lots:
+        return {}
+    tx = pd.DataFrame(lots, columns=["symbol", "acquired", "cost"])
+    tx["acquired"] = pd.to_datetime(tx["acquired"])
+    rates = rates.sort_index()
+    rates = rates.reindex(rates.index.union(pd.DatetimeIndex(tx["acquired"].unique()))).ffill().bfill()
+    trade_rates = rates.stack().reindex(pd.MultiIndex.from_arrays([tx["acquired"], tx["symbol"]]))
+    tx["cost"] = tx["cost"].astype("float64") * trade_rates.to_numpy()
+
+    costs = tx.groupby("symbol")["cost"]
+    converted = costs.count() == costs.size()
+    return {symbol: float(cost) for symbol, cost in costs.sum()[converted].items()}
+
+
+def sample_dates(start_date, end_date):
+    """Return the dates plotted on the growth chart: daily, weekly or monthly depending on the span."""
+    time_span_days = (end_date - start_date).days
+    if time_span_days > 365 * 2:
+        delta, time_unit = timedelta(days=30), 'month'
+    elif time_span_days > 90:
+        delta, time_unit = timedelta(days=7), 'week'
+    else:
+        delta, time_unit = timedelta(days=1), 'day'
+
+    dates = []
+    current_date = start_date
+    while current_date <= end_date:
+        last_added_date = dates[-1] if dates else None
+        if time_unit == 'week' and last_added_date and current_date.isocalendar()[:2] == last_added_date.isocalendar()[:2]:
+            current_date += timedelta(days=1)
+            continue
+        if time_unit == 'month' and last_added_date and (current_date.year, current_date.month) == (last_added_date.year, last_added_date.month):
+            current_date += timedelta(days=1)
+            continue
+        dates.append(current_date)
+        current_date += delta
+    return dates
+
+
+def price_frame(historical_prices, start, index):
+    """Align every symbol's close prices on index, carrying the last known close forward from start (or from its first)."""
+    series = {}
+    for symbol, prices in historical_prices.items():
+        s = pd.Series(prices, dtype="float64")
+        s.index = pd.to_datetime(s.index)
+        # A zero or missing close counts as "no price that day", as it always has on the chart.
+        series[symbol] = s[(s.index >= start) & (s > 0)] if start is not None else s[s > 0]
+    if not series:
+        return pd.DataFrame(index=index)
+
+    frame = pd.DataFrame(series).sort_index()
+    return frame.reindex(frame.index.union(index)).ffill().reindex(index)
+
+
+def portfolio_values(transactions, prices, rates=None):
+    """Value and cost basis of the portfolio on every date of prices' index, in one vectorized pass.
+
+    transactions are rows with symbol, shares, price and date ('YYYY-MM-DD') sorted by date;
+    prices is a (date x symbol) frame of closes from price_frame(). rates is an optional
+    (date x symbol) frame of daily factors converting each symbol's prices into the base
+    currency; closes and purchase costs are converted at the rate of their own day. Only
+    symbols with a prices column are counted. Returns (values, cost_basis) arrays.
+    """
+    index = prices.index
+    tx = pd.DataFrame(transactions, columns=["symbol", "shares", "price", "date"])
+    tx = tx[tx["symbol"].isin(list(prices.columns))]
+    if tx.empty:
+        return np.zeros(len(index)), np.zeros(len(index))
+    tx["date"] = pd.to_datetime(tx["date"])
+    tx["shares"] = tx["shares"].astype("float64")
+    tx["cost"] = np.where(tx["shares"] > 0, tx["shares"] * tx["price"].astype("float64"), 0.0)
+
+    if rates is not None:
+        # One frame holding the rate in force on every sampled date and every trade date.
+        rates = rates.sort_index()
+        rates = rates.reindex(rates.index.union(index).union(pd.DatetimeIndex(tx["date"].unique()))).ffill().bfill()
+        trade_rates = rates.stack().reindex(pd.MultiIndex.from_arrays([tx["date"], tx["symbol"]]))
+        tx["cost"] = (tx["cost"] * trade_rates.to_numpy()).fillna(0)
+
+    shares = (tx.pivot_table(index="date", columns="symbol", values="shares", aggfunc="sum")
+              .fillna(0).cumsum()
+              .reindex(index, method="ffill").fillna(0))
+    cost_basis = (tx.groupby("date")["cost"].sum().cumsum()
+                  .reindex(index, method="ffill").fillna(0).to_numpy())
+
+    if rates is not None:
+        prices = prices * rates.reindex(index=index, columns=prices.columns)
+    prices = prices.reindex(columns=shares.columns).fillna(0)
+
+    held = shares.where(shares > 0, 0).to_numpy()
+    return (held * prices.to_numpy()).sum(axis=1), cost_basis
+
+
+def growth_points(index, values, cost_basis):
+    """The growth chart's labels, values and % growth for the dates of index, leaving out days worth nothing."""
+    values, cost_basis = np.asarray(values, dtype="float64"), np.asarray(cost_basis, dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.where(cost_basis > 0, (values - cost_basis) / cost_basis * 100, 0.0)
+
+    mask = values > 0
+    return {
+        "labels": [d.strftime('%Y-%m-%d') for d in index[mask]],
+        "values_abs": [round(float(v), 2) for v in values[mask]],
+        "values_pct": [round(float(p), 2) for p in pct[mask]],
+    }
+
+
+def growth_series(transactions, historical_prices, end_date=None, rates=None):
+    """Build the portfolio value and % growth curves on the chart's sample dates.
+
+    transactions are rows with symbol, shares, price and date ('YYYY-MM-DD') sorted by date;
+    historical_prices maps symbol -> {date: close}; rates is as for portfolio_values().
+    """
+    growth = {"labels": [], "values_abs": [], "values_pct": []}
+    if not transactions:
+        return growth
+
+    start_date = datetime.strptime(transactions[0]['date'], '%Y-%m-%d').date()
+    dates = sample_dates(start_date, end_date or date.today())
+    if not dates:
+        return growth
+    sample_index = pd.DatetimeIndex(dates)
+
+    prices = price_frame(historical_prices, pd.Timestamp(start_date), sample_index)
+    return growth_points(sample_index, *portfolio_values(transactions, prices, rates))
@@ -0,0 +1,69 @@
+"""Materialized per-user positions, kept in step with the transactions table.
+
+Each (user, symbol) row holds the running aggregates the dashboard and sell() need:
+net shares, cost and quantity of all buys and sale proceeds. buy() and sell() apply their
+trade as a delta; deletes re-aggregate the one affected symbol. Cost basis of the shares
+still held (open_cost) and realized P/L come from the lot ledger in lots.py.
+"""
+
+import sqlite3
+
+
+CREATE_POSITIONS = """
+    CREATE TABLE IF NOT EXISTS positions (
+        user_id INTEGER NOT NULL,
+        symbol TEXT NOT NULL,
+        shares REAL NOT NULL DEFAULT 0,
+        total_cost REAL NOT NULL DEFAULT 0,
+        shares_bought REAL NOT NULL DEFAULT 0,
+        sale_proceeds REAL NOT NULL DEFAULT 0,
+        realized_pl REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, symbol),
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )"""
+
+AGGREGATE_COLUMNS = """
+    SUM(shares),
+    SUM(CASE WHEN shares > 0 THEN price * shares ELSE 0 END),
+    SUM(CASE WHEN shares > 0 THEN shares ELSE 0 END),
+    SUM(CASE WHEN shares < 0 THEN -shares * price ELSE 0 END)"""
+
+# Realized P/L at the average buy price, as positions carried it before the lot ledger
+# (migration 3 still computes it; migration 5 replaces it with per-lot figures).
+REALIZED_PL = """
+    realized_pl = CASE WHEN shares_bought > 0
+        THEN sale_proceeds - (shares_bought - shares) * total_cost / shares_bought ELSE 0 END"""
+
+
+def execute(db, sql, **params):
+    """Run sql with named parameters on the cs50 wrapper or a sqlite3 connection; SELECTs return dicts."""
+    if not isinstance(db, sqlite3.Connection):
+        return db.execute(sql, **params)
+    cursor = db.execute(sql, params)
+    if cursor.description is None:
+        return cursor.rowcount
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+
+def apply_trade(db, user_id, symbol, shares, price):
+    """Fold one newly logged trade (shares < 0 for a sale) into the user's position aggregates."""
+    bought = shares if shares > 0 else 0
+    execute(
+        db,
+        "INSERT INTO positions (user_id, symbol, shares, total_cost, shares_bought, sale_proceeds) "
+        "VALUES (:user_id, :symbol, :shares, :total_cost, :shares_bought, :sale_proceeds) "
+        "ON CONFLICT (user_id, symbol) DO UPDATE SET "
+        "shares = shares + excluded.shares, total_cost = total_cost + excluded.total_cost, "
+        "shares_bought = shares_bought + excluded.shares_bought, sale_proceeds = sale_proceeds + excluded.sale_proceeds",
+        user_id=user_id, symbol=symbol, shares=shares, total_cost=bought * price, shares_bought=bought,
+        sale_proceeds=-shares * price if shares < 0 else 0)
+
+
+# Re-aggregates one position; each statement takes the named parameters :user_id and :symbol.
+REFRESH_POSITION = [
+    "DELETE FROM positions WHERE user_id = :user_id AND symbol = :symbol",
+    f"INSERT INTO positions (user_id, symbol, shares, total_cost, shares_bought, sale_proceeds) "
+    f"SELECT user_id, symbol, {AGGREGATE_COLUMNS} FROM transactions "
+    f"WHERE user_id = :user_id AND symbol = :symbol GROUP BY user_id, symbol",
+]
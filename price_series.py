@@ -0,0 +1,71 @@
+"""Range-limited, downsampled close series for the stock detail chart.
+
+A chart a few hundred pixels wide cannot show more points than it has pixels, so long
+ranges are reduced to a fixed point budget with Largest-Triangle-Three-Buckets, which
+keeps the peaks and troughs that give a price chart its shape. Series are returned as
+columnar arrays (dates, closes) to keep the JSON small.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Range key -> how far back from the latest close it reaches; None is the whole history.
+RANGES = {
+    "1m": pd.DateOffset(months=1),
+    "6m": pd.DateOffset(months=6),
+    "1y": pd.DateOffset(years=1),
+    "5y": pd.DateOffset(years=5),
+    "max": None,
+}
+DEFAULT_RANGE = "1m"
+POINT_BUDGET = 400
+MIN_POINTS, MAX_POINTS = 50, 2000
+
+
+def lttb(x, y, threshold):
+    """Return the indices of the threshold points of (x, y) that Largest-Triangle-Three-Buckets keeps.
+
+    The first and last points are always kept; every bucket in between contributes the point
+    forming the largest triangle with the previously kept point and the next bucket's average.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def price_series(closes, range_key=DEFAULT_RANGE, points=POINT_BUDGET):
+    """Slice closes ({date: close}) to range_key and downsample it to at most points points.
+
+    Returns {"range", "dates", "closes", "total"}, where total is the number of closes in the
+    range before downsampling. Raises KeyError for an unknown range_key.
+    """
+    offset = RANGES[range_key]
+    series = pd.Series(closes, dtype="float64")
+    series.index = pd.to_datetime(series.index)
+    series = series.sort_index()
+    if offset is not None and not series.empty:
+        series = series[series.index >= series.index[-1] - offset]
+
+    x = series.index.to_numpy().astype("datetime64[D]").astype(np.int64).astype("float64")
+    y = series.to_numpy()
+    kept = lttb(x, y, max(MIN_POINTS, min(points, MAX_POINTS)))
+    return {
+        "range": range_key,
+        "dates": series.index[kept].strftime('%Y-%m-%d').tolist(),
+        "closes": [round(float(close), 4) for close in y[kept]],
+        "total": len(series),
+    }
@@ -0,0 +1,60 @@
+"""Persistent daily price history kept in finance.db.
+
+Each symbol's OHLC rows are stored once and topped up with only the days FMP has added
+since the last stored date, so restarts and deploys start with a warm history.
+"""
+
+import threading
+from datetime import date
+
+from migrations import connect
+
+
+class PriceStore:
+    """Daily OHLC rows per symbol, plus the date each symbol was last synced with FMP."""
+
+    def __init__(self, path="finance.db"):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def sync_state(self, symbol):
+        """Return (last stored date, date of last sync) for symbol; both None if never synced."""
+        row = self._connect().execute(
+            "SELECT last_date, synced_on FROM price_history_sync WHERE symbol = ?", (symbol.upper(),)).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def closes(self, symbol):
+        """Return the stored closes for symbol as {date: close}, oldest first."""
+        rows = self._connect().execute(
+            "SELECT date, close FROM price_history WHERE symbol = ? ORDER BY date", (symbol.upper(),))
+        return dict(rows)
+
+    def save(self, symbol, historical_list):
+        """Upsert FMP historical rows for symbol and mark it synced today."""
+        symbol = symbol.upper()
+        rows = [
+            (symbol, item["date"], item.get("open"), item.get("high"), item.get("low"), item["close"], item.get("volume"))
+            for item in historical_list
+            if item.get("date") and item.get("close") is not None
+        ]
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO price_history (symbol, date, open, high, low, close, volume) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute(
+                "INSERT OR REPLACE INTO price_history_sync (symbol, last_date, synced_on) "
+                "VALUES (?, (SELECT MAX(date) FROM price_history WHERE symbol = ?), ?)",
+                (symbol, symbol, date.today().isoformat()))
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
@@ -0,0 +1,154 @@
+"""Live price ticks pushed to open pages over Server-Sent Events.
+
+Each worker runs at most one poller thread, for the union of the symbols its connected
+clients watch, and fans every price change out to the clients watching that symbol. Polls
+go through helpers.live_quotes(), which coalesces them across workers, so any number of
+open dashboards costs one batched FMP quote call per interval rather than a quote lookup
+per page reload. Stocks are polled during market hours only, crypto around the clock;
+the poller stops when the last client disconnects. Every open stream holds a worker
+thread, so a process serves at most max_streams of them; clients beyond that are turned
+away and keep the prices the page was rendered with.
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+
+from helpers import live_quotes
+from refresher import market_open
+
+
+logger = logging.getLogger(__name__)
+
+MAX_SYMBOLS = 50
+# Ticks a slow client may fall behind by before it misses some.
+QUEUE_SIZE = 100
+# Comment lines keep proxies from closing an idle stream and reveal disconnected clients.
+KEEPALIVE = 15
+# Streams end after this long and the browser reconnects, so no worker thread is held indefinitely.
+MAX_STREAM_SECONDS = 600
+RETRY_MS = 3000
+# Seconds a client turned away at the stream limit is asked to wait before trying again.
+FULL_RETRY_AFTER = 60
+
+
+def _tick(symbol, quote):
+    return {"symbol": symbol, "price": quote["price"], "previous_close": quote.get("previous_close", quote["price"])}
+
+
+class Subscription:
+    """One client's symbols and the queue of ticks waiting to be sent to it."""
+
+    def __init__(self, symbols):
+        self.symbols = frozenset(symbols)
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+
+    def put(self, tick):
+        try:
+            self.queue.put_nowait(tick)
+        except queue.Full:
+            pass
+
+
+class PriceStream:
+    """Per-process hub between one quote poller and any number of subscribed clients."""
+
+    def __init__(self, cache, interval=None, is_crypto=None, max_streams=None):
+        self.cache = cache
+        self.interval = interval or cache.ttls["live"].total_seconds()
+        self.is_crypto = is_crypto or (lambda symbol: False)
+        self._subscriptions = set()
+        # symbol -> the last tick sent for it, replayed to clients that subscribe later.
+        self._last = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._slots = threading.BoundedSemaphore(max_streams) if max_streams else None
+
+    def open_slot(self):
+        """Claim a stream slot for a new client; False when max_streams are already open."""
+        return self._slots is None or self._slots.acquire(blocking=False)
+
+    def close_slot(self):
+        if self._slots is not None:
+            self._slots.release()
+
+    def subscribe(self, symbols):
+        subscription = Subscription(symbols)
+        with self._lock:
+            new_symbols = subscription.symbols - self._watched()
+            self._subscriptions.add(subscription)
+            known = [self._last[symbol] for symbol in subscription.symbols if symbol in self._last]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="price-stream", daemon=True)
+                self._thread.start()
+        for tick in known:
+            subscription.put(tick)
+        if new_symbols:
+            self._wakeup.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def _watched(self):
+        return frozenset().union(*(subscription.symbols for subscription in self._subscriptions))
+
+    def poll_once(self, now=None):
+        """Fetch the watched symbols that are trading and send changed prices on. Returns how many changed."""
+        with self._lock:
+            watched = self._watched()
+        is_market_open = market_open(now)
+        symbols = sorted(symbol for symbol in watched if is_market_open or self.is_crypto(symbol))
+        if not symbols:
+            return 0
+
+        quotes = live_quotes(symbols, self.cache)
+        changed = []
+        with self._lock:
+            for symbol, quote in quotes.items():
+                tick = _tick(symbol, quote)
+                if self._last.get(symbol) != tick:
+                    self._last[symbol] = tick
+                    changed.append(tick)
+            for symbol in set(self._last) - watched:
+                del self._last[symbol]
+            subscriptions = list(self._subscriptions)
+        for tick in changed:
+            for subscription in subscriptions:
+                if tick["symbol"] in subscription.symbols:
+                    subscription.put(tick)
+        return len(changed)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscriptions:
+                    self._thread = None
+                    return
+            self._wakeup.clear()
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.error("Price stream poll failed: %s", e)
+            self._wakeup.wait(self.interval)
+
+    def events(self, symbols, keepalive=KEEPALIVE, max_seconds=MAX_STREAM_SECONDS):
+        """Yield the text/event-stream body for a client watching symbols: a `price` event per tick."""
+        # Subscribing here rather than in the view means a client gone before the body starts leaves nothing behind.
+        subscription = self.subscribe(symbols)
+        deadline = time.monotonic() + max_seconds
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    tick = subscription.queue.get(timeout=min(keepalive, remaining))
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: price\ndata: {json.dumps(tick)}\n\n"
+        finally:
+            self.unsubscribe(subscription)
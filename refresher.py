@@ -0,0 +1,72 @@
+"""Background refresher that keeps quotes for every held symbol warm in the shared cache.
+
+Every interval it reads the symbols somebody currently holds and re-fetches their quotes
+in batched FMP calls: stocks during US market hours, crypto around the clock. With the
+SQLite cache backend, a lease makes sure only one gunicorn worker refreshes per interval,
+so FMP usage is one batch per interval however many workers or users there are.
+"""
+
+import logging
+import threading
+from datetime import datetime, time as dt_time
+from zoneinfo import ZoneInfo
+
+from helpers import refresh_quotes
+from migrations import connect
+
+
+logger = logging.getLogger(__name__)
+
+MARKET_TZ = ZoneInfo("America/New_York")
+MARKET_OPEN = dt_time(9, 30)
+MARKET_CLOSE = dt_time(16, 0)
+LEASE_KEY = "refresher:quotes"
+
+
+def market_open(now=None):
+    """True during regular NYSE/Nasdaq hours (holidays are not accounted for)."""
+    now = (now or datetime.now(MARKET_TZ)).astimezone(MARKET_TZ)
+    return now.weekday() < 5 and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+
+def held_symbols(conn):
+    """Return [(symbol, is_crypto)] for every symbol with an open position."""
+    return conn.execute(
+        "SELECT symbol, MAX(asset_type = 'crypto') FROM transactions "
+        "WHERE symbol IN (SELECT symbol FROM positions WHERE shares > 0) GROUP BY symbol").fetchall()
+
+
+def refresh_once(conn, cache, now=None):
+    """Refresh quotes for the held symbols that are trading now. Returns how many were refreshed."""
+    is_market_open = market_open(now)
+    symbols = [symbol for symbol, is_crypto in held_symbols(conn) if is_crypto or is_market_open]
+    if not symbols:
+        return 0
+    return refresh_quotes(symbols, cache)
+
+
+class QuoteRefresher(threading.Thread):
+    """Daemon thread that calls refresh_once() every interval seconds."""
+
+    def __init__(self, database, cache, interval=60):
+        super().__init__(name="quote-refresher", daemon=True)
+        self.database = database
+        self.cache = cache
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        conn = connect(self.database)
+        while not self.stopped.is_set():
+            # The lease is left to expire rather than released, so it spaces refreshes
+            # by one interval across every worker sharing the cache.
+            if self.cache.backend.acquire_lease(LEASE_KEY, self.interval - 1):
+                try:
+                    refresh_once(conn, self.cache)
+                except Exception as e:
+                    logger.error("Quote refresh failed: %s", e)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
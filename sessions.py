@@ -0,0 +1,130 @@
+"""Session backends: Flask's signed cookie, or a server-side store in SQLite.
+
+The session only carries user_id and pending flash messages, so the default is Flask's
+signed cookie: no storage at all, and any host holding SECRET_KEY can read it. The SQLite
+store is for deployments that want server-side sessions (revocable, nothing readable in
+the browser). Loading one costs an indexed read, writes only happen when the session
+changes or its expiry needs extending, and expired rows are swept periodically instead
+of accumulating like the old filesystem sessions did.
+"""
+
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+BACKENDS = ("cookie", "sqlite", "filesystem")
+BUSY_TIMEOUT_MS = 15000
+# Expired sessions are deleted at most this often per process.
+SWEEP_INTERVAL = 60 * 60
+
+
+class StoredSession(CallbackDict, SessionMixin):
+    """A session loaded from the store, tracking whether it changed or was cleared."""
+
+    def __init__(self, initial=None, sid=None, expires_at=0.0):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.modified = False
+        # Set by clear() (as login and logout do): the next save starts a new session ID,
+        # so an ID known before login is worthless after it.
+        self.regenerate = False
+
+    def clear(self):
+        super().clear()
+        self.regenerate = True
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """Server-side sessions in a SQLite file, keyed by a random ID in the session cookie."""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, path="sessions.db"):
+        self.path = path
+        self._local = threading.local()
+        self._next_sweep = 0
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY NOT NULL, data TEXT NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID")
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _sweep(self, now):
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + SWEEP_INTERVAL
+        self._connect().execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            row = self._connect().execute(
+                "SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?", (sid, time.time())).fetchone()
+            if row is not None:
+                return StoredSession(self.serializer.loads(row[0]), sid, row[1])
+        return StoredSession()
+
+    def save_session(self, app, session, response):
+        name, domain, path = self.get_cookie_name(app), self.get_cookie_domain(app), self.get_cookie_path(app)
+        conn = self._connect()
+        now = time.time()
+        self._sweep(now)
+
+        if session.sid and (session.regenerate or not session):
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session.sid,))
+            if not session:
+                response.delete_cookie(name, domain=domain, path=path)
+                return
+            session.sid = None
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        # An untouched session is only written when less than half its lifetime is left.
+        if not session or (not session.modified and session.sid and session.expires_at - now > lifetime / 2):
+            return
+
+        session.sid = session.sid or secrets.token_urlsafe(32)
+        conn.execute("INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)",
+                     (session.sid, self.serializer.dumps(dict(session)), now + lifetime))
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+def init_app(app, backend, secret_key=None, path="sessions.db"):
+    """Configure app's sessions for backend (one of BACKENDS)."""
+    if backend not in BACKENDS:
+        raise RuntimeError(f"SESSION_BACKEND must be one of {', '.join(BACKENDS)}")
+    app.config["SESSION_PERMANENT"] = False
+    app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
+    if backend == "cookie":
+        if not secret_key:
+            raise RuntimeError("SECRET_KEY not set")
+        app.secret_key = secret_key
+    elif backend == "sqlite":
+        app.session_interface = SQLiteSessionInterface(path)
+    else:
+        from flask_session import Session
+
+        app.config["SESSION_TYPE"] = "filesystem"
+        Session(app)
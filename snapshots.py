@@ -0,0 +1,167 @@
+"""Stored daily portfolio values, so the growth chart only computes today's point live.
+
+portfolio_snapshots holds each user's portfolio value and cost basis, in their base
+currency, for every finished day since their first trade. A past day's value only changes
+when a trade dated on or before it is logged or deleted, or the base currency changes, so
+those invalidate the user's rows from that date on and the rows always form one unbroken
+run of days from the first trade. Only settled days are stored: those up to the last
+date every symbol the user still needed that day has a close for, so a day valued with a
+carried-forward close (an upstream sync that failed, or a close not published yet) is
+computed live until its real close arrives. The nightly `flask snapshot-portfolios` batch
+values every user over one shared price frame; days it has not reached yet are computed
+and stored by the first chart request that needs them.
+"""
+
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from lots import EPSILON
+from portfolio import growth_points, portfolio_values, price_frame, sample_dates
+from positions import execute
+
+
+CREATE_SNAPSHOTS = (
+    "CREATE TABLE IF NOT EXISTS portfolio_snapshots ("
+    "user_id INTEGER NOT NULL, date TEXT NOT NULL, value REAL NOT NULL, cost_basis REAL NOT NULL, "
+    "PRIMARY KEY (user_id, date)) WITHOUT ROWID")
+
+USER_TRANSACTIONS = ("SELECT symbol, shares, price, DATE(timestamp) AS date FROM transactions "
+                "WHERE user_id = ? ORDER BY timestamp, id")
+
+
+def invalidate_snapshots(db, user_id, from_date=None):
+    """Forget the user's snapshots from from_date ('YYYY-MM-DD') on, or all of them."""
+    if from_date is None:
+        execute(db, "DELETE FROM portfolio_snapshots WHERE user_id = :user_id", user_id=user_id)
+    else:
+        execute(db, "DELETE FROM portfolio_snapshots WHERE user_id = :user_id AND date >= :date",
+                user_id=user_id, date=from_date[:10])
+
+
+def _trades(rows):
+    return [(row["symbol"], row["shares"], row["price"], row["date"]) for row in rows]
+
+
+def _first_date(transactions):
+    return datetime.strptime(transactions[0]["date"], '%Y-%m-%d').date()
+
+
+def _settled_through(transactions, historical_prices):
+    """The last day whose value is final given the closes loaded, or None if no day is.
+
+    A symbol constrains it until its last trade if it is no longer held, otherwise for good:
+    days after its last close would be valued at a stale close, or without it at all.
+    """
+    held, last_trade = {}, {}
+    for row in transactions:
+        held[row["symbol"]] = held.get(row["symbol"], 0) + row["shares"]
+        last_trade[row["symbol"]] = row["date"]
+
+    settled = None
+    for symbol, shares in held.items():
+        closes = [day for day, close in (historical_prices.get(symbol) or {}).items() if close and close > 0]
+        last_close = max(closes) if closes else None
+        if shares <= EPSILON and last_close is not None and last_close >= last_trade[symbol]:
+            continue
+        if last_close is None:
+            return None
+        settled = last_close if settled is None else min(settled, last_close)
+    return date.fromisoformat(settled) if settled is not None else date.max
+
+
+def _pending_from(database, user_id, start):
+    """The first day without a snapshot, given the user's first trade was on start."""
+    row = database.query_one(
+        "SELECT MIN(date) AS first, MAX(date) AS last, COUNT(*) AS n FROM portfolio_snapshots WHERE user_id = ?", user_id)
+    if not row["n"]:
+        return start
+    last = date.fromisoformat(row["last"])
+    if row["first"] != start.isoformat() or row["n"] != (last - start).days + 1:
+        # Left behind by a change that skipped invalidation; start over rather than chart a gap.
+        database.execute("DELETE FROM portfolio_snapshots WHERE user_id = ?", user_id)
+        return start
+    return last + timedelta(days=1)
+
+
+def _save(database, user_id, base, transactions, frame):
+    """Store frame's days, unless a trade or the base currency changed while they were computed."""
+    if frame.empty:
+        return 0
+    with database.transaction() as conn:
+        current = conn.execute(USER_TRANSACTIONS, (user_id,)).fetchall()
+        current_base = conn.execute("SELECT base_currency FROM users WHERE id = ?", (user_id,)).fetchone()
+        if current_base is None or current_base["base_currency"] != base or _trades(current) != _trades(transactions):
+            return 0
+        conn.executemany(
+            "INSERT OR REPLACE INTO portfolio_snapshots (user_id, date, value, cost_basis) VALUES (?, ?, ?, ?)",
+            [(user_id, day.strftime('%Y-%m-%d'), float(value), float(cost))
+             for day, value, cost in zip(frame.index, frame["value"], frame["cost_basis"])])
+    return len(frame)
+
+
+def _values(transactions, prices, rates):
+    values, cost_basis = portfolio_values(transactions, prices, rates)
+    return pd.DataFrame({"value": values, "cost_basis": cost_basis}, index=prices.index)
+
+
+def growth_from_snapshots(database, user_id, base, transactions, historical_prices, rates=None, today=None):
+    """The user's growth chart: stored days read back, missing settled days computed and stored, the rest live.
+
+    transactions are the user's rows with symbol, shares, price and date, as selected by
+    USER_TRANSACTIONS (at least one); historical_prices maps each symbol they traded -> {date:
+    close}; rates is as for portfolio.portfolio_values(), converting into base.
+    """
+    today = today or date.today()
+    start = _first_date(transactions)
+    first = _pending_from(database, user_id, start)
+
+    stored = None
+    if first > start:
+        rows = database.query("SELECT date, value, cost_basis FROM portfolio_snapshots WHERE user_id = ? ORDER BY date",
+                              user_id)
+        stored = pd.DataFrame([(row["value"], row["cost_basis"]) for row in rows], columns=["value", "cost_basis"],
+                              index=pd.to_datetime([row["date"] for row in rows]))
+
+    fresh = _values(transactions, price_frame(historical_prices, None, pd.date_range(first, today)), rates)
+    settled = _settled_through(transactions, historical_prices)
+    if settled is not None:
+        last = min(settled, today - timedelta(days=1))
+        _save(database, user_id, base, transactions, fresh[fresh.index <= pd.Timestamp(last)])
+
+    sample_index = pd.DatetimeIndex(sample_dates(start, today))
+    daily = (pd.concat([stored, fresh]) if stored is not None else fresh).reindex(sample_index)
+    return growth_points(sample_index, daily["value"].to_numpy(), daily["cost_basis"].to_numpy())
+
+
+def snapshot_all(database, users, transactions, historical_prices, rates, today=None):
+    """Store every settled day not snapshotted yet, for all users, in one pass over shared prices.
+
+    users maps user_id -> base currency; transactions maps user_id -> their rows in
+    USER_TRANSACTIONS order; historical_prices covers every traded symbol; rates maps a base
+    currency -> the factor frame for its users' symbols, and leaves out currencies that
+    need no conversion. Returns the number of days stored.
+    """
+    yesterday = (today or date.today()) - timedelta(days=1)
+    pending = {}
+    for user_id, rows in transactions.items():
+        settled = _settled_through(rows, historical_prices)
+        if settled is None:
+            continue
+        first = _pending_from(database, user_id, _first_date(rows))
+        last = min(settled, yesterday)
+        if first <= last:
+            pending[user_id] = (first, last)
+    if not pending:
+        return 0
+
+    # One frame of closes for every symbol over every day any user still needs.
+    prices = price_frame(historical_prices, None, pd.date_range(min(first for first, _ in pending.values()),
+                                                                max(last for _, last in pending.values())))
+    stored = 0
+    for user_id, (first, last) in pending.items():
+        symbols = sorted({row["symbol"] for row in transactions[user_id]} & set(prices.columns))
+        frame = _values(transactions[user_id], prices.loc[pd.Timestamp(first):pd.Timestamp(last), symbols],
+                        rates.get(users[user_id]))
+        stored += _save(database, user_id, users[user_id], transactions[user_id], frame)
+    return stored
@@ -1,18 +1,35 @@
+function fetchJSON(url) {
+  // The API answers with an ETag, so the browser revalidates and reuses unchanged data (304).
+  return fetch(url, { credentials: "same-origin", headers: { Accept: "application/json" } })
+    .then((response) => {
+      if (!response.ok) throw new Error(`${url} responded ${response.status}`);
+      return response.json();
+    });
+}
+
 document.addEventListener("DOMContentLoaded", () => {
-  const chartDataEl = document.getElementById("chart-data");
-  if (!chartDataEl) return;
+  const dataEl = document.getElementById("chart-data");
+  if (!dataEl) return;
+
+  const data = JSON.parse(dataEl.textContent);
 
-  const chartData = JSON.parse(chartDataEl.textContent);
+  drawDistributionChart(data.distribution);
 
-  // === Asset Distribution Chart ===
-  if (chartData.distribution && chartData.distribution.labels.length > 0) {
+  fetchJSON(data.growth)
+    .then((growth) => drawGrowthChart(growth))
+    .catch((error) => console.error("Could not load portfolio growth:", error));
+});
+
+// === Asset Distribution Chart ===
+function drawDistributionChart(distribution) {
+  if (distribution && distribution.labels.length > 0) {
     const ctxDist = document.getElementById("distributionChart").getContext("2d");
     new Chart(ctxDist, {
       type: "doughnut",
       data: {
-        labels: chartData.distribution.labels,
+        labels: distribution.labels,
         datasets: [{
-          data: chartData.distribution.values,
+          data: distribution.values,
           backgroundColor: [
             "rgba(153, 102, 255, 0.7)",
             "rgba(255, 159, 64, 0.7)",
@@ -46,18 +63,20 @@ document.addEventListener("DOMContentLoaded", () => {
       },
     });
   }
+}
 
-  // === Portfolio Growth Chart ===
-  if (chartData.growth && chartData.growth.labels.length > 1) {
+// === Portfolio Growth Chart ===
+function drawGrowthChart(growth) {
+  if (growth && growth.labels.length > 1) {
     const ctxGrowth = document.getElementById("growthChart").getContext("2d");
     new Chart(ctxGrowth, {
       type: "line",
       data: {
-        labels: chartData.growth.labels,
+        labels: growth.labels,
         datasets: [
           {
             label: "Portfolio Value",
-            data: chartData.growth.values_abs,
+            data: growth.values_abs,
             borderColor: "rgb(54, 162, 235)",
             backgroundColor: "rgba(54, 162, 235, 0.2)",
             fill: true,
@@ -65,7 +84,7 @@ document.addEventListener("DOMContentLoaded", () => {
           },
           {
             label: "Growth",
-            data: chartData.growth.values_pct,
+            data: growth.values_pct,
             borderColor: "rgb(255, 99, 132)",
             yAxisID: "y1",
           },
@@ -86,12 +105,7 @@ document.addEventListener("DOMContentLoaded", () => {
                   if (context.dataset.yAxisID === "y1") {
                     label += context.parsed.y.toFixed(2) + "%";
                   } else {
-                    label +=
-                      "$" +
-                      context.parsed.y.toLocaleString("en-US", {
-                        minimumFractionDigits: 2,
-                        maximumFractionDigits: 2,
-                      });
+                    label += formatMoney(context.parsed.y, growth.currency || "USD");
                   }
                 }
                 return label;
@@ -110,7 +124,7 @@ document.addEventListener("DOMContentLoaded", () => {
           y: {
             type: "linear",
             position: "left",
-            title: { display: true, text: "Value ($)", color: "#e5e7eb" },
+            title: { display: true, text: `Value (${growth.currency || "USD"})`, color: "#e5e7eb" },
             ticks: { color: "#9ca3af" },
             grid: { color: "#374151" },
           },
@@ -125,4 +139,4 @@ document.addEventListener("DOMContentLoaded", () => {
       },
     });
   }
-});
+}
@@ -0,0 +1,76 @@
+// Keeps prices on the page current from the server's price stream (Server-Sent Events).
+// Elements marked data-live-symbol are updated when their symbol ticks; on the dashboard,
+// rows also carry the shares held, the FX rate into the base currency and their cost.
+document.addEventListener("DOMContentLoaded", () => {
+  const configEl = document.getElementById("live-prices");
+  if (!configEl || !window.EventSource) return;
+
+  const config = JSON.parse(configEl.textContent);
+  const currency = config.currency || "USD";
+  const money = (value) => formatMoney(value, currency);
+  const colors = ["text-green-400", "text-red-400", "text-gray-200"];
+
+  function setSigned(el, value, text) {
+    if (!el) return;
+    el.textContent = text;
+    el.classList.remove(...colors);
+    el.classList.add(value > 0 ? colors[0] : value < 0 ? colors[1] : colors[2]);
+  }
+
+  function percent(value, base) {
+    return `${(base > 0 ? (value / base) * 100 : 0).toFixed(2)}%`;
+  }
+
+  // Dashboard totals are re-added from every row's latest figures, as the server computes them.
+  function updateTotals() {
+    let value = 0, dailyPl = 0, cost = 0;
+    document.querySelectorAll("tr[data-live-symbol]").forEach((row) => {
+      value += Number(row.dataset.value || 0);
+      dailyPl += Number(row.dataset.dailyPl || 0);
+      cost += Number(row.dataset.cost || 0);
+    });
+    const totalPl = value - cost;
+    setSigned(document.querySelector('[data-live-total="daily-pl"]'), dailyPl,
+      `${money(dailyPl)} (${percent(dailyPl, value - dailyPl)})`);
+    setSigned(document.querySelector('[data-live-total="total-pl"]'), totalPl,
+      `${money(totalPl)} (${percent(totalPl, cost)})`);
+  }
+
+  function applyTick(tick) {
+    let rowsChanged = false;
+    document.querySelectorAll(`[data-live-symbol="${CSS.escape(tick.symbol)}"]`).forEach((el) => {
+      const rate = Number(el.dataset.rate || 1);
+      const price = tick.price * rate;
+      const change = price - tick.previous_close * rate;
+      const field = (name) => el.querySelector(`[data-live-field="${name}"]`);
+
+      field("price").textContent = money(price);
+      setSigned(field("change"), change, `${money(change)} (${percent(change, price - change)})`);
+      if (el.dataset.shares === undefined) return;
+
+      const shares = Number(el.dataset.shares);
+      const cost = Number(el.dataset.cost);
+      el.dataset.value = shares * price;
+      el.dataset.dailyPl = shares * change;
+      field("value").textContent = money(shares * price);
+      setSigned(field("daily-pl"), shares * change, money(shares * change));
+      setSigned(field("total-pl"), shares * price - cost,
+        `${money(shares * price - cost)} (${percent(shares * price - cost, cost)})`);
+      rowsChanged = true;
+    });
+    if (rowsChanged) updateTotals();
+  }
+
+  // EventSource reconnects by itself when the server ends a stream or the connection drops. It gives up on
+  // an error status, such as the 503 sent when the server has no stream to spare: the page then keeps its
+  // rendered prices and tries again later.
+  const FALLBACK_RETRY_MS = 60000;
+  function connect() {
+    const source = new EventSource(config.url);
+    source.addEventListener("price", (event) => applyTick(JSON.parse(event.data)));
+    source.addEventListener("error", () => {
+      if (source.readyState === EventSource.CLOSED) setTimeout(connect, FALLBACK_RETRY_MS);
+    });
+  }
+  connect();
+});
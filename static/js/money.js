@@ -0,0 +1,7 @@
+// Formats an amount of a currency the way the server's money filter does. Load before the scripts that use it.
+// Minor-unit codes such as GBp (pence) are not ISO currencies; they are shown as a plain suffix.
+function formatMoney(value, currency = "USD") {
+  return /^[A-Z]{3}$/.test(currency)
+    ? value.toLocaleString("en-US", { style: "currency", currency })
+    : `${value.toLocaleString("en-US", { minimumFractionDigits: 2, maximumFractionDigits: 2 })} ${currency}`;
+}
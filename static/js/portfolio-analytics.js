@@ -0,0 +1,69 @@
+document.addEventListener("DOMContentLoaded", () => {
+  const panel = document.getElementById("portfolio-analytics");
+  if (!panel) return;
+
+  const percent = (value) => `${(value * 100).toFixed(2)}%`;
+  const ratio = (value) => value.toFixed(2);
+  const formats = {
+    twr: percent, twr_annualized: percent, mwr: percent, volatility: percent,
+    sharpe: ratio, max_drawdown: percent, beta: ratio,
+  };
+  // Metrics where a negative value is bad news; the others are shown in neutral colour.
+  const signed = new Set(["twr", "twr_annualized", "mwr", "sharpe"]);
+
+  function drawMetrics(metrics) {
+    panel.querySelectorAll("[data-metric]").forEach((el) => {
+      const key = el.dataset.metric;
+      const value = metrics[key];
+      if (value === null || value === undefined) return;
+      el.textContent = formats[key](value);
+      if (signed.has(key)) el.classList.add(value > 0 ? "text-green-400" : value < 0 ? "text-red-400" : "text-gray-200");
+      if (key === "beta") el.title = `Against ${metrics.benchmark}`;
+      if (key === "max_drawdown" && metrics.max_drawdown_date) el.title = `Trough on ${metrics.max_drawdown_date}`;
+    });
+    document.getElementById("analytics-period").textContent =
+      `${metrics.start} to ${metrics.end} · beta against ${metrics.benchmark}`;
+  }
+
+  function drawCorrelation(correlation) {
+    const table = document.getElementById("correlation-table");
+    const header = document.createElement("tr");
+    header.className = "bg-gray-800";
+    ["", ...correlation.symbols].forEach((symbol) => {
+      const th = document.createElement("th");
+      th.className = "px-3 py-2 text-left text-xs font-medium uppercase tracking-wider";
+      th.textContent = symbol;
+      header.appendChild(th);
+    });
+    table.appendChild(header);
+
+    correlation.matrix.forEach((values, i) => {
+      const tr = document.createElement("tr");
+      const th = document.createElement("th");
+      th.className = "px-3 py-2 text-left text-xs font-medium uppercase tracking-wider";
+      th.textContent = correlation.symbols[i];
+      tr.appendChild(th);
+      values.forEach((value) => {
+        const td = document.createElement("td");
+        td.className = "px-3 py-2 whitespace-nowrap";
+        td.textContent = value === null ? "–" : value.toFixed(2);
+        if (value !== null) td.style.backgroundColor = `rgba(99, 102, 241, ${Math.abs(value) * 0.5})`;
+        tr.appendChild(td);
+      });
+      table.appendChild(tr);
+    });
+  }
+
+  fetch(panel.dataset.url, { credentials: "same-origin", headers: { Accept: "application/json" } })
+    .then((response) => {
+      if (!response.ok) throw new Error(`${panel.dataset.url} responded ${response.status}`);
+      return response.json();
+    })
+    .then((metrics) => {
+      if (!metrics.start) return; // Nothing traded yet.
+      drawMetrics(metrics);
+      drawCorrelation(metrics.correlation);
+      panel.classList.remove("hidden");
+    })
+    .catch((error) => console.error("Could not load portfolio analytics:", error));
+});
@@ -0,0 +1,136 @@
+document.addEventListener("DOMContentLoaded", () => {
+  const dataElement = document.getElementById("page-data");
+  const chartCanvas = document.getElementById("historicalChart");
+  const chartErrorEl = document.getElementById("chart-error");
+  if (!dataElement || !chartCanvas) return;
+
+  const pageData = JSON.parse(dataElement.textContent);
+  const quoteData = pageData.quote;
+  const currency = pageData.currency || "USD";
+
+  const timeRangeButtons = document.querySelectorAll(".time-range-btn");
+  const headerChangeDiv = document.getElementById("header-change");
+  const absEl = document.getElementById("header-change-abs");
+  const pctEl = document.getElementById("header-change-pct");
+  // Each range is fetched once per page view; the server downsamples it to fit the chart.
+  const seriesByRange = new Map();
+  let historicalChart = null;
+  let selectedRange = null;
+
+  function showError() {
+    chartCanvas.style.display = "none";
+    chartErrorEl.classList.remove("hidden");
+  }
+
+  function loadRange(range) {
+    if (!seriesByRange.has(range)) {
+      const url = `${pageData.historyUrl}?range=${range}`;
+      const request = fetch(url, { credentials: "same-origin", headers: { Accept: "application/json" } })
+        .then((response) => {
+          if (!response.ok) throw new Error(`${url} responded ${response.status}`);
+          return response.json();
+        });
+      // Forget failed requests so clicking the range again retries.
+      request.catch(() => seriesByRange.delete(range));
+      seriesByRange.set(range, request);
+    }
+    return seriesByRange.get(range);
+  }
+
+  function updateHeader(closes) {
+    let changeAbs = 0;
+    let changePct = 0;
+
+    if (!closes || closes.length < 2) {
+      const currentPrice = quoteData.price;
+      const prevClose = quoteData.previous_close;
+      if (typeof currentPrice === "number" && typeof prevClose === "number") {
+        changeAbs = currentPrice - prevClose;
+        changePct = prevClose > 0 ? (changeAbs / prevClose) * 100 : 0;
+      }
+    } else {
+      // Downsampling always keeps the first and last close of the range.
+      const firstPrice = closes[0];
+      const lastPrice = closes[closes.length - 1];
+      changeAbs = lastPrice - firstPrice;
+      changePct = firstPrice > 0 ? (changeAbs / firstPrice) * 100 : 0;
+    }
+
+    absEl.textContent = formatMoney(changeAbs, currency);
+    pctEl.textContent = ` (${changePct.toFixed(2)}%)`;
+
+    headerChangeDiv.className = "text-xl font-semibold";
+    if (changeAbs > 0) headerChangeDiv.classList.add("text-green-500");
+    else if (changeAbs < 0) headerChangeDiv.classList.add("text-red-500");
+    else headerChangeDiv.classList.add("text-gray-300");
+  }
+
+  function drawSeries(series) {
+    if (historicalChart) {
+      historicalChart.data.labels = series.dates;
+      historicalChart.data.datasets[0].data = series.closes;
+      historicalChart.update();
+      return;
+    }
+    historicalChart = new Chart(chartCanvas.getContext("2d"), {
+      type: "line",
+      data: {
+        labels: series.dates,
+        datasets: [{
+          label: `Close Price (${currency})`,
+          data: series.closes,
+          borderColor: "rgb(99, 102, 241)", // Indigo
+          backgroundColor: "rgba(99, 102, 241, 0.2)",
+          fill: true,
+          tension: 0.1,
+          pointRadius: 0,
+        }],
+      },
+      options: {
+        responsive: true,
+        maintainAspectRatio: false,
+        animation: false,
+        interaction: { mode: "index", intersect: false },
+        scales: {
+          x: { type: "time", ticks: { color: "#d1d5db" } }, // Unit picked per range.
+          y: { title: { display: true, text: `Price (${currency})`, color: "#d1d5db" }, ticks: { color: "#d1d5db" } },
+        },
+        plugins: { legend: { display: false }, tooltip: { mode: "index", intersect: false } },
+      },
+    });
+  }
+
+  function selectRange(range) {
+    selectedRange = range;
+    loadRange(range)
+      .then((series) => {
+        if (range !== selectedRange) return; // A later click won.
+        if (series.dates.length === 0) {
+          showError();
+          updateHeader(null);
+          return;
+        }
+        drawSeries(series);
+        updateHeader(series.closes);
+      })
+      .catch((error) => {
+        console.error("Could not load historical prices:", error);
+        if (!historicalChart) showError();
+        updateHeader(null);
+      });
+  }
+
+  timeRangeButtons.forEach((button) => {
+    button.addEventListener("click", () => {
+      timeRangeButtons.forEach((btn) => {
+        btn.classList.remove("bg-indigo-600", "text-white");
+        btn.classList.add("bg-gray-700", "text-gray-300");
+      });
+      button.classList.add("bg-indigo-600", "text-white");
+      button.classList.remove("bg-gray-700", "text-gray-300");
+      selectRange(button.dataset.range);
+    });
+  });
+
+  document.querySelector('.time-range-btn[data-range="1m"]').click();
+});
@@ -0,0 +1,198 @@
+"""Local symbol index that answers /search autocomplete in-process.
+
+FMP's stock and crypto symbol lists are downloaded at most once a day, written to a JSON
+file so every worker (and the next restart) can load them without calling FMP, and kept
+in memory as sorted arrays. A query is matched against symbol prefixes and against
+prefixes of the words in the company name with bisect, so a keystroke costs a few
+microseconds and works while FMP is down. /search only goes to FMP when the index has
+no match (or has not been downloaded yet).
+"""
+
+import bisect
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+import upstream
+
+
+logger = logging.getLogger(__name__)
+
+STOCK_LIST_URL = "https://financialmodelingprep.com/api/v3/stock/list"
+CRYPTO_LIST_URL = "https://financialmodelingprep.com/api/v3/symbol/available-cryptocurrencies"
+
+# The stock list carries no currency, so a listing's currency is decided by its exchange.
+# Listings on exchanges not mapped here are left out of the index (/search falls back to FMP).
+EXCHANGE_CURRENCIES = {
+    **dict.fromkeys(("NASDAQ", "NYSE", "AMEX", "NYSEArca", "BATS", "CBOE", "OTC", "PNK"), "USD"),
+    **dict.fromkeys(("XETRA", "EURONEXT", "MIL", "BME", "HEL", "VIE"), "EUR"),
+    "LSE": "GBp", "SIX": "CHF", "TSX": "CAD", "ASX": "AUD", "HKSE": "HKD", "JPX": "JPY",
+    "STO": "SEK", "OSL": "NOK", "CPH": "DKK", "NSE": "INR", "BSE": "INR", "KSC": "KRW",
+    "SAO": "BRL", "MEX": "MXN", "JNB": "ZAc", "TLV": "ILA",
+}
+
+MAX_AGE = 24 * 60 * 60
+# A failed or in-progress download is not retried, by this or any other worker, for this long.
+RETRY_AFTER = 5 * 60
+LEASE_KEY = "symbols:refresh"
+MAX_RESULTS = 10
+# Upper bound on name-word candidates looked at per query, so one-letter queries stay cheap.
+MAX_SCAN = 2000
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _words(text):
+    return _WORD.findall((text or "").lower())
+
+
+def _prefix_range(keys, prefix):
+    return bisect.bisect_left(keys, prefix), bisect.bisect_left(keys, prefix + "\uffff")
+
+
+class _Table:
+    """Sorted symbol and name-word arrays over one asset type's listings."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        by_symbol = sorted((entry["symbol"].upper(), i) for i, entry in enumerate(entries))
+        self.symbols = [symbol for symbol, _ in by_symbol]
+        self.symbol_ids = [i for _, i in by_symbol]
+        by_word = sorted({(word, i) for i, entry in enumerate(entries) for word in _words(entry["name"])})
+        self.words = [word for word, _ in by_word]
+        self.word_ids = [i for _, i in by_word]
+
+    def get(self, symbol):
+        i = bisect.bisect_left(self.symbols, symbol)
+        return self.entries[self.symbol_ids[i]] if i < len(self.symbols) and self.symbols[i] == symbol else None
+
+    def search(self, keywords, limit):
+        # Exact symbol first, then symbols starting with the query, then names whose
+        # words start with every word of the query (in any order).
+        prefix = keywords.strip().upper()
+        if not prefix:
+            return []
+        lo, hi = _prefix_range(self.symbols, prefix)
+        ids = list(dict.fromkeys(self.symbol_ids[lo:min(hi, lo + limit)]))
+
+        query = _words(keywords)
+        if query and len(ids) < limit:
+            lo, hi = _prefix_range(self.words, query[0])
+            for i in self.word_ids[lo:min(hi, lo + MAX_SCAN)]:
+                if i in ids:
+                    continue
+                name_words = _words(self.entries[i]["name"])
+                if all(any(word.startswith(q) for word in name_words) for q in query[1:]):
+                    ids.append(i)
+                    if len(ids) >= limit:
+                        break
+        return [self.entries[i] for i in ids]
+
+
+def _listing(row):
+    currency = row.get("currency") or EXCHANGE_CURRENCIES.get(row.get("exchangeShortName")) or "USD"
+    return {"symbol": row["symbol"], "name": row.get("name") or row["symbol"],
+            "currency": currency, "exchangeShortName": row.get("exchangeShortName")}
+
+
+def download(api_key):
+    """Fetch the full stock and crypto symbol lists from FMP in the index file's format."""
+    stocks = upstream.get_json(f"{STOCK_LIST_URL}?apikey={urllib.parse.quote_plus(api_key or '')}", timeout=(3.05, 60))
+    cryptos = upstream.get_json(f"{CRYPTO_LIST_URL}?apikey={urllib.parse.quote_plus(api_key or '')}", timeout=(3.05, 60))
+    # Keyed by symbol so a symbol listed on several exchanges is offered once.
+    return {
+        "built_at": time.time(),
+        "stock": list({row["symbol"]: _listing(row) for row in stocks
+                       if row.get("symbol") and row.get("exchangeShortName") in EXCHANGE_CURRENCIES}.values()),
+        "crypto": list({row["symbol"]: _listing(row) for row in cryptos if row.get("symbol")}.values()),
+    }
+
+
+class SymbolIndex:
+    """In-memory prefix index over the symbol lists persisted at path."""
+
+    def __init__(self, path="symbols.json", max_age=MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.built_at = 0
+        self._tables = {}
+        self._next_attempt = 0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Load the index file if there is one. Returns False when there is none or it is unreadable."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self._install(data)
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(self.path):
+                logger.error("Could not load symbol index %s: %s", self.path, e)
+            return False
+        return True
+
+    def _install(self, data):
+        tables = {asset_type: _Table(data[asset_type]) for asset_type in ("stock", "crypto")}
+        self._tables, self.built_at = tables, data["built_at"]
+
+    def refresh(self, api_key=None):
+        """Download the symbol lists, persist them and swap them in. Returns the number of listings."""
+        data = download(api_key or os.environ.get("API_KEY"))
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        self._install(data)
+        return len(data["stock"]) + len(data["crypto"])
+
+    def refresh_if_stale(self, cache):
+        """Bring the index up to date without blocking the caller.
+
+        A newer file written by another worker is simply reloaded; otherwise one worker,
+        chosen through a cache lease, downloads the lists in a background thread.
+        """
+        now = time.time()
+        if now - self.built_at < self.max_age or now < self._next_attempt:
+            return
+        with self._lock:
+            if now < self._next_attempt:
+                return
+            self._next_attempt = now + RETRY_AFTER
+        try:
+            if os.path.getmtime(self.path) > self.built_at + 1 and self.load() and now - self.built_at < self.max_age:
+                return
+        except OSError:
+            pass
+        if cache.backend.acquire_lease(LEASE_KEY, RETRY_AFTER):
+            threading.Thread(target=self._refresh_in_background, name="symbol-index", daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error("Symbol index refresh failed: %s", e)
+
+    def search(self, keywords, asset_type, limit=MAX_RESULTS):
+        """Return up to limit listings matching keywords, best first; [] when nothing (or no index) matches."""
+        table = self._tables.get(asset_type)
+        return table.search(keywords, limit) if table else []
+
+    def asset_type(self, symbol):
+        """"stock" or "crypto" for a listing with exactly this symbol, or None if the index does not have it."""
+        for asset_type, table in self._tables.items():
+            if table.get(symbol.upper()) is not None:
+                return asset_type
+        return None
+
+    def currency(self, symbol):
+        """Currency the listing with exactly this symbol is quoted in, or None if the index does not have it."""
+        for table in self._tables.values():
+            entry = table.get(symbol.upper())
+            if entry is not None:
+                return entry["currency"]
+        return None
@@ -0,0 +1,144 @@
+"""Shared HTTP client for the upstream market-data APIs (FMP and NewsAPI).
+
+One pooled keep-alive session is reused for every call, so repeated requests to the same
+host skip the TCP and TLS handshakes. Calls have connect/read timeouts, retry 429 and 5xx
+responses with jittered exponential backoff, and go through a per-host circuit breaker
+that fails fast while a provider is down so callers can fall back to stale cached data.
+Calls a page is waiting on pass interactive=True: they use a second session that retries
+once, quickly, and never waits out a Retry-After, so one lookup holds a worker for
+seconds rather than the tens of seconds four attempts at a 10 s read timeout could take.
+"""
+
+import os
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import count, span
+
+
+TIMEOUT = (3.05, 10)
+
+# When the UPSTREAM_BASE_URL environment variable is set, every call goes to that origin
+# instead, keeping its path and query: the benchmark suite points it at its stub server.
+
+_RETRY_OPTIONS = dict(
+    total=3,
+    connect=2,
+    read=1,
+    status=3,
+    backoff_factor=0.3,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset({"GET"}),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+# A read timeout is not retried: the page would rather show cached data than wait again.
+_INTERACTIVE_RETRY_OPTIONS = dict(_RETRY_OPTIONS, total=1, connect=1, read=0, status=1, backoff_factor=0.1,
+                                  respect_retry_after_header=False)
+
+
+def _retry(options):
+    try:
+        return Retry(backoff_jitter=0.3, **options)
+    except TypeError:
+        # urllib3 < 2 has no backoff_jitter; fall back to plain exponential backoff.
+        return Retry(**options)
+
+
+RETRY = _retry(_RETRY_OPTIONS)
+INTERACTIVE_RETRY = _retry(_INTERACTIVE_RETRY_OPTIONS)
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling a host whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Open after failure_threshold consecutive failures; allow one trial call after reset_after seconds."""
+
+    def __init__(self, failure_threshold=5, reset_after=30):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_after:
+                # Half-open: let this call through and push the next trial out by another reset_after.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+def _build_session(retry):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+session = _build_session(RETRY)
+interactive_session = _build_session(INTERACTIVE_RETRY)
+breakers = defaultdict(CircuitBreaker)
+
+
+def _is_provider_failure(error):
+    """Timeouts, connection errors, 429 and 5xx count against the breaker; other 4xx do not."""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, requests.RequestException)
+
+
+def get_json(url, timeout=TIMEOUT, interactive=False):
+    """GET url through the shared session and return its decoded JSON body.
+
+    With interactive, the call uses the session with the short retry budget.
+
+    Raises requests.RequestException (CircuitOpenError while the host's breaker is open)
+    or ValueError for a body that isn't JSON.
+    """
+    base_url = os.environ.get("UPSTREAM_BASE_URL")
+    if base_url:
+        parts, base = urllib.parse.urlsplit(url), urllib.parse.urlsplit(base_url)
+        url = urllib.parse.urlunsplit((base.scheme, base.netloc, parts.path, parts.query, ""))
+    host = urllib.parse.urlsplit(url).netloc
+    breaker = breakers[host]
+    if not breaker.allow():
+        count("quantive_upstream_requests_total", host=host, outcome="circuit_open")
+        raise CircuitOpenError(f"circuit open for {host}")
+
+    try:
+        with span("upstream"):
+            response = (interactive_session if interactive else session).get(url, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()
+    except requests.RequestException as e:
+        count("quantive_upstream_requests_total", host=host, outcome="error")
+        if _is_provider_failure(e):
+            breaker.record_failure()
+        raise
+    count("quantive_upstream_requests_total", host=host, outcome="ok")
+    breaker.record_success()
+    return data